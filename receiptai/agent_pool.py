@@ -0,0 +1,203 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Generic,
+    List,
+    Optional,
+    TypedDict,
+    TypeVar,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+# Queries that may wait for a free agent, on top of the ones being answered
+DEFAULT_MAX_QUEUED_QUERIES = 16
+
+# Seconds a query may take, waiting for an agent included
+DEFAULT_QUERY_TIMEOUT_SECONDS = 120.0
+
+
+class PoolRejectedError(Exception):
+    """Raised when a query arrives while the pool and its queue are full."""
+
+
+class PoolMetrics(TypedDict):
+    size: int
+    idle: int
+    running: int
+    queued: int
+    max_queued: int
+    completed: int
+    rejected: int
+    timed_out: int
+
+
+class AgentPool(Generic[T]):
+    """
+    Hands out a fixed set of agents, one query at a time each, in arrival order.
+
+    Each agent owns its own MCP sessions, so queries on different agents never share a
+    stdio pipe. A query that finds every agent busy waits in a bounded queue; once the
+    queue is full further queries are rejected straight away rather than piling up,
+    and every query, waiting included, is bounded by a timeout.
+    """
+
+    def __init__(
+        self,
+        max_queued: int = DEFAULT_MAX_QUEUED_QUERIES,
+        timeout: Optional[float] = DEFAULT_QUERY_TIMEOUT_SECONDS,
+    ):
+        """
+        Initialize an empty pool.
+
+        Args:
+            max_queued: Maximum number of queries waiting for a free agent.
+            timeout: Seconds a query may take, waiting included, or None for no limit.
+        """
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self._agents: List[T] = []
+        self._idle: asyncio.Queue[T] = asyncio.Queue()
+        self._admitted = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+
+    @property
+    def size(self) -> int:
+        return len(self._agents)
+
+    def add(self, agent: T):
+        """
+        Adds an idle agent to the pool.
+
+        Args:
+            agent: The agent, which must not be shared with any other pool.
+        """
+        self._agents.append(agent)
+        self._idle.put_nowait(agent)
+
+    def clear(self):
+        """Removes every agent from the pool; queries still running keep theirs."""
+        self._agents.clear()
+        while not self._idle.empty():
+            self._idle.get_nowait()
+
+    @asynccontextmanager
+    async def _acquire(self) -> AsyncIterator[T]:
+        """
+        Holds the first free agent for the duration of the block.
+
+        The block, waiting for the agent included, is bounded by the timeout, so it must
+        only wait on the agent's work; stream keeps its caller out of it.
+
+        Yields:
+            The agent, which is handed back when the block exits.
+
+        Raises:
+            PoolRejectedError: If every agent is busy and the queue is full.
+            TimeoutError: If the block, waiting included, took longer than the timeout.
+        """
+        if not self._agents:
+            raise PoolRejectedError('The agent pool has no agents')
+        if self._admitted >= self.size + self.max_queued:
+            self._rejected += 1
+            raise PoolRejectedError(
+                f'All {self.size} agents are busy and {self.max_queued} queries are queued'
+            )
+
+        self._admitted += 1
+        try:
+            async with asyncio.timeout(self.timeout):
+                agent = await self._idle.get()
+                try:
+                    yield agent
+                finally:
+                    # An agent removed by clear is not handed out again
+                    if agent in self._agents:
+                        self._idle.put_nowait(agent)
+        except TimeoutError:
+            self._timed_out += 1
+            logger.warning(f'Query timed out after {self.timeout} seconds')
+            raise
+        finally:
+            self._admitted -= 1
+        self._completed += 1
+
+    async def run(self, query: Callable[[T], Awaitable[R]]) -> R:
+        """
+        Runs a query on the first free agent.
+
+        Args:
+            query: Coroutine function that answers the query with the agent it is given.
+
+        Returns:
+            The result of the query.
+
+        Raises:
+            PoolRejectedError: If every agent is busy and the queue is full.
+            TimeoutError: If the query, waiting included, took longer than the timeout.
+        """
+        async with self._acquire() as agent:
+            return await query(agent)
+
+    async def stream(self, query: Callable[[T], AsyncIterator[R]]) -> AsyncIterator[R]:
+        """
+        Runs a streamed query on the first free agent, yielding its items as they come.
+
+        The query runs in a task of its own and its items are buffered, so the timeout
+        bounds the agent's work, waiting included, and not the time the caller spends on
+        each item. Closing the iterator cancels the query and hands the agent back.
+
+        Args:
+            query: Function that streams the query's items from the agent it is given.
+
+        Yields:
+            The items of the query.
+
+        Raises:
+            PoolRejectedError: If every agent is busy and the queue is full.
+            TimeoutError: If the query, waiting included, took longer than the timeout.
+        """
+        items: asyncio.Queue[Any] = asyncio.Queue()
+        finished = object()
+
+        async def produce():
+            async with self._acquire() as agent:
+                async for item in query(agent):
+                    items.put_nowait(item)
+
+        task = asyncio.create_task(produce())
+        task.add_done_callback(lambda _: items.put_nowait(finished))
+        try:
+            while (item := await items.get()) is not finished:
+                yield item
+            # Raises whatever ended the query early
+            task.result()
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    def metrics(self) -> PoolMetrics:
+        """Returns the current load of the pool and its counters since it was created."""
+        idle = self._idle.qsize()
+        running = self.size - idle
+        return PoolMetrics(
+            size=self.size,
+            idle=idle,
+            running=running,
+            queued=max(0, self._admitted - running),
+            max_queued=self.max_queued,
+            completed=self._completed,
+            rejected=self._rejected,
+            timed_out=self._timed_out,
+        )
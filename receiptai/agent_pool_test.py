@@ -0,0 +1,176 @@
+import asyncio
+import unittest
+from contextlib import aclosing
+
+from agent_pool import AgentPool, PoolRejectedError
+
+
+class TestAgentPool(unittest.TestCase):
+    def test_queries_run_concurrently_across_agents(self):
+        async def scenario():
+            pool: AgentPool[str] = AgentPool(max_queued=0)
+            for agent in ['a', 'b']:
+                pool.add(agent)
+            started = asyncio.Event()
+            release = asyncio.Event()
+            running = []
+
+            async def query(agent: str) -> str:
+                running.append(agent)
+                if len(running) == 2:
+                    started.set()
+                await release.wait()
+                return agent
+
+            tasks = [asyncio.create_task(pool.run(query)) for _ in range(2)]
+            await asyncio.wait_for(started.wait(), 1)
+            self.assertEqual(pool.metrics()['running'], 2)
+            release.set()
+            return sorted(await asyncio.gather(*tasks)), pool.metrics()
+
+        results, metrics = asyncio.run(scenario())
+        self.assertEqual(results, ['a', 'b'])
+        self.assertEqual(metrics['idle'], 2)
+        self.assertEqual(metrics['completed'], 2)
+
+    def test_queued_queries_wait_for_a_free_agent(self):
+        async def scenario():
+            pool: AgentPool[str] = AgentPool(max_queued=2)
+            pool.add('a')
+            order = []
+
+            async def query(agent: str) -> int:
+                order.append(len(order))
+                await asyncio.sleep(0)
+                return len(order)
+
+            results = await asyncio.gather(*(pool.run(query) for _ in range(3)))
+            return results, order
+
+        results, order = asyncio.run(scenario())
+        self.assertEqual(results, [1, 2, 3])
+        self.assertEqual(order, [0, 1, 2])
+
+    def test_rejects_when_queue_is_full(self):
+        async def scenario():
+            pool: AgentPool[str] = AgentPool(max_queued=1)
+            pool.add('a')
+            release = asyncio.Event()
+
+            async def query(agent: str):
+                await release.wait()
+
+            running = asyncio.create_task(pool.run(query))
+            queued = asyncio.create_task(pool.run(query))
+            await asyncio.sleep(0)
+            self.assertEqual(pool.metrics()['queued'], 1)
+            with self.assertRaises(PoolRejectedError):
+                await pool.run(query)
+            release.set()
+            await asyncio.gather(running, queued)
+            return pool.metrics()
+
+        metrics = asyncio.run(scenario())
+        self.assertEqual(metrics['rejected'], 1)
+        self.assertEqual(metrics['completed'], 2)
+
+    def test_timeout_returns_agent_to_pool(self):
+        async def scenario():
+            pool: AgentPool[str] = AgentPool(timeout=0.01)
+            pool.add('a')
+
+            async def slow(agent: str):
+                await asyncio.sleep(1)
+
+            async def fast(agent: str) -> str:
+                return agent
+
+            with self.assertRaises(TimeoutError):
+                await pool.run(slow)
+            return await pool.run(fast), pool.metrics()
+
+        result, metrics = asyncio.run(scenario())
+        self.assertEqual(result, 'a')
+        self.assertEqual(metrics['timed_out'], 1)
+        self.assertEqual(metrics['idle'], 1)
+
+    def test_cancelled_stream_returns_agent_to_pool(self):
+        async def scenario():
+            pool: AgentPool[str] = AgentPool()
+            pool.add('a')
+
+            async def query(agent: str):
+                while True:
+                    yield agent
+                    await asyncio.sleep(0)
+
+            async def consume():
+                async with aclosing(pool.stream(query)) as items:
+                    async for _ in items:
+                        await asyncio.sleep(0.01)
+
+            task = asyncio.create_task(consume())
+            await asyncio.sleep(0.02)
+            busy = pool.metrics()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return busy, pool.metrics()
+
+        busy, metrics = asyncio.run(scenario())
+        self.assertEqual(busy['running'], 1)
+        self.assertEqual(metrics['idle'], 1)
+        self.assertEqual(metrics['queued'], 0)
+
+    def test_stream_timeout_mid_stream(self):
+        async def scenario():
+            pool: AgentPool[str] = AgentPool(timeout=0.05)
+            pool.add('a')
+            received = []
+
+            async def query(agent: str):
+                yield 'first'
+                await asyncio.sleep(1)
+                yield 'never'
+
+            with self.assertRaises(TimeoutError):
+                async for item in pool.stream(query):
+                    received.append(item)
+            return received, pool.metrics()
+
+        received, metrics = asyncio.run(scenario())
+        self.assertEqual(received, ['first'])
+        self.assertEqual(metrics['timed_out'], 1)
+        self.assertEqual(metrics['idle'], 1)
+
+    def test_slow_consumer_does_not_time_out_stream(self):
+        async def scenario():
+            pool: AgentPool[str] = AgentPool(timeout=0.05)
+            pool.add('a')
+
+            async def query(agent: str):
+                for index in range(3):
+                    yield index
+
+            received = []
+            async for item in pool.stream(query):
+                await asyncio.sleep(0.04)
+                received.append(item)
+            return received, pool.metrics()
+
+        received, metrics = asyncio.run(scenario())
+        self.assertEqual(received, [0, 1, 2])
+        self.assertEqual(metrics['timed_out'], 0)
+        self.assertEqual(metrics['completed'], 1)
+
+    def test_empty_pool_rejects(self):
+        async def scenario():
+            pool: AgentPool[str] = AgentPool()
+            await pool.run(lambda agent: asyncio.sleep(0))
+
+        with self.assertRaises(PoolRejectedError):
+            asyncio.run(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import base64
+import pathlib
+from typing import Tuple
+from urllib.parse import quote, unquote, urlparse
+
+import mcp.types as types
+
+# Resource URIs of Gmail attachments: gmail-attachment://<email_id>/<part_id>
+ATTACHMENT_URI_SCHEME = 'gmail-attachment'
+
+# Largest attachment embedded in a tool result; bigger ones are only referenced
+MAX_EMBEDDED_ATTACHMENT_BYTES = 5 * 1024 * 1024
+
+
+def attachment_uri(email_id: str, part_id: str) -> str:
+    """
+    Returns the resource URI an attachment can be read from.
+
+    Args:
+        email_id: The Gmail message ID.
+        part_id: The MIME part ID of the attachment, e.g. '1.2'.
+
+    Returns:
+        The attachment URI.
+    """
+    return f'{ATTACHMENT_URI_SCHEME}://{quote(email_id, safe="")}/{quote(part_id, safe="")}'
+
+
+def parse_attachment_uri(uri: str) -> Tuple[str, str]:
+    """
+    Splits an attachment resource URI into its email and part IDs.
+
+    Args:
+        uri: A URI returned by attachment_uri.
+
+    Returns:
+        The email ID and part ID.
+
+    Raises:
+        ValueError: If the URI is not an attachment URI.
+    """
+    parsed = urlparse(uri)
+    part_id = parsed.path.lstrip('/')
+    if parsed.scheme != ATTACHMENT_URI_SCHEME or not parsed.netloc or not part_id:
+        raise ValueError(f'Not an attachment URI: {uri}')
+    return unquote(parsed.netloc), unquote(part_id)
+
+
+def saved_file_uri(path: str) -> str:
+    """
+    Returns the file:// URI of a file saved by a LocalFileSystem.
+
+    Args:
+        path: The absolute path of the saved file.
+
+    Returns:
+        The file URI.
+    """
+    return pathlib.Path(path).as_uri()
+
+
+def embedded_attachment(uri: str, mime_type: str, content: bytes) -> types.EmbeddedResource:
+    """
+    Wraps attachment bytes as an MCP embedded blob resource.
+
+    The bytes travel as resource content next to the tool's text result, so clients
+    can hand them to the user or a file without putting them in the model's context.
+
+    Args:
+        uri: The attachment URI.
+        mime_type: The MIME type of the attachment.
+        content: The attachment bytes.
+
+    Returns:
+        The embedded resource.
+    """
+    return types.EmbeddedResource(
+        type='resource',
+        resource=types.BlobResourceContents(
+            uri=uri,  # type: ignore[arg-type]
+            mimeType=mime_type,
+            blob=base64.b64encode(content).decode('ascii'),
+        ),
+    )
@@ -0,0 +1,35 @@
+import base64
+import unittest
+
+from attachment_resources import (
+    attachment_uri,
+    embedded_attachment,
+    parse_attachment_uri,
+    saved_file_uri,
+)
+
+
+class TestAttachmentResources(unittest.TestCase):
+    def test_uri_round_trip(self):
+        uri = attachment_uri('18f2a9c0b1d2e3f4', '1.2')
+        self.assertEqual(uri, 'gmail-attachment://18f2a9c0b1d2e3f4/1.2')
+        self.assertEqual(parse_attachment_uri(uri), ('18f2a9c0b1d2e3f4', '1.2'))
+
+    def test_rejects_other_uris(self):
+        for uri in ('file:///tmp/a.pdf', 'gmail-attachment://abc', 'gmail-attachment:///1'):
+            with self.assertRaises(ValueError):
+                parse_attachment_uri(uri)
+
+    def test_saved_file_uri(self):
+        self.assertEqual(saved_file_uri('/tmp/receipts/a b.pdf'), 'file:///tmp/receipts/a%20b.pdf')
+
+    def test_embedded_attachment(self):
+        resource = embedded_attachment('gmail-attachment://abc/1', 'application/pdf', b'%PDF-1.4')
+        self.assertEqual(resource.type, 'resource')
+        self.assertEqual(resource.resource.mimeType, 'application/pdf')
+        self.assertEqual(base64.b64decode(resource.resource.blob), b'%PDF-1.4')
+        self.assertEqual(str(resource.resource.uri), 'gmail-attachment://abc/1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import base64
+import re
+from typing import Iterable, Iterator, Union
+
+# Bytes of the response scanned for the start of the data field before giving up
+MAX_FIELD_PREFIX_BYTES = 4096
+
+
+class Base64UrlDecoder:
+    """
+    Incremental decoder for the url-safe base64 Gmail uses for message and attachment data.
+
+    Input may be split at any character; whatever does not complete a 4 character
+    group is carried over to the next call, so each input byte is decoded exactly once.
+    """
+
+    def __init__(self):
+        self._pending = b''
+
+    def feed(self, data: Union[bytes, str]) -> bytes:
+        """
+        Decode the next piece of encoded input.
+
+        Args:
+            data: The encoded text, with or without padding.
+
+        Returns:
+            The bytes decoded from every complete 4 character group seen so far.
+        """
+        if isinstance(data, str):
+            data = data.encode('ascii')
+        data = self._pending + data.rstrip(b'=')
+        complete = len(data) - len(data) % 4
+        self._pending = data[complete:]
+        return base64.urlsafe_b64decode(data[:complete])
+
+    def finish(self) -> bytes:
+        """
+        Decode the final, unpadded group of the input.
+
+        Returns:
+            The remaining decoded bytes.
+
+        Raises:
+            ValueError: If the input length is not a valid base64 length.
+        """
+        pending, self._pending = self._pending, b''
+        if not pending:
+            return b''
+        if len(pending) == 1:
+            raise ValueError('Truncated base64 data')
+        return base64.urlsafe_b64decode(pending + b'=' * (4 - len(pending)))
+
+
+def decode_json_data_field(chunks: Iterable[bytes], field: str = 'data') -> Iterator[bytes]:
+    """
+    Decodes the base64url string field of a streamed JSON response, chunk by chunk.
+
+    Gmail's attachments.get returns {"size": ..., "data": "<base64url>"}. Rather than
+    loading the whole response and its decoded copy into memory, the field value is
+    located in the byte stream and decoded as it arrives. Base64url never contains
+    characters that need JSON escaping, so the value ends at the next double quote.
+
+    Args:
+        chunks: The raw response body, in chunks of any size.
+        field: The name of the string field to decode.
+
+    Yields:
+        The decoded bytes, in order.
+
+    Raises:
+        ValueError: If the field is missing or its value is not terminated.
+    """
+    field_start = re.compile(rb'"' + re.escape(field.encode()) + rb'"\s*:\s*"')
+    decoder = Base64UrlDecoder()
+    prefix = b''
+    in_value = False
+
+    for chunk in chunks:
+        if not in_value:
+            prefix += chunk
+            match = field_start.search(prefix)
+            if match is None:
+                if len(prefix) > MAX_FIELD_PREFIX_BYTES:
+                    raise ValueError(f'Field {field} not found in response')
+                continue
+            in_value = True
+            chunk = prefix[match.end() :]
+            prefix = b''
+
+        end = chunk.find(b'"')
+        if end != -1:
+            decoded = decoder.feed(chunk[:end])
+            if decoded:
+                yield decoded
+            remainder = decoder.finish()
+            if remainder:
+                yield remainder
+            return
+
+        decoded = decoder.feed(chunk)
+        if decoded:
+            yield decoded
+
+    if in_value:
+        raise ValueError(f'Response ended inside field {field}')
+    raise ValueError(f'Field {field} not found in response')
@@ -0,0 +1,61 @@
+import base64
+import json
+import os
+import unittest
+
+from attachment_stream import Base64UrlDecoder, decode_json_data_field
+
+
+def split(data: bytes, size: int):
+    return [data[start : start + size] for start in range(0, len(data), size)]
+
+
+class TestBase64UrlDecoder(unittest.TestCase):
+    def test_decodes_across_arbitrary_splits(self):
+        content = os.urandom(1000)
+        encoded = base64.urlsafe_b64encode(content).rstrip(b'=')
+        for size in (1, 3, 4, 7, 64):
+            decoder = Base64UrlDecoder()
+            decoded = b''.join(decoder.feed(chunk) for chunk in split(encoded, size))
+            self.assertEqual(decoded + decoder.finish(), content)
+
+    def test_accepts_padding_and_str(self):
+        decoder = Base64UrlDecoder()
+        decoded = decoder.feed(base64.urlsafe_b64encode(b'\xfb\xff hi').decode())
+        self.assertEqual(decoded + decoder.finish(), b'\xfb\xff hi')
+
+    def test_truncated_input(self):
+        decoder = Base64UrlDecoder()
+        decoder.feed(b'QUJDR')
+        with self.assertRaises(ValueError):
+            decoder.finish()
+
+
+class TestDecodeJsonDataField(unittest.TestCase):
+    def setUp(self):
+        self.content = b'%PDF-1.4 ' + os.urandom(5000)
+        self.response = json.dumps(
+            {'size': len(self.content), 'data': base64.urlsafe_b64encode(self.content).decode()},
+            indent=2,
+        ).encode()
+
+    def test_decodes_field_from_chunks(self):
+        for size in (1, 5, 100, len(self.response)):
+            decoded = b''.join(decode_json_data_field(split(self.response, size)))
+            self.assertEqual(decoded, self.content)
+
+    def test_yields_incrementally(self):
+        chunks = decode_json_data_field(split(self.response, 1024))
+        self.assertLessEqual(len(next(chunks)), 1024)
+
+    def test_missing_field(self):
+        with self.assertRaises(ValueError):
+            list(decode_json_data_field([b'{"size": 0}']))
+
+    def test_truncated_response(self):
+        with self.assertRaises(ValueError):
+            list(decode_json_data_field([self.response[:200]]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,44 @@
+import asyncio
+import json
 import logging
 import os
-from contextlib import AsyncExitStack
+import time
+from contextlib import AsyncExitStack, aclosing
 from enum import Enum
-from typing import Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, TypedDict
 
+from agent_pool import (
+    DEFAULT_MAX_QUEUED_QUERIES,
+    DEFAULT_QUERY_TIMEOUT_SECONDS,
+    AgentPool,
+    PoolRejectedError,
+)
 from dotenv.main import load_dotenv
 from fastapi import HTTPException, Request
 from langchain_anthropic import ChatAnthropic
+from langchain_core.tools import BaseTool, ToolException
 from langchain_mcp_adapters.client import MultiServerMCPClient, StdioConnection
 from langchain_ollama import ChatOllama
 from langgraph.prebuilt import create_react_agent
-from pydantic import BaseModel
+from mcp.shared.exceptions import McpError
+from pydantic import AnyUrl, BaseModel
+from query_router import ReceiptQuery, answer_receipt_query, parse_receipt_query
+from response_cache import (
+    DEFAULT_MAX_ENTRIES,
+    DEFAULT_TTL_SECONDS,
+    ResponseCache,
+    cache_key,
+    date_requests,
+    normalize_query,
+)
 from templates import EMAIL_SEARCH_TEMPLATE
+from tool_compaction import (
+    DEFAULT_TOOL_HISTORY_TOKEN_BUDGET,
+    DEFAULT_TOOL_MESSAGE_TOKEN_BUDGET,
+    PayloadStore,
+    make_compaction_hook,
+    make_read_tool_output_tool,
+)
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -42,18 +69,107 @@ load_dotenv()
 ENVCONFIG_MODEL = os.environ.get('ENVCONFIG_MODEL', 'llama3.1:8b')
 ENVCONFIG_MODEL = os.environ.get('MODEL_CHOICE', 'local')
 
+# Sets of MCP server processes, each serving one query at a time
+MCP_SESSION_POOL_SIZE = int(os.environ.get('MCP_SESSION_POOL_SIZE', '2'))
+MAX_QUEUED_QUERIES = int(os.environ.get('MAX_QUEUED_QUERIES', str(DEFAULT_MAX_QUEUED_QUERIES)))
+QUERY_TIMEOUT_SECONDS = float(
+    os.environ.get('QUERY_TIMEOUT_SECONDS', str(DEFAULT_QUERY_TIMEOUT_SECONDS))
+)
+
+# Answer structured receipt queries with the Gmail tools directly, without the agent
+QUERY_FAST_PATH = os.environ.get('QUERY_FAST_PATH', '1') != '0'
+
+# Tokens of tool output the agent sees per tool message, and across its history; full
+# outputs stay readable by reference. A message budget of 0 disables compaction
+TOOL_MESSAGE_TOKEN_BUDGET = int(
+    os.environ.get('TOOL_MESSAGE_TOKEN_BUDGET', str(DEFAULT_TOOL_MESSAGE_TOKEN_BUDGET))
+)
+TOOL_HISTORY_TOKEN_BUDGET = int(
+    os.environ.get('TOOL_HISTORY_TOKEN_BUDGET', str(DEFAULT_TOOL_HISTORY_TOKEN_BUDGET))
+)
+
+# Graph nodes reported as steps of a streamed query, and the characters of each tool
+# result a stream shows
+AGENT_NODES = ('agent', 'tools')
+STREAM_TOOL_OUTPUT_CHARS = 500
+
+# Responses kept for repeated queries; a size of 0 disables the cache
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', str(DEFAULT_MAX_ENTRIES)))
+RESPONSE_CACHE_TTL_SECONDS = float(
+    os.environ.get('RESPONSE_CACHE_TTL_SECONDS', str(DEFAULT_TTL_SECONDS))
+)
+
+# Resource each Gmail server reports its scheduler metrics on, and the seconds /status
+# waits for it
+GMAIL_METRICS_URI = 'gmail://metrics'
+STATUS_TIMEOUT_SECONDS = 5.0
+
+# Seconds between checks of the mailbox for changes that invalidate cached responses
+MAILBOX_CHECK_SECONDS = float(os.environ.get('MAILBOX_CHECK_SECONDS', '15'))
+
 
 class ModelChoice(Enum):
     LOCAL = 'local'
     REMOTE = 'remote'
 
 
+class StreamEvent(TypedDict):
+    event: str
+    data: Any
+
+
+class SessionSet(TypedDict):
+    agent: Any
+    tools: Dict[str, BaseTool]
+
+
 class LangGraphClient:
-    def __init__(self):
-        self.session: Optional[MultiServerMCPClient] = None
+    """
+    Answers queries with a LangGraph agent over the Gmail and time MCP servers.
+
+    A stdio MCP session handles one request at a time, so the client starts pool_size
+    sets of server processes, each with its own agent, and concurrent queries are
+    spread over them by an AgentPool. Queries for the receipt of one transaction are
+    answered by calling the tools directly, without a model round trip, and repeated
+    queries are answered from a ResponseCache until the mailbox changes. Tool results
+    are compacted to a token budget before each model call, so long searches do not
+    inflate every later turn.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = MCP_SESSION_POOL_SIZE,
+        max_queued: int = MAX_QUEUED_QUERIES,
+        timeout: float = QUERY_TIMEOUT_SECONDS,
+        fast_path: bool = QUERY_FAST_PATH,
+        response_cache: Optional[ResponseCache] = None,
+    ):
+        """
+        Initialize the client; connect_to_server starts the servers.
+
+        Args:
+            pool_size: Number of MCP session sets, and so of queries answered at once.
+            max_queued: Maximum number of queries waiting for a free session set.
+            timeout: Seconds a query may take, waiting included.
+            fast_path: Answer structured receipt queries without the agent.
+            response_cache: The cache of responses to repeated queries.
+        """
+        if pool_size < 1:
+            raise ValueError(f'pool_size must be at least 1, got {pool_size}')
+        self.pool_size = pool_size
+        self.sessions: List[MultiServerMCPClient] = []
         self.exit_stack = AsyncExitStack()
-        self.mcpClient = None
-        self.agent = None
+        self.pool: AgentPool[SessionSet] = AgentPool(max_queued=max_queued, timeout=timeout)
+        self.fast_path = fast_path
+        self.response_cache = response_cache or ResponseCache(
+            max_entries=RESPONSE_CACHE_SIZE, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS
+        )
+        # The task checking the mailbox in the background, and when the last successful
+        # check started
+        self._mailbox_checks: Optional[asyncio.Task[None]] = None
+        self._mailbox_checked_at: Optional[float] = None
+        # Full tool results the agents saw compacted, shared by every session set
+        self.payload_store = PayloadStore()
         self.initialised = False
 
         if ENVCONFIG_MODEL == ModelChoice.LOCAL:
@@ -99,87 +215,395 @@ class LangGraphClient:
             'encoding': 'utf-8',
         }
 
-        client = await self.exit_stack.enter_async_context(
-            MultiServerMCPClient({'gmail': GmailMcpOpts, 'time': TimeMcpOpts})
-        )
+        # One at a time, as each client must be closed by the task that opened it
+        for _ in range(self.pool_size):
+            client = await self.exit_stack.enter_async_context(
+                MultiServerMCPClient({'gmail': GmailMcpOpts, 'time': TimeMcpOpts})
+            )
+            self.sessions.append(client)
+            # The agent's tools are bound to this client's sessions
+            tools = client.get_tools()
+            self.pool.add(
+                SessionSet(
+                    agent=self._create_agent(tools),
+                    tools={tool.name: tool for tool in tools},
+                )
+            )
 
-        self.session = client
-        response = client.get_tools()
-        self.agent = create_react_agent(self.model, client.get_tools())
+        logger.info(
+            'Connected %d session sets to servers with tools: %s',
+            self.pool_size,
+            [tool.name for tool in self.sessions[0].get_tools()],
+        )
 
-        # self.session is guaranteed to be non-None at this point
-        assert self.session is not None, 'Session should be initialised'
+        if self.response_cache.max_entries > 0:
+            self._mailbox_checks = asyncio.create_task(self._check_mailbox_periodically())
+        self.initialised = True
 
-        logger.info('Connected to server with tools: %s', [tool.name for tool in response])
+    def _create_agent(self, tools: List[BaseTool]) -> Any:
+        """Create an agent over the tools, compacting their results unless disabled"""
+        if TOOL_MESSAGE_TOKEN_BUDGET <= 0:
+            return create_react_agent(self.model, tools)
+        return create_react_agent(
+            self.model,
+            [*tools, make_read_tool_output_tool(self.payload_store, TOOL_MESSAGE_TOKEN_BUDGET)],
+            pre_model_hook=make_compaction_hook(
+                self.payload_store, TOOL_MESSAGE_TOKEN_BUDGET, TOOL_HISTORY_TOKEN_BUDGET
+            ),
+        )
 
-        self.initialised = True
+    async def process_query(self, query: str, use_cache: bool = True) -> str:
+        """Process a query, from the response cache if it was answered recently
 
-    async def process_query(self, query: str) -> str:
-        """Process a query using LangGraph agent and available tools"""
+        Args:
+            query: The user's query
+            use_cache: Look the query up in the response cache; the answer is cached
+                either way, if the mailbox could be checked
+        """
         if not self.initialised:
             raise ValueError('LangGraph Client is not initialised yet')
 
-        assert self.session is not None, 'Session should be initialised when client is initialised'
-        assert self.agent is not None, 'Agent should be initialised when client is initialised'
+        # Resolving the cache key and answering share one deadline, the pool's timeout
+        async with asyncio.timeout(self.pool.timeout):
+            key, cached_response = await self._look_up_cache(query, use_cache)
+            if cached_response is not None:
+                logger.info('Answered query from the response cache')
+                return cached_response
+
+            response = await self._answer_query(query)
+        if key is not None and _is_json(response):
+            self.response_cache.put(key, response)
+        return response
+
+    async def _look_up_cache(
+        self, query: str, use_cache: bool
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Looks a query up in the response cache.
+
+        The mailbox is checked in the background, so the lookup never waits for a check;
+        while no recent check succeeded the cache is bypassed.
 
-        prompt = f"{EMAIL_SEARCH_TEMPLATE} \n Here is the user's query: {query}"
+        Returns:
+            The key to cache the query's response under, or None if it must not be cached
+            as its dates or the mailbox state are unknown, and the cached response, if
+            use_cache and there is one
+        """
+        if not self._mailbox_state_known():
+            return None, None
+        key = await self._cache_key(query)
+        if key is None:
+            return None, None
+        return key, self.response_cache.get(key) if use_cache else None
+
+    async def _cache_key(self, query: str) -> Optional[str]:
+        """The cache key of a query, with its relative dates resolved by the time server."""
+        if self.response_cache.max_entries <= 0:
+            return None
+        normalized_query = normalize_query(query)
+        requests = date_requests(normalized_query)
+        if not requests:
+            return cache_key(normalized_query, [])
+
+        async def resolve(sessions: SessionSet) -> List[str]:
+            return [
+                await sessions['tools']['get_date'].ainvoke(arguments) for arguments in requests
+            ]
+
+        try:
+            # Through the pool, like any query: admitted, bounded and on a free session set
+            time_windows = await self.pool.run(resolve)
+        except (KeyError, ToolException) as e:
+            logger.warning('Could not resolve the dates of a query, not caching it: %s', e)
+            return None
+        return cache_key(normalized_query, time_windows)
+
+    def _mailbox_state_known(self) -> bool:
+        """
+        Whether the mailbox was checked recently enough for responses to be cached and
+        served.
 
-        # Call the agent
-        agent_response = await self.agent.ainvoke(
-            {'messages': [{'role': 'user', 'content': prompt}]}
+        A check may take a while, so the last one counts until the one after it is overdue.
+        """
+        return (
+            self._mailbox_checked_at is not None
+            and time.monotonic() - self._mailbox_checked_at < 2 * MAILBOX_CHECK_SECONDS
         )
 
-        # Extract the final response text from the agent response
-        # The last message contains the AIMessage object
-        ai_message = agent_response['messages'][-1]
-
-        # Handle different content formats
-        final_response = ''
-        if hasattr(ai_message, 'content'):
-            content = ai_message.content
-            # Check if content is a string
-            if isinstance(content, str):
-                final_response = content
-            # Check if content is a list of content blocks
-            elif isinstance(content, list):
-                # Concatenate text blocks
-                for block in content:
-                    if isinstance(block, dict) and block.get('type') == 'text':
-                        final_response += block.get('text', '')
-
-            # If the response is not JSON, try to extract JSON from it
-            if not final_response.startswith('{'):
-                # Try to find JSON in the response
-                import re
-
-                json_match = re.search(r'({.*})', final_response, re.DOTALL)
-                if json_match:
-                    final_response = json_match.group(1)
-        else:
-            # Fallback: try to access content as a property or method
+    async def _check_mailbox_periodically(self):
+        """
+        Syncs the mailbox every MAILBOX_CHECK_SECONDS, so that the response cache drops
+        its entries once new mail has arrived.
+        """
+        while True:
             try:
-                if callable(getattr(ai_message, 'text', None)):
-                    final_response = ai_message.text()
-                elif hasattr(ai_message, 'text'):
-                    final_response = ai_message.text
-                else:
-                    logger.warning('Unexpected response format, trying to convert to string')
-                    final_response = str(ai_message)
+                await self._sync_mailbox()
             except Exception as e:
-                logger.error(f'Error extracting content from response: {e}')
-                final_response = str(ai_message)
+                logger.error('Error checking the mailbox: %s', e)
+            await asyncio.sleep(MAILBOX_CHECK_SECONDS)
+
+    async def _sync_mailbox(self) -> bool:
+        """Syncs the mailbox on a free session set and reports the result to the cache"""
+        started_at = time.monotonic()
+        try:
+            sync_result = json.loads(
+                await self.pool.run(lambda sessions: sessions['tools']['sync-mailbox'].ainvoke({}))
+            )
+            messages_changed = bool(
+                sync_result['full_sync'] or sync_result['added'] or sync_result['deleted']
+            )
+            self.response_cache.observe_sync(str(sync_result['history_id']), messages_changed)
+        except (
+            KeyError,
+            TypeError,
+            ValueError,
+            ToolException,
+            PoolRejectedError,
+            TimeoutError,
+        ) as e:
+            logger.warning('Could not check the mailbox, bypassing the response cache: %s', e)
+            return False
+        self._mailbox_checked_at = started_at
+        return True
+
+    async def _answer_query(self, query: str) -> str:
+        """Answer a query with the fast path or the agent, whichever fits it"""
+        receipt_query = parse_receipt_query(query) if self.fast_path else None
+        if receipt_query is not None:
+            response = await self._answer_receipt_query(receipt_query)
+            if response is not None:
+                return response
+
+        # Call the first free agent; raises PoolRejectedError or TimeoutError under load
+        agent_response = await self.pool.run(
+            lambda sessions: sessions['agent'].ainvoke(_agent_input(query))
+        )
+
+        return extract_response_text(agent_response['messages'][-1])
 
-        return final_response
+    async def _answer_receipt_query(self, receipt_query: ReceiptQuery) -> Optional[str]:
+        """Answer a receipt query with the tools directly, or None to leave it to the agent"""
+        logger.info('Answering receipt query without the agent: %s', receipt_query)
+
+        async def answer(sessions: SessionSet) -> Optional[Dict[str, Any]]:
+            tools = sessions['tools']
+            return await answer_receipt_query(
+                receipt_query, lambda name, arguments: tools[name].ainvoke(arguments)
+            )
+
+        try:
+            response = await self.pool.run(answer)
+        except (ToolException, ValueError) as e:
+            # A tool error is left to the agent, which can retry or rephrase
+            logger.warning('Receipt query failed, falling back to the agent: %s', e)
+            return None
+        if response is None:
+            logger.info('No confident answer to the receipt query, falling back to the agent')
+            return None
+        return json.dumps(response)
+
+    async def stream_query(self, query: str, use_cache: bool = True) -> AsyncIterator[StreamEvent]:
+        """Process a query, reporting the agent's steps, tool calls and tokens as they happen
+
+        The run holds its session set until the iteration ends, so closing the iterator,
+        as a disconnecting client does, cancels the run.
+
+        Args:
+            query: The user's query
+            use_cache: Look the query up in the response cache; the answer is cached
+                either way, if the mailbox could be checked
+
+        Yields:
+            Progress events, then one result event with the response text
+        """
+        if not self.initialised:
+            raise ValueError('LangGraph Client is not initialised yet')
+
+        # Resolving the cache key and the fast path share one deadline, the pool's timeout
+        deadline = None
+        if self.pool.timeout is not None:
+            deadline = asyncio.get_running_loop().time() + self.pool.timeout
+
+        async with asyncio.timeout_at(deadline):
+            key, cached_response = await self._look_up_cache(query, use_cache)
+        if cached_response is not None:
+            yield StreamEvent(event='route', data={'route': 'cache'})
+            yield StreamEvent(event='result', data=cached_response)
+            return
+
+        response = None
+        receipt_query = parse_receipt_query(query) if self.fast_path else None
+        if receipt_query is not None:
+            yield StreamEvent(event='route', data={'route': 'receipt', 'query': receipt_query})
+            async with asyncio.timeout_at(deadline):
+                response = await self._answer_receipt_query(receipt_query)
+
+        if response is None:
+            yield StreamEvent(event='route', data={'route': 'agent'})
+            final_state = None
+            # The pool's timeout bounds the agent, not the time the caller takes per event
+            async with aclosing(
+                self.pool.stream(
+                    lambda sessions: sessions['agent'].astream_events(
+                        _agent_input(query), version='v2'
+                    )
+                )
+            ) as events:
+                async for event in events:
+                    stream_event = to_stream_event(event)
+                    if stream_event is not None:
+                        yield stream_event
+                    # The graph's own end event, which has no parent, carries the final state
+                    if event['event'] == 'on_chain_end' and not event.get('parent_ids'):
+                        final_state = event['data'].get('output')
+            if not final_state or not final_state.get('messages'):
+                raise ValueError('The agent finished without a response')
+            response = extract_response_text(final_state['messages'][-1])
+
+        if key is not None and _is_json(response):
+            self.response_cache.put(key, response)
+        yield StreamEvent(event='result', data=response)
+
+    async def gmail_metrics(self) -> List[Optional[Dict[str, Any]]]:
+        """Read the Gmail scheduler metrics of each session set's Gmail server
+
+        Metrics are read alongside any query the session set is answering, as a server
+        handles requests concurrently, so they do not wait for the pool.
+
+        Returns:
+            The metrics of each session set, or None where they could not be read
+        """
+
+        async def read(client: MultiServerMCPClient) -> Optional[Dict[str, Any]]:
+            try:
+                async with asyncio.timeout(STATUS_TIMEOUT_SECONDS):
+                    result = await client.sessions['gmail'].read_resource(AnyUrl(GMAIL_METRICS_URI))
+                return json.loads(getattr(result.contents[0], 'text', ''))
+            except (KeyError, IndexError, ValueError, TimeoutError, McpError) as e:
+                logger.warning('Could not read the Gmail scheduler metrics: %s', e)
+                return None
+
+        return list(await asyncio.gather(*(read(client) for client in self.sessions)))
 
     async def cleanup(self):
         """Clean up resources"""
         if self.initialised:
+            self.pool.clear()
+            if self._mailbox_checks is not None:
+                self._mailbox_checks.cancel()
+                self._mailbox_checks = None
             await self.exit_stack.aclose()
-            self.session = None
-            self.agent = None
+            self.sessions = []
             self.initialised = False
 
 
+def _agent_input(query: str) -> Dict[str, Any]:
+    prompt = f"{EMAIL_SEARCH_TEMPLATE} \n Here is the user's query: {query}"
+    return {'messages': [{'role': 'user', 'content': prompt}]}
+
+
+def _message_text(content: Any) -> str:
+    """The text of message content that is a string or a list of content blocks"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return ''.join(
+            block.get('text', '')
+            for block in content
+            if isinstance(block, dict) and block.get('type') == 'text'
+        )
+    return ''
+
+
+def to_stream_event(event: Dict[str, Any]) -> Optional[StreamEvent]:
+    """Convert a LangGraph astream_events (v2) event to a stream event for the client
+
+    Args:
+        event: The LangGraph event
+
+    Returns:
+        The stream event, or None for events the client is not told about
+    """
+    kind = event['event']
+    name = event.get('name', '')
+    data = event.get('data', {})
+    if kind == 'on_chain_start' and name in AGENT_NODES:
+        if event.get('metadata', {}).get('langgraph_node') == name:
+            return StreamEvent(
+                event='step',
+                data={'node': name, 'step': event['metadata'].get('langgraph_step')},
+            )
+    elif kind == 'on_chat_model_stream':
+        text = _message_text(getattr(data.get('chunk'), 'content', None))
+        if text:
+            return StreamEvent(event='token', data={'text': text})
+    elif kind == 'on_tool_start':
+        return StreamEvent(event='tool_start', data={'name': name, 'input': data.get('input')})
+    elif kind == 'on_tool_end':
+        output = data.get('output')
+        text = _message_text(getattr(output, 'content', output))
+        if len(text) > STREAM_TOOL_OUTPUT_CHARS:
+            text = text[:STREAM_TOOL_OUTPUT_CHARS] + '…'
+        return StreamEvent(event='tool_end', data={'name': name, 'output': text})
+    return None
+
+
+def extract_response_text(ai_message: Any) -> str:
+    """Extract the final response text from the last message of the agent
+
+    Args:
+        ai_message: The AIMessage the agent finished with
+
+    Returns:
+        The response text, narrowed to the JSON object in it if there is one
+    """
+    # Handle different content formats
+    final_response = ''
+    if hasattr(ai_message, 'content'):
+        content = ai_message.content
+        # Check if content is a string
+        if isinstance(content, str):
+            final_response = content
+        # Check if content is a list of content blocks
+        elif isinstance(content, list):
+            # Concatenate text blocks
+            for block in content:
+                if isinstance(block, dict) and block.get('type') == 'text':
+                    final_response += block.get('text', '')
+
+        # If the response is not JSON, try to extract JSON from it
+        if not final_response.startswith('{'):
+            # Try to find JSON in the response
+            import re
+
+            json_match = re.search(r'({.*})', final_response, re.DOTALL)
+            if json_match:
+                final_response = json_match.group(1)
+    else:
+        # Fallback: try to access content as a property or method
+        try:
+            if callable(getattr(ai_message, 'text', None)):
+                final_response = ai_message.text()
+            elif hasattr(ai_message, 'text'):
+                final_response = ai_message.text
+            else:
+                logger.warning('Unexpected response format, trying to convert to string')
+                final_response = str(ai_message)
+        except Exception as e:
+            logger.error(f'Error extracting content from response: {e}')
+            final_response = str(ai_message)
+
+    return final_response
+
+
+def _is_json(response: str) -> bool:
+    try:
+        json.loads(response)
+    except json.JSONDecodeError:
+        return False
+    return True
+
+
 def get_langchain_client(request: Request) -> LangGraphClient:
     """Get the LangGraph client from the app state."""
     if not hasattr(request.app, 'langgraph_client'):
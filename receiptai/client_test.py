@@ -0,0 +1,87 @@
+import asyncio
+import json
+import time
+import unittest
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+from client import LangGraphClient, SessionSet
+
+RESPONSE = json.dumps({'count': '0', 'results': []})
+
+
+class FakeTool:
+    def __init__(self, respond):
+        self.respond = respond
+        self.calls: List[Dict[str, Any]] = []
+
+    async def ainvoke(self, arguments: Dict[str, Any]) -> Any:
+        self.calls.append(arguments)
+        return await self.respond(arguments)
+
+
+class FakeAgent:
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.queries = 0
+
+    async def ainvoke(self, agent_input: Dict[str, Any]) -> Dict[str, Any]:
+        self.queries += 1
+        await asyncio.sleep(self.delay)
+        return {'messages': [SimpleNamespace(content=RESPONSE)]}
+
+
+class TestLangGraphClient(unittest.IsolatedAsyncioTestCase):
+    def make_client(self, agent: FakeAgent, timeout: float = 5) -> LangGraphClient:
+        self.sync_started = asyncio.Event()
+        self.sync_release = asyncio.Event()
+
+        async def sync_mailbox(arguments: Dict[str, Any]) -> str:
+            self.sync_started.set()
+            await self.sync_release.wait()
+            return json.dumps({'full_sync': True, 'added': 1, 'deleted': 0, 'history_id': '1'})
+
+        async def get_date(arguments: Dict[str, Any]) -> str:
+            await asyncio.sleep(self.get_date_delay)
+            return '2025-04-21 to 2025-04-27'
+
+        self.get_date_delay = 0.0
+        client = LangGraphClient(pool_size=2, timeout=timeout, fast_path=False)
+        self.sync_tool = FakeTool(sync_mailbox)
+        tools = {'sync-mailbox': self.sync_tool, 'get_date': FakeTool(get_date)}
+        for _ in range(client.pool_size):
+            client.pool.add(SessionSet(agent=agent, tools=tools))  # type: ignore[typeddict-item]
+        client._mailbox_checks = asyncio.create_task(client._check_mailbox_periodically())
+        client.initialised = True
+        self.addAsyncCleanup(client.cleanup)
+        return client
+
+    async def test_queries_do_not_wait_for_the_mailbox_check(self):
+        agent = FakeAgent()
+        client = self.make_client(agent)
+        await self.sync_started.wait()
+
+        # The first sync is still running, so the query is answered without the cache
+        self.assertEqual(await asyncio.wait_for(client.process_query('find invoices'), 1), RESPONSE)
+        self.assertEqual(client.response_cache.metrics()['entries'], 0)
+
+        self.sync_release.set()
+        while client._mailbox_checked_at is None:
+            await asyncio.sleep(0)
+        await client.process_query('find invoices')
+        await client.process_query('find invoices')
+        self.assertEqual(agent.queries, 2)
+        self.assertEqual(client.response_cache.metrics()['hits'], 1)
+        self.assertEqual(len(self.sync_tool.calls), 1)
+
+    async def test_query_has_one_deadline(self):
+        client = self.make_client(FakeAgent(delay=0.15), timeout=0.25)
+        client._mailbox_checked_at = time.monotonic()
+        # Resolving the dates and answering each fit the timeout, but not together
+        self.get_date_delay = 0.15
+        with self.assertRaises(TimeoutError):
+            await client.process_query('find invoices from last week')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
-from typing import List
-from pydantic import BaseModel
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from pydantic import BaseModel, PrivateAttr
 from datetime import datetime
 
 class Email(BaseModel):
@@ -10,6 +10,66 @@ class Email(BaseModel):
     from_email: str
     to_email: str
     date: datetime
+    snippet: str = ''
+
+class BodyNotLoadedError(RuntimeError):
+    """Raised when the body of a LazyEmail is used before it was loaded."""
+
+class LazyEmail(Email):
+    """
+    An Email built from message metadata whose body is only downloaded on request.
+
+    The body has to be loaded with await load_body(), or GmailService.load_bodies() for
+    many emails at once, before it is read or the email is serialized; until then both
+    raise BodyNotLoadedError rather than block on a download or leave the body out.
+    """
+
+    _aload_body: Optional[Callable[[], Awaitable[str]]] = PrivateAttr(default=None)
+
+    @classmethod
+    def from_metadata(cls, aload_body: Callable[[], Awaitable[str]], **fields: Any) -> 'LazyEmail':
+        """
+        Create an email without a body.
+
+        Args:
+            aload_body: Coroutine function returning the body.
+            fields: The other Email fields.
+        """
+        email = cls.model_validate({**fields, 'body': ''})
+        del email.__dict__['body']
+        email._aload_body = aload_body
+        return email
+
+    @property
+    def body_loaded(self) -> bool:
+        return 'body' in self.__dict__
+
+    async def load_body(self) -> str:
+        """Download the body if it has not been loaded yet and return it."""
+        if not self.body_loaded:
+            assert self._aload_body is not None, 'LazyEmail created without a body loader'
+            self.__dict__['body'] = await self._aload_body()
+        return self.__dict__['body']
+
+    def _require_body(self, exclude: Any = None):
+        if not self.body_loaded and not (exclude and 'body' in exclude):
+            raise BodyNotLoadedError(
+                f'The body of email {self.id} is not loaded; await load_body() first'
+            )
+
+    def model_dump(self, **kwargs: Any) -> Dict[str, Any]:
+        self._require_body(kwargs.get('exclude'))
+        return super().model_dump(**kwargs)
+
+    def model_dump_json(self, **kwargs: Any) -> str:
+        self._require_body(kwargs.get('exclude'))
+        return super().model_dump_json(**kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called when body has not been loaded into the instance dict yet
+        if name == 'body':
+            self._require_body()
+        return super().__getattr__(name)
 
 class Attachment(BaseModel):
     filename: str
@@ -33,12 +93,14 @@ class EmailInterface(ABC):
         pass
 
     @abstractmethod
-    async def search_emails(self, query: str) -> List[Email]:
+    async def search_emails(self, query: str, metadata_only: bool = False) -> List[Email]:
         """
         Searches emails based on a query string.
 
         Args:
             query: The search query string
+            metadata_only: Return emails built from headers and snippet whose body has
+                to be loaded before use, instead of downloading every full message
 
         Returns:
             A list of email objects that match the search criteria
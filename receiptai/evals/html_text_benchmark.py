@@ -0,0 +1,110 @@
+"""
+Benchmarks html_text.html_to_text against the BeautifulSoup converter it replaced, on the
+HTML bodies of the sample emails in evals/emails.
+
+Usage: make bench-html
+"""
+
+import email
+import statistics
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple, cast
+
+from bs4 import BeautifulSoup, Tag
+from bs4.element import NavigableString
+from html_text import html_to_text
+
+EMAILS_DIR = Path(__file__).parent / 'emails'
+ROUNDS = 20
+
+
+def beautifulsoup_html_to_text(html: str) -> str:
+    """
+    The BeautifulSoup converter html_text replaced, kept as the benchmark baseline.
+
+    It re-extracts the text of every nested block element, so nested layouts are quadratic.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Remove script and style elements
+    for script in soup(['script', 'style']):
+        script.extract()
+
+    # Handle links - preserve URL information by replacing with "[text](url)"
+    for link_element in soup.find_all('a'):
+        link = cast(Tag, link_element)
+        href = link.get('href')
+        if href:
+            link_text = link.get_text(strip=True) or href
+            replacement_string = f'{link_text} {href}'
+            link.replace_with(NavigableString(replacement_string))
+
+    # Extract text with better formatting
+    lines = []
+    for element_raw in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'div', 'li']):
+        element = cast(Tag, element_raw)
+        text = element.get_text(strip=True)
+        if text:
+            if element.name.startswith('h'):
+                level = int(element.name[1])
+                if level == 1:
+                    lines.append(f'\n{"=" * len(text)}\n{text}\n{"=" * len(text)}')
+                elif level == 2:
+                    lines.append(f'\n{text}\n{"-" * len(text)}')
+                else:
+                    lines.append(f'\n{text}')
+            elif element.name == 'li':
+                lines.append(f'• {text}')
+            else:
+                lines.append(text)
+
+    # If no structured elements found, fall back to regular text extraction
+    if not lines:
+        lines = soup.get_text(separator='\n', strip=True).split('\n')
+
+    # Filter out empty lines and join with double newlines for paragraph separation
+    return '\n'.join(line for line in lines if line.strip())
+
+
+def load_html_bodies() -> List[Tuple[str, str]]:
+    """Returns the name and first text/html part of every sample email."""
+    bodies = []
+    for eml_file in sorted(EMAILS_DIR.glob('*.eml')):
+        with open(eml_file, 'rb') as f:
+            msg = email.message_from_binary_file(f)
+        for part in msg.walk():
+            if part.get_content_type() == 'text/html':
+                payload = part.get_payload(decode=True)
+                if isinstance(payload, bytes):
+                    bodies.append((eml_file.name, payload.decode(errors='replace')))
+                break
+    return bodies
+
+
+def time_converter(converter: Callable[[str], str], html: str) -> float:
+    """Returns the median time in milliseconds of converting html ROUNDS times."""
+    timings = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        converter(html)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    print(f'{"email":<10}{"html bytes":>12}{"bs4 ms":>10}{"html_text ms":>14}{"speedup":>10}')
+    total_old = total_new = 0.0
+    for name, html in load_html_bodies():
+        old = time_converter(beautifulsoup_html_to_text, html)
+        new = time_converter(html_to_text, html)
+        total_old += old
+        total_new += new
+        print(f'{name:<10}{len(html):>12}{old:>10.2f}{new:>14.2f}{old / new:>9.1f}x')
+    print(
+        f'{"total":<10}{"":>12}{total_old:>10.2f}{total_new:>14.2f}{total_old / total_new:>9.1f}x'
+    )
+
+
+if __name__ == '__main__':
+    main()
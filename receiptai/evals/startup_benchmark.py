@@ -0,0 +1,72 @@
+"""
+Measures how long the Gmail MCP server takes from spawn to its first tool list, the
+way LangGraphClient.connect_to_server starts it, and how much of that is imports.
+
+Usage: make bench-startup
+"""
+
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+SERVER_SCRIPT = Path(__file__).parent.parent / 'gmail_mcp.py'
+ROUNDS = 5
+
+
+def server_env() -> dict:
+    """The environment of the server; the Gmail paths only need to be set, not valid."""
+    env = dict(os.environ)
+    env.setdefault('CREDS_FILE_PATH', 'creds/credentials.json')
+    env.setdefault('TOKEN_JSON_PATH', 'creds/token.json')
+    env['PYTHONPATH'] = str(SERVER_SCRIPT.parent)
+    return env
+
+
+async def time_to_first_tool_list() -> float:
+    """Returns the seconds from spawning the server to receiving its tool list."""
+    params = StdioServerParameters(
+        command=sys.executable, args=[str(SERVER_SCRIPT)], env=server_env()
+    )
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull:
+        async with stdio_client(params, errlog=devnull) as (read_stream, write_stream):
+            async with ClientSession(read_stream, write_stream) as session:
+                await session.initialize()
+                await session.list_tools()
+                return time.perf_counter() - start
+
+
+def time_import(module: str) -> float:
+    """Returns the seconds a fresh interpreter takes to import a module."""
+    code = f'import time; s = time.perf_counter(); import {module}; print(time.perf_counter() - s)'
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        env=server_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(result.stdout.strip())
+
+
+def main():
+    timings: List[float] = []
+    for _ in range(ROUNDS):
+        timings.append(asyncio.run(time_to_first_tool_list()))
+    print(f'time to first tool list: {statistics.median(timings) * 1000:.0f} ms (median)')
+
+    for module in ['gmail_mcp', 'gmail_service']:
+        median = statistics.median(time_import(module) for _ in range(ROUNDS))
+        print(f'import {module}: {median * 1000:.0f} ms (median)')
+
+
+if __name__ == '__main__':
+    main()
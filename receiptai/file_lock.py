@@ -0,0 +1,57 @@
+import fcntl
+import os
+import threading
+from types import TracebackType
+from typing import Optional, Type
+
+
+class FileLock:
+    """
+    An exclusive lock shared by every thread and process that opens the same lock file.
+
+    Threads of one process are serialized by an in-process lock, and processes by an
+    advisory flock on the file, so on-disk stores can be shared by several processes.
+    The lock is released when its holder exits, even if it crashes. The lock file is
+    created the first time the lock is taken.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the lock.
+
+        Args:
+            path: The path of the lock file.
+        """
+        self.path = os.path.abspath(path)
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+
+    def _open(self) -> int:
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        return self._fd
+
+    def __enter__(self) -> 'FileLock':
+        self._lock.acquire()
+        try:
+            fcntl.flock(self._open(), fcntl.LOCK_EX)
+        except BaseException:
+            self._lock.release()
+            raise
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ):
+        fcntl.flock(self._open(), fcntl.LOCK_UN)
+        self._lock.release()
+
+    def close(self):
+        """Close the lock file."""
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
@@ -1,34 +1,86 @@
+import asyncio
 import base64
+import functools
+import hashlib
+import itertools
+import json
 import logging
+import mmap
 import os
+import shutil
+import tempfile
+import threading
 from abc import ABC, abstractmethod
-from typing import Dict, Union
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, TypedDict, TypeVar, Union
 
+from file_lock import FileLock
 from pydantic import BaseModel
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+T = TypeVar('T')
+
+# Bytes read at a time when a file is iterated, e.g. to stream it into an upload
+DEFAULT_READ_CHUNK_BYTES = 256 * 1024
+
+# File system calls an AsyncFileSystem runs at once, each on its own worker thread
+DEFAULT_MAX_CONCURRENT_FILE_OPERATIONS = 8
+
+
 class AttachmentResponse(BaseModel):
     filename: str
     mimeType: str
     data: Union[bytes, str]
 
 
+class ManifestEntry(TypedDict):
+    sha256: str
+    mime_type: str
+    size: int
+
+
 class FileSystem(ABC):
     """
     Abstract base class for a file system.
     """
 
+    # Whether saving under a name that is already taken keeps both contents, so callers
+    # do not need to pick unique names themselves
+    deduplicates: bool = False
+
     @abstractmethod
-    def save_file(self, filename: str, mimeType: str, data: Union[bytes, str]) -> str:
+    def save_file(
+        self, filename: str, mimeType: str, data: Union[bytes, str], overwrite: bool = True
+    ) -> str:
         """
         Saves the given content against the filename.
         Args:
             filename: The path to save the file to.
             mimeType: The MIME type of the data.
             data: The data to save.  Must be bytes or a string.
+            overwrite: Replace an existing file of the same name, rather than saving
+                under a free name next to it.
+        Returns:
+            The path to the saved file.
+        """
+        pass
+
+    @abstractmethod
+    def save_stream(
+        self, filename: str, mimeType: str, chunks: Iterable[bytes], overwrite: bool = True
+    ) -> str:
+        """
+        Saves content that arrives in chunks, without holding all of it in memory.
+        Args:
+            filename: The path to save the file to.
+            mimeType: The MIME type of the data.
+            chunks: The decoded content, in order.
+            overwrite: Replace an existing file of the same name, rather than saving
+                under a free name next to it.
         Returns:
             The path to the saved file.
         """
@@ -47,6 +99,61 @@ class FileSystem(ABC):
         """
         pass
 
+    def _retrieve_bytes(self, filename: str) -> bytes:
+        data = self.retrieve_file(filename)
+        return data if isinstance(data, bytes) else data.encode('utf-8')
+
+    def read_range(self, filename: str, offset: int = 0, length: Optional[int] = None) -> bytes:
+        """
+        Reads part of a file.
+
+        This default reads the whole file; implementations that can seek override it.
+        Args:
+            filename: The path to the file to read.
+            offset: The position of the first byte to read.
+            length: The maximum number of bytes to read, or None to read to the end.
+        Returns:
+            The bytes read, fewer than length if the file ends first.
+        Raises:
+            FileNotFoundError: If the file does not exist.
+        """
+        data = self._retrieve_bytes(filename)
+        return data[offset:] if length is None else data[offset : offset + length]
+
+    def iter_file(
+        self, filename: str, chunk_size: int = DEFAULT_READ_CHUNK_BYTES
+    ) -> Iterator[bytes]:
+        """
+        Reads a file in chunks, e.g. to stream it into an upload.
+
+        This default reads the whole file; implementations that can stream override it.
+        Args:
+            filename: The path to the file to read.
+            chunk_size: The maximum size of each chunk.
+        Returns:
+            An iterator over the content, in order.
+        Raises:
+            FileNotFoundError: If the file does not exist.
+        """
+        data = self._retrieve_bytes(filename)
+        return (data[start : start + chunk_size] for start in range(0, len(data), chunk_size))
+
+    @contextmanager
+    def map_file(self, filename: str) -> Iterator[memoryview]:
+        """
+        Provides a read-only view of a file's content for the duration of a with block.
+
+        This default reads the whole file; local implementations memory-map it instead.
+        Args:
+            filename: The path to the file to view.
+        Returns:
+            A context manager yielding the memoryview, which must not be used after the
+            with block.
+        Raises:
+            FileNotFoundError: If the file does not exist.
+        """
+        yield memoryview(self._retrieve_bytes(filename))
+
 
 class LocalFileSystem(FileSystem):
     """
@@ -122,61 +229,212 @@ class LocalFileSystem(FileSystem):
         logger.warning(f'Data does not match signature for MIME type: {mime_type}')
         return False
 
-    def save_file(self, filename: str, mimeType: str, data: Union[bytes, str]) -> str:
+    def check_mime_type(self, filename: str, mime_type: str) -> bool:
         """
-        Save data to a file with MIME type validation.
+        Validate that a saved file matches the specified MIME type.
+
+        Only the signature bytes are read, however large the file is.
 
         Args:
-            filename: The name of the file to save.
-            mimeType: The MIME type of the data.
-            data: The data to save, either as bytes or a string.
+            filename: The name of the file to check.
+            mime_type: The expected MIME type.
 
         Returns:
-            The path to the saved file.
+            True if valid, False otherwise.
+
+        Raises:
+            FileNotFoundError: If the file does not exist.
+        """
+        signature = self.MIME_SIGNATURES.get(mime_type, b'')
+        return self._validate_mime_type(self.read_range(filename, 0, len(signature)), mime_type)
+
+    def _get_save_name(self, filename: str, mime_type: str) -> str:
         """
+        Get the name a file of the given MIME type is saved under.
 
-        # Check MIME type against file extension
-        if mimeType in self.MIME_SIGNATURES:
-            if mimeType not in self.MIME_SIGNATURES_EXTENSIONS:
-                logger.info(f'No file extension found for MIME type: {mimeType}')
+        The extension for the MIME type is appended unless the filename already has it.
+        Types without a known extension keep the filename as given.
 
-        file_extension = self.MIME_SIGNATURES_EXTENSIONS[mimeType]
+        Args:
+            filename: The relative filename.
+            mime_type: The MIME type of the data.
 
-        full_path = self._get_full_path(f'{filename}.{file_extension}')
+        Returns:
+            The relative filename with its extension.
+        """
+        file_extension = self.MIME_SIGNATURES_EXTENSIONS.get(mime_type)
+        if file_extension is None:
+            logger.info(f'No file extension found for MIME type: {mime_type}')
+        elif not filename.lower().endswith(f'.{file_extension}'):
+            filename = f'{filename}.{file_extension}'
+        return filename
+
+    def _get_save_path(self, filename: str, mime_type: str) -> str:
+        """
+        Get the full path a file of the given MIME type is saved to, creating its directory.
+
+        Args:
+            filename: The relative filename.
+            mime_type: The MIME type of the data.
+
+        Returns:
+            The full absolute path.
+        """
+        full_path = self._get_full_path(self._get_save_name(filename, mime_type))
         os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        return full_path
 
-        # Handle both string and binary data
-        if isinstance(data, str):
+    def _decode_data(self, data: Union[bytes, str]) -> bytes:
+        """
+        Decode data given to save_file.
+
+        Args:
+            data: The binary data, or a base64 encoded string of it.
+
+        Returns:
+            The binary data.
+        """
+        if isinstance(data, bytes):
+            return data
+        try:
+            # Assume it's base64 encoded
+            decoded_data = base64.b64decode(data)
+            logger.info('Base64 decoding successful')
+            return decoded_data
+        except Exception as e:
+            logger.error(f'Base64 decoding error: {e}')
+            raise
+
+    def _reserve_path(self, full_path: str) -> str:
+        """
+        Atomically claim full_path, or the first free <name>_<n><ext> next to it.
+
+        The claim is an empty file created with O_EXCL, so concurrent savers, in this
+        process or another, can never pick the same name.
+
+        Args:
+            full_path: The path the caller would like to save to.
+
+        Returns:
+            The claimed path, which the caller must replace with the saved content.
+        """
+        base, ext = os.path.splitext(full_path)
+        for attempt in itertools.count():
+            candidate = full_path if attempt == 0 else f'{base}_{attempt}{ext}'
             try:
-                # Assume it's base64 encoded
-                decoded_data = base64.b64decode(data)
-                logger.info('Base64 decoding successful')
-            except Exception as e:
-                logger.error(f'Base64 decoding error: {e}')
-                raise
-        else:
-            # It's already binary data
-            decoded_data = data
-
-        # Check MIME type
-        if mimeType in self.MIME_SIGNATURES:
-            if decoded_data.startswith(self.MIME_SIGNATURES[mimeType]):
-                logger.info(f'Decoded data starts with expected signature for {mimeType}')
-            else:
-                logger.warning(
-                    f'Decoded data does NOT start with expected signature for {mimeType}'
-                )
+                os.close(os.open(candidate, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+            except FileExistsError:
+                continue
+            if candidate != full_path:
+                logger.info(f'{full_path} exists, saving to {candidate}')
+            return candidate
+        raise AssertionError('unreachable')
+
+    def _write_atomically(self, full_path: str, chunks: Iterable[bytes], mime_type: str) -> int:
+        """
+        Write content to a temporary file next to full_path, then rename it into place.
+
+        Readers see either the previous file or the complete new one, never a partial
+        write, and a failed write leaves no temporary file behind. Only the first bytes
+        are checked against the MIME type signature, so memory use is bounded by the
+        chunk size rather than the file size.
+
+        Args:
+            full_path: The path to save to.
+            chunks: The decoded content, in order.
+            mime_type: The MIME type of the data.
 
-        # Save the decoded data to a file
+        Returns:
+            The number of bytes written.
+        """
+        signature = self.MIME_SIGNATURES.get(mime_type)
+        head = b''
+        size = 0
+
+        temp_fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(full_path), prefix='.', suffix='.tmp'
+        )
         try:
-            with open(full_path, 'wb') as f:
-                f.write(decoded_data)
-            logger.info(f'File saved to {full_path}')
-            return full_path
+            with os.fdopen(temp_fd, 'wb') as f:
+                for chunk in chunks:
+                    if signature is not None and len(head) < len(signature):
+                        head += chunk[: len(signature) - len(head)]
+                        if len(head) == len(signature):
+                            self._validate_mime_type(head, mime_type)
+                    f.write(chunk)
+                    size += len(chunk)
+            os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return size
+
+    def _save_chunks(
+        self, filename: str, mime_type: str, chunks: Iterable[bytes], overwrite: bool
+    ) -> str:
+        """Save content atomically, under a free name unless overwrite is set."""
+        full_path = self._get_save_path(filename, mime_type)
+        if not overwrite:
+            full_path = self._reserve_path(full_path)
+
+        try:
+            size = self._write_atomically(full_path, chunks, mime_type)
         except Exception as e:
             logger.error(f'Error saving file: {e}')
+            if not overwrite:
+                # Release the claimed name
+                os.remove(full_path)
             raise
 
+        logger.info(f'File saved to {full_path} ({size} bytes)')
+        return full_path
+
+    def save_file(
+        self, filename: str, mimeType: str, data: Union[bytes, str], overwrite: bool = True
+    ) -> str:
+        """
+        Save data to a file with MIME type validation.
+
+        The file is written to a temporary file and renamed into place, so it is never
+        seen half written.
+
+        Args:
+            filename: The name of the file to save.
+            mimeType: The MIME type of the data.
+            data: The data to save, either as bytes or a string.
+            overwrite: Replace an existing file of the same name, rather than saving
+                under the first free <name>_<n><ext>.
+
+        Returns:
+            The path to the saved file.
+        """
+        # Handle both string and binary data
+        decoded_data = self._decode_data(data)
+        return self._save_chunks(filename, mimeType, [decoded_data], overwrite)
+
+    def save_stream(
+        self, filename: str, mimeType: str, chunks: Iterable[bytes], overwrite: bool = True
+    ) -> str:
+        """
+        Save decoded content to a file as it arrives, one chunk at a time.
+
+        Memory use is bounded by the chunk size rather than the file size. The content
+        is renamed into place once complete, so nothing is left behind if the chunks
+        raise.
+
+        Args:
+            filename: The name of the file to save.
+            mimeType: The MIME type of the data.
+            chunks: The decoded content, in order.
+            overwrite: Replace an existing file of the same name, rather than saving
+                under the first free <name>_<n><ext>.
+
+        Returns:
+            The path to the saved file.
+        """
+        return self._save_chunks(filename, mimeType, chunks, overwrite)
+
     def retrieve_file(self, filename: str) -> bytes:
         """
         Retrieve the content of a file.
@@ -190,11 +448,7 @@ class LocalFileSystem(FileSystem):
         Raises:
             FileNotFoundError: If the file does not exist.
         """
-        full_path = self._get_full_path(filename)
-
-        if not os.path.exists(full_path):
-            logger.error(f'File not found: {full_path}')
-            raise FileNotFoundError(f'File not found: {filename}')
+        full_path = self._get_read_path(filename)
 
         try:
             with open(full_path, 'rb') as f:
@@ -204,3 +458,508 @@ class LocalFileSystem(FileSystem):
         except Exception as e:
             logger.error(f'Error retrieving file: {e}')
             raise
+
+    def _get_read_path(self, filename: str) -> str:
+        """
+        Get the full path of an existing file.
+
+        Args:
+            filename: The relative filename.
+
+        Returns:
+            The full absolute path.
+
+        Raises:
+            FileNotFoundError: If the file does not exist.
+        """
+        full_path = self._get_full_path(filename)
+        if not os.path.isfile(full_path):
+            logger.error(f'File not found: {full_path}')
+            raise FileNotFoundError(f'File not found: {filename}')
+        return full_path
+
+    def read_range(self, filename: str, offset: int = 0, length: Optional[int] = None) -> bytes:
+        """
+        Read part of a file, without reading the rest of it.
+
+        Args:
+            filename: The name of the file to read.
+            offset: The position of the first byte to read.
+            length: The maximum number of bytes to read, or None to read to the end.
+
+        Returns:
+            The bytes read, fewer than length if the file ends first.
+
+        Raises:
+            FileNotFoundError: If the file does not exist.
+        """
+        if offset < 0 or (length is not None and length < 0):
+            raise ValueError(f'Invalid range: offset {offset}, length {length}')
+        with open(self._get_read_path(filename), 'rb') as f:
+            f.seek(offset)
+            return f.read() if length is None else f.read(length)
+
+    def iter_file(
+        self, filename: str, chunk_size: int = DEFAULT_READ_CHUNK_BYTES
+    ) -> Iterator[bytes]:
+        """
+        Read a file in chunks, so memory use is bounded by the chunk size.
+
+        The file is opened before the first chunk is requested, so a missing file is
+        reported by this call rather than by the iteration.
+
+        Args:
+            filename: The name of the file to read.
+            chunk_size: The maximum size of each chunk.
+
+        Returns:
+            An iterator over the content, in order.
+
+        Raises:
+            FileNotFoundError: If the file does not exist.
+        """
+        if chunk_size <= 0:
+            raise ValueError(f'chunk_size must be positive, got {chunk_size}')
+        f = open(self._get_read_path(filename), 'rb')
+
+        def chunks() -> Iterator[bytes]:
+            with f:
+                while chunk := f.read(chunk_size):
+                    yield chunk
+
+        return chunks()
+
+    @contextmanager
+    def map_file(self, filename: str) -> Iterator[memoryview]:
+        """
+        Memory-map a file, giving zero-copy read access to its content.
+
+        Pages are only read from disk when they are accessed, so slicing the view reads
+        only the bytes it covers. Views and slices of it must not be used, or kept,
+        after the with block, which unmaps the file.
+
+        Args:
+            filename: The name of the file to map.
+
+        Returns:
+            A context manager yielding a read-only memoryview of the content.
+
+        Raises:
+            FileNotFoundError: If the file does not exist.
+        """
+        with open(self._get_read_path(filename), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Empty files cannot be mapped
+                yield memoryview(b'')
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    yield view
+                finally:
+                    view.release()
+
+
+class ContentAddressedFileSystem(LocalFileSystem):
+    """
+    A local file system that stores each distinct content once, keyed by its SHA-256.
+
+    Content is kept under objects/<first two hex digits>/<hash>, and an append-only
+    manifest maps the logical names files were saved under to their hashes. Saving the
+    same content again, under any name, writes no content and at most one manifest
+    line. Saving different content under a name that is taken points the name at it,
+    or without overwrite keeps both, by suffixing the new name with the start of its
+    hash, so a repeated save of the same file always lands on the same name.
+
+    Saves return the path of the logical name under the base directory, which is made a
+    hard link to the stored content, so it can be opened like any saved file without
+    taking more space. The read methods resolve logical names through the manifest.
+
+    Several processes can share the base directory. Content is renamed into place, and
+    manifest lines are appended under a lock file; each process replays the lines the
+    others appended before it records a name or resolves one.
+    """
+
+    deduplicates = True
+
+    OBJECTS_DIRECTORY = 'objects'
+    MANIFEST_FILENAME = 'manifest.jsonl'
+    LOCK_FILENAME = '.manifest.lock'
+
+    def __init__(self, base_directory: str = '.'):
+        """
+        Initialize the content-addressed file system.
+
+        Args:
+            base_directory: The base directory for all file operations.
+        """
+        super().__init__(base_directory)
+        self.objects_directory = os.path.join(self.base_directory, self.OBJECTS_DIRECTORY)
+        self.manifest_path = os.path.join(self.base_directory, self.MANIFEST_FILENAME)
+        os.makedirs(self.objects_directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(os.path.join(self.base_directory, self.LOCK_FILENAME))
+        self._manifest: Dict[str, ManifestEntry] = {}
+        # How far into the manifest file has been replayed
+        self._manifest_offset = 0
+        with self._lock:
+            self._load_manifest()
+        logger.info(f'ContentAddressedFileSystem loaded {len(self._manifest)} manifest entries')
+
+    def _load_manifest(self):
+        """
+        Replay the manifest lines appended since the last call, where a later line for a
+        name replaces an earlier one; hold the lock.
+        """
+        try:
+            if os.path.getsize(self.manifest_path) <= self._manifest_offset:
+                return
+        except FileNotFoundError:
+            return
+        with open(self.manifest_path, 'rb') as f:
+            f.seek(self._manifest_offset)
+            data = f.read()
+        # A line without its newline is still being appended, and is replayed next time
+        complete = data[: data.rfind(b'\n') + 1]
+        self._manifest_offset += len(complete)
+        for line in complete.decode('utf-8', errors='replace').splitlines():
+            try:
+                record = json.loads(line)
+                self._manifest[record['name']] = ManifestEntry(
+                    sha256=record['sha256'],
+                    mime_type=record['mime_type'],
+                    size=int(record['size']),
+                )
+            except (ValueError, KeyError, TypeError):
+                # A line cut short by an interrupted append
+                logger.warning(f'Skipping invalid manifest line: {line.strip()}')
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_directory, digest[:2], digest)
+
+    def _record(self, name: str, entry: ManifestEntry, overwrite: bool) -> str:
+        """
+        Point a logical name at content, replacing what the name pointed at or choosing
+        another name if it is taken.
+
+        Args:
+            name: The logical name the content was saved under.
+            entry: The manifest entry of the content.
+            overwrite: Point a taken name at the new content, rather than recording it
+                under the name suffixed with the start of its hash.
+
+        Returns:
+            The logical name the content is recorded under.
+        """
+        with self._lock, self._file_lock:
+            self._load_manifest()
+            existing = self._manifest.get(name)
+            if existing is not None and existing['sha256'] != entry['sha256'] and not overwrite:
+                base, ext = os.path.splitext(name)
+                name = f'{base}_{entry["sha256"][:8]}{ext}'
+                existing = self._manifest.get(name)
+            if existing is not None and existing['sha256'] == entry['sha256']:
+                logger.info(f'{name} is already stored, nothing to write')
+                if not os.path.exists(self._get_full_path(name)):
+                    self._link(name, entry['sha256'])
+                return name
+
+            line = json.dumps({'name': name, **entry}) + '\n'
+            with open(self.manifest_path, 'ab') as f:
+                if f.tell() > self._manifest_offset:
+                    # End the line of an append that was interrupted, so it is skipped
+                    line = '\n' + line
+                f.write(line.encode('utf-8'))
+            self._load_manifest()
+            self._link(name, entry['sha256'])
+            return name
+
+    def _link(self, name: str, digest: str):
+        """
+        Make the path of a logical name a hard link to the content, replacing what was
+        there; hold both locks.
+
+        The link is made under a temporary name and renamed into place, so the path
+        always holds complete content. File systems without hard links get a copy.
+        """
+        full_path = self._get_full_path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        temp_path = os.path.join(
+            os.path.dirname(full_path), f'.{os.path.basename(full_path)}.link.tmp'
+        )
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        try:
+            os.link(self._object_path(digest), temp_path)
+        except OSError:
+            shutil.copyfile(self._object_path(digest), temp_path)
+        os.replace(temp_path, full_path)
+
+    def save_file(
+        self, filename: str, mimeType: str, data: Union[bytes, str], overwrite: bool = True
+    ) -> str:
+        """
+        Save data, storing its content only if no file with the same content exists.
+
+        Args:
+            filename: The name of the file to save.
+            mimeType: The MIME type of the data.
+            data: The data to save, either as bytes or a string.
+            overwrite: Point a taken name at this content, rather than saving under the
+                name suffixed with the start of the content's hash.
+
+        Returns:
+            The path of the logical name the content was saved under.
+        """
+        decoded_data = self._decode_data(data)
+
+        digest = hashlib.sha256(decoded_data).hexdigest()
+        object_path = self._object_path(digest)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            self._write_atomically(object_path, [decoded_data], mimeType)
+
+        name = self._get_logical_name(filename, mimeType)
+        name = self._record(
+            name,
+            ManifestEntry(sha256=digest, mime_type=mimeType, size=len(decoded_data)),
+            overwrite,
+        )
+        logger.info(f'File {name} saved to {object_path}')
+        return os.path.join(self.base_directory, name)
+
+    def save_stream(
+        self, filename: str, mimeType: str, chunks: Iterable[bytes], overwrite: bool = True
+    ) -> str:
+        """
+        Save decoded content as it arrives, hashing it on the way.
+
+        The content is written to a temporary file, which is discarded if the content
+        is already stored, and otherwise renamed into place.
+
+        Args:
+            filename: The name of the file to save.
+            mimeType: The MIME type of the data.
+            chunks: The decoded content, in order.
+            overwrite: Point a taken name at this content, rather than saving under the
+                name suffixed with the start of the content's hash.
+
+        Returns:
+            The path of the logical name the content was saved under.
+        """
+        name = self._get_logical_name(filename, mimeType)
+        signature = self.MIME_SIGNATURES.get(mimeType)
+        sha256 = hashlib.sha256()
+        head = b''
+        size = 0
+
+        temp_fd, temp_path = tempfile.mkstemp(dir=self.objects_directory, suffix='.tmp')
+        try:
+            with os.fdopen(temp_fd, 'wb') as f:
+                for chunk in chunks:
+                    if signature is not None and len(head) < len(signature):
+                        head += chunk[: len(signature) - len(head)]
+                        if len(head) == len(signature):
+                            self._validate_mime_type(head, mimeType)
+                    sha256.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+
+            digest = sha256.hexdigest()
+            object_path = self._object_path(digest)
+            if os.path.exists(object_path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.replace(temp_path, object_path)
+        except Exception as e:
+            logger.error(f'Error saving file: {e}')
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        name = self._record(
+            name, ManifestEntry(sha256=digest, mime_type=mimeType, size=size), overwrite
+        )
+        logger.info(f'File {name} saved to {object_path} ({size} bytes)')
+        return os.path.join(self.base_directory, name)
+
+    def _get_logical_name(self, filename: str, mime_type: str) -> str:
+        """
+        Get the manifest name of a file, rejecting names outside the base directory and
+        the names of the store's own files.
+        """
+        name = self._get_save_name(filename, mime_type)
+        full_path = self._get_full_path(name)
+        name = os.path.relpath(full_path, self.base_directory)
+        reserved = {self.MANIFEST_FILENAME, self.LOCK_FILENAME, self.OBJECTS_DIRECTORY, '.'}
+        if name in reserved or name.startswith(self.OBJECTS_DIRECTORY + os.sep):
+            raise ValueError(f'Reserved filename: {filename}')
+        return name
+
+    def resolve(self, filename: str) -> Optional[str]:
+        """
+        Get the path of the content saved under a logical name.
+
+        Args:
+            filename: The logical name, including the extension save added for its MIME
+                type, or its path as returned by save.
+
+        Returns:
+            The path of the stored content, or None if nothing is saved under the name.
+        """
+        name = os.path.relpath(os.path.join(self.base_directory, filename), self.base_directory)
+        with self._lock:
+            self._load_manifest()
+            entry = self._manifest.get(name)
+        return self._object_path(entry['sha256']) if entry is not None else None
+
+    def _get_read_path(self, filename: str) -> str:
+        """
+        Get the path of the content saved under a logical name.
+
+        Paths of logical names, as returned by save, and of stored content are accepted
+        too, so every read method takes any of them.
+
+        Args:
+            filename: The logical name or content path of the file.
+
+        Returns:
+            The full absolute path of the content.
+
+        Raises:
+            FileNotFoundError: If nothing is saved under the name.
+        """
+        object_path = self.resolve(filename)
+        if object_path is not None:
+            return object_path
+        return super()._get_read_path(filename)
+
+
+class AsyncFileSystem(ABC):
+    """
+    Abstract base class for a file system used from async code.
+
+    Its calls never block the event loop, so many files can be saved concurrently.
+    """
+
+    deduplicates: bool = False
+
+    @abstractmethod
+    async def save_file(
+        self, filename: str, mimeType: str, data: Union[bytes, str], overwrite: bool = True
+    ) -> str:
+        """
+        Saves the given content against the filename.
+        Args:
+            filename: The path to save the file to.
+            mimeType: The MIME type of the data.
+            data: The data to save.  Must be bytes or a string.
+            overwrite: Replace an existing file of the same name, rather than saving
+                under a free name next to it.
+        Returns:
+            The path to the saved file.
+        """
+        pass
+
+    @abstractmethod
+    async def save_stream(
+        self, filename: str, mimeType: str, chunks: Iterable[bytes], overwrite: bool = True
+    ) -> str:
+        """
+        Saves content that arrives in chunks, without holding all of it in memory.
+        Args:
+            filename: The path to save the file to.
+            mimeType: The MIME type of the data.
+            chunks: The decoded content, in order. It may block, e.g. on a download, as
+                it is consumed off the event loop.
+            overwrite: Replace an existing file of the same name, rather than saving
+                under a free name next to it.
+        Returns:
+            The path to the saved file.
+        """
+        pass
+
+    @abstractmethod
+    async def retrieve_file(self, filename: str) -> Union[bytes, str]:
+        """
+        Retrieves the content of the file at the specified path.
+        Args:
+            filename: The path to the file to retrieve.
+        Returns:
+            The content of the file, either as bytes or a string.
+        Raises:
+            FileNotFoundError: If the file does not exist.
+        """
+        pass
+
+    @abstractmethod
+    async def read_range(
+        self, filename: str, offset: int = 0, length: Optional[int] = None
+    ) -> bytes:
+        """
+        Reads part of a file.
+        Args:
+            filename: The path to the file to read.
+            offset: The position of the first byte to read.
+            length: The maximum number of bytes to read, or None to read to the end.
+        Returns:
+            The bytes read, fewer than length if the file ends first.
+        Raises:
+            FileNotFoundError: If the file does not exist.
+        """
+        pass
+
+
+class ThreadPoolFileSystem(AsyncFileSystem):
+    """
+    Runs the calls of a FileSystem on a bounded thread pool, off the event loop.
+
+    The wrapped file system's writes are atomic and its overwrite=False saves claim
+    their names atomically, so concurrent saves through one pool are safe.
+    """
+
+    def __init__(
+        self,
+        file_system: FileSystem,
+        max_workers: int = DEFAULT_MAX_CONCURRENT_FILE_OPERATIONS,
+    ):
+        """
+        Initialize the thread pool file system.
+
+        Args:
+            file_system: The file system the calls are made on.
+            max_workers: The maximum number of calls running at once.
+        """
+        self.file_system = file_system
+        self.deduplicates = file_system.deduplicates
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fs')
+
+    async def _run(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(function, *args, **kwargs)
+        )
+
+    async def save_file(
+        self, filename: str, mimeType: str, data: Union[bytes, str], overwrite: bool = True
+    ) -> str:
+        return await self._run(
+            self.file_system.save_file, filename, mimeType, data, overwrite=overwrite
+        )
+
+    async def save_stream(
+        self, filename: str, mimeType: str, chunks: Iterable[bytes], overwrite: bool = True
+    ) -> str:
+        return await self._run(
+            self.file_system.save_stream, filename, mimeType, chunks, overwrite=overwrite
+        )
+
+    async def retrieve_file(self, filename: str) -> Union[bytes, str]:
+        return await self._run(self.file_system.retrieve_file, filename)
+
+    async def read_range(
+        self, filename: str, offset: int = 0, length: Optional[int] = None
+    ) -> bytes:
+        return await self._run(self.file_system.read_range, filename, offset, length)
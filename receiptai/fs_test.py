@@ -1,9 +1,11 @@
+import asyncio
 import base64
 import os
 import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 
-from fs import LocalFileSystem
+from fs import ContentAddressedFileSystem, LocalFileSystem, ThreadPoolFileSystem
 
 
 class TestLocalFileSystem(unittest.TestCase):
@@ -79,5 +81,261 @@ class TestLocalFileSystem(unittest.TestCase):
         path = self.fs.save_file('test_png', 'image/png', self.png_data)
         self.assertTrue(path.endswith('.png'))
 
+    def test_save_stream(self):
+        chunks = [self.pdf_data[:3], self.pdf_data[3:]]
+        path = self.fs.save_stream('streamed', 'application/pdf', iter(chunks))
+        self.assertTrue(path.endswith('streamed.pdf'))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.pdf_data)
+
+    def test_save_stream_keeps_existing_extension(self):
+        path = self.fs.save_stream('invoice.pdf', 'application/pdf', [self.pdf_data])
+        self.assertTrue(path.endswith('invoice.pdf'))
+
+    def test_save_stream_unknown_mime_type(self):
+        path = self.fs.save_stream('data.bin', 'application/octet-stream', [b'\x00\x01'])
+        self.assertTrue(path.endswith('data.bin'))
+
+    def test_save_stream_removes_partial_file(self):
+        def failing_chunks():
+            yield self.pdf_data
+            raise ValueError('connection reset')
+
+        with self.assertRaises(ValueError):
+            self.fs.save_stream('partial', 'application/pdf', failing_chunks())
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'partial.pdf')))
+
+    def test_read_range(self):
+        self.fs.save_file('ranged', 'application/pdf', self.pdf_data)
+        self.assertEqual(self.fs.read_range('ranged.pdf', 0, 5), b'%PDF-')
+        self.assertEqual(self.fs.read_range('ranged.pdf', 9), b'Test PDF')
+        self.assertEqual(self.fs.read_range('ranged.pdf', 100, 5), b'')
+        with self.assertRaises(FileNotFoundError):
+            self.fs.read_range('missing.pdf', 0, 5)
+
+    def test_iter_file(self):
+        self.fs.save_file('chunked', 'application/pdf', self.pdf_data)
+        chunks = list(self.fs.iter_file('chunked.pdf', chunk_size=4))
+        self.assertEqual(b''.join(chunks), self.pdf_data)
+        self.assertTrue(all(len(chunk) <= 4 for chunk in chunks))
+        with self.assertRaises(FileNotFoundError):
+            self.fs.iter_file('missing.pdf')
+
+    def test_map_file(self):
+        self.fs.save_file('mapped', 'application/pdf', self.pdf_data)
+        with self.fs.map_file('mapped.pdf') as view:
+            self.assertEqual(bytes(view[:5]), b'%PDF-')
+            self.assertEqual(len(view), len(self.pdf_data))
+        self.fs.save_file('empty', 'application/octet-stream', b'')
+        with self.fs.map_file('empty') as view:
+            self.assertEqual(len(view), 0)
+
+    def test_check_mime_type(self):
+        self.fs.save_file('checked', 'application/pdf', self.pdf_data)
+        self.assertTrue(self.fs.check_mime_type('checked.pdf', 'application/pdf'))
+        self.assertFalse(self.fs.check_mime_type('checked.pdf', 'image/png'))
+        self.assertTrue(self.fs.check_mime_type('checked.pdf', 'application/octet-stream'))
+
+    def test_save_without_overwrite_picks_free_name(self):
+        first = self.fs.save_file('invoice.pdf', 'application/pdf', self.pdf_data, overwrite=False)
+        second = self.fs.save_stream(
+            'invoice.pdf', 'application/pdf', [self.pdf_data], overwrite=False
+        )
+        self.assertTrue(first.endswith('invoice.pdf'))
+        self.assertTrue(second.endswith('invoice_1.pdf'))
+
+    def test_overwrite_replaces_file(self):
+        self.fs.save_file('replaced', 'application/pdf', self.pdf_data)
+        path = self.fs.save_file('replaced', 'application/pdf', b'%PDF-1.7 New')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'%PDF-1.7 New')
+
+    def test_concurrent_saves_get_distinct_names(self):
+        def save(_):
+            return self.fs.save_file('same.pdf', 'application/pdf', self.pdf_data, overwrite=False)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            paths = list(executor.map(save, range(16)))
+        self.assertEqual(len(set(paths)), 16)
+
+    def failing_chunks(self):
+        yield self.pdf_data
+        raise ValueError('connection reset')
+
+    def test_failed_save_releases_name(self):
+        with self.assertRaises(ValueError):
+            self.fs.save_stream(
+                'bad.pdf', 'application/pdf', self.failing_chunks(), overwrite=False
+            )
+        self.assertEqual(os.listdir(self.temp_dir), [])
+        path = self.fs.save_file('bad.pdf', 'application/pdf', self.pdf_data, overwrite=False)
+        self.assertTrue(path.endswith('bad.pdf'))
+
+    def test_failed_overwrite_keeps_previous_file(self):
+        path = self.fs.save_file('kept', 'application/pdf', self.pdf_data)
+        with self.assertRaises(ValueError):
+            self.fs.save_stream('kept', 'application/pdf', self.failing_chunks())
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.pdf_data)
+        self.assertEqual(os.listdir(self.temp_dir), ['kept.pdf'])
+
+
+class TestThreadPoolFileSystem(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.fs = ThreadPoolFileSystem(LocalFileSystem(self.temp_dir))
+        self.pdf_data = b'%PDF-1.0 Test PDF'
+
+    def tearDown(self):
+        import shutil
+
+        shutil.rmtree(self.temp_dir)
+
+    def test_concurrent_saves(self):
+        async def save_all():
+            return await asyncio.gather(
+                *(
+                    self.fs.save_file('async', 'application/pdf', self.pdf_data, overwrite=False)
+                    for _ in range(10)
+                ),
+                self.fs.save_stream('streamed', 'application/pdf', iter([self.pdf_data])),
+            )
+
+        paths = asyncio.run(save_all())
+        self.assertEqual(len(set(paths)), 11)
+        self.assertEqual(asyncio.run(self.fs.retrieve_file('streamed.pdf')), self.pdf_data)
+        self.assertEqual(asyncio.run(self.fs.read_range('async.pdf', 0, 5)), b'%PDF-')
+
+
+class TestContentAddressedFileSystem(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.fs = ContentAddressedFileSystem(self.temp_dir)
+        self.pdf_data = b'%PDF-1.0 Test PDF'
+        self.other_pdf_data = b'%PDF-1.0 Other PDF'
+
+    def tearDown(self):
+        import shutil
+
+        shutil.rmtree(self.temp_dir)
+
+    def object_files(self):
+        objects_directory = os.path.join(self.temp_dir, 'objects')
+        return [name for _, _, names in os.walk(objects_directory) for name in names]
+
+    def manifest_lines(self):
+        with open(os.path.join(self.temp_dir, 'manifest.jsonl')) as f:
+            return f.readlines()
+
+    def test_duplicate_saves_store_content_once(self):
+        first = self.fs.save_file('invoice', 'application/pdf', self.pdf_data)
+        second = self.fs.save_stream('invoice.pdf', 'application/pdf', [self.pdf_data])
+        third = self.fs.save_file('copy', 'application/pdf', self.pdf_data)
+        self.assertEqual(first, os.path.join(self.temp_dir, 'invoice.pdf'))
+        self.assertEqual(first, second)
+        self.assertEqual(third, os.path.join(self.temp_dir, 'copy.pdf'))
+        self.assertEqual(len(self.object_files()), 1)
+        # The repeated save of invoice.pdf adds no manifest line
+        self.assertEqual(len(self.manifest_lines()), 2)
+
+    def test_name_conflict_keeps_both(self):
+        self.fs.save_file('invoice', 'application/pdf', self.pdf_data, overwrite=False)
+        path = self.fs.save_file('invoice', 'application/pdf', self.other_pdf_data, overwrite=False)
+        self.assertRegex(os.path.basename(path), r'^invoice_[0-9a-f]{8}\.pdf$')
+        self.assertEqual(self.fs.retrieve_file('invoice.pdf'), self.pdf_data)
+        self.assertEqual(self.fs.retrieve_file(path), self.other_pdf_data)
+        self.assertEqual(len(self.object_files()), 2)
+        self.assertEqual(len(self.manifest_lines()), 2)
+
+        # Saving the second content again finds the suffixed name it was stored under
+        again = self.fs.save_file(
+            'invoice', 'application/pdf', self.other_pdf_data, overwrite=False
+        )
+        self.assertEqual(again, path)
+        self.assertEqual(len(self.manifest_lines()), 2)
+
+    def test_saved_path_links_to_content(self):
+        path = self.fs.save_file('invoice', 'application/pdf', self.pdf_data)
+        copy = self.fs.save_stream('copy', 'application/pdf', [self.pdf_data])
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.pdf_data)
+        # Both names share the one stored copy of the content
+        self.assertEqual(os.stat(path).st_ino, os.stat(copy).st_ino)
+        self.assertEqual(len(self.object_files()), 1)
+
+    def test_reserved_names_are_rejected(self):
+        for filename in ['manifest.jsonl', 'objects/ab/invoice']:
+            with self.subTest(filename=filename), self.assertRaises(ValueError):
+                self.fs.save_file(filename, 'application/octet-stream', self.pdf_data)
+
+    def test_overwrite_replaces_manifest_entry(self):
+        self.fs.save_file('invoice', 'application/pdf', self.pdf_data)
+        path = self.fs.save_stream('invoice', 'application/pdf', [self.other_pdf_data])
+        self.assertEqual(path, os.path.join(self.temp_dir, 'invoice.pdf'))
+        self.assertEqual(self.fs.retrieve_file('invoice.pdf'), self.other_pdf_data)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.other_pdf_data)
+
+        reopened = ContentAddressedFileSystem(self.temp_dir)
+        self.assertEqual(reopened.retrieve_file('invoice.pdf'), self.other_pdf_data)
+
+    def test_instances_share_a_directory(self):
+        other = ContentAddressedFileSystem(self.temp_dir)
+        self.fs.save_file('invoice', 'application/pdf', self.pdf_data, overwrite=False)
+        path = other.save_file('invoice', 'application/pdf', self.other_pdf_data, overwrite=False)
+
+        # The second instance saw the name was taken, and the first resolves its save
+        self.assertNotEqual(os.path.basename(path), 'invoice.pdf')
+        self.assertEqual(self.fs.retrieve_file(path), self.other_pdf_data)
+        self.assertEqual(other.retrieve_file('invoice.pdf'), self.pdf_data)
+
+        other.save_file('invoice', 'application/pdf', self.other_pdf_data)
+        self.assertEqual(self.fs.retrieve_file('invoice.pdf'), self.other_pdf_data)
+        self.assertEqual(len(self.manifest_lines()), 3)
+
+    def test_interrupted_append_is_skipped(self):
+        self.fs.save_file('invoice', 'application/pdf', self.pdf_data)
+        with open(os.path.join(self.temp_dir, 'manifest.jsonl'), 'a') as f:
+            f.write('{"name": "cut')
+        self.fs.save_file('copy', 'application/pdf', self.pdf_data)
+
+        reopened = ContentAddressedFileSystem(self.temp_dir)
+        self.assertEqual(reopened.retrieve_file('copy.pdf'), self.pdf_data)
+        self.assertEqual(reopened.retrieve_file('invoice.pdf'), self.pdf_data)
+
+    def test_retrieve_file(self):
+        path = self.fs.save_stream('invoice', 'application/pdf', iter([b'%PDF', b'-1.0']))
+        self.assertEqual(self.fs.retrieve_file('invoice.pdf'), b'%PDF-1.0')
+        self.assertEqual(self.fs.retrieve_file(path), b'%PDF-1.0')
+        with self.assertRaises(FileNotFoundError):
+            self.fs.retrieve_file('missing.pdf')
+
+    def test_ranged_and_mapped_reads_of_logical_names(self):
+        self.fs.save_file('invoice', 'application/pdf', self.pdf_data)
+        self.assertEqual(self.fs.read_range('invoice.pdf', 0, 5), b'%PDF-')
+        self.assertEqual(b''.join(self.fs.iter_file('invoice.pdf', 4)), self.pdf_data)
+        with self.fs.map_file('invoice.pdf') as view:
+            self.assertEqual(bytes(view), self.pdf_data)
+
+    def test_manifest_persists(self):
+        self.fs.save_file('invoice', 'application/pdf', self.pdf_data)
+        reopened = ContentAddressedFileSystem(self.temp_dir)
+        self.assertEqual(reopened.retrieve_file('invoice.pdf'), self.pdf_data)
+
+    def test_save_stream_removes_partial_file(self):
+        def failing_chunks():
+            yield self.pdf_data
+            raise ValueError('connection reset')
+
+        with self.assertRaises(ValueError):
+            self.fs.save_stream('partial', 'application/pdf', failing_chunks())
+        self.assertEqual(self.object_files(), [])
+        self.assertIsNone(self.fs.resolve('partial.pdf'))
+
+    def test_path_traversal_prevention(self):
+        with self.assertRaises(ValueError):
+            self.fs.save_file('../outside', 'application/pdf', self.pdf_data)
+
+
 if __name__ == '__main__':
     unittest.main()
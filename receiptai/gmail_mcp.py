@@ -2,22 +2,121 @@ import asyncio
 import json
 import logging
 import os
-from datetime import datetime
-from typing import cast
+from typing import TYPE_CHECKING, Any, Dict, Optional, Union, cast
 
 import mcp.server.stdio
 import mcp.types as types
+from attachment_resources import (
+    MAX_EMBEDDED_ATTACHMENT_BYTES,
+    attachment_uri,
+    embedded_attachment,
+    parse_attachment_uri,
+    saved_file_uri,
+)
 from dotenv import load_dotenv
-from fs import LocalFileSystem
-from gmail_service import GmailService
+from fs import ContentAddressedFileSystem, ThreadPoolFileSystem
+from mail_index import MailIndex
 from mcp.server import NotificationOptions, Server
+from mcp.server.lowlevel.helper_types import ReadResourceContents
 from mcp.server.models import InitializationOptions
+from message_cache import DEFAULT_MAX_BYTES, MessageCache
+from pydantic import AnyUrl
+from search_pagination import (
+    BODY_POLICIES,
+    DEFAULT_MAX_BODY_CHARS,
+    DEFAULT_MAX_RESPONSE_BYTES,
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    decode_cursor,
+    encode_cursor,
+    fit_to_budget,
+    format_email,
+)
+from tool_progress import ToolProgress
+
+if TYPE_CHECKING:
+    from gmail_service import GmailService
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-file_system = LocalFileSystem(base_directory='creds/file_storage')
+# Resource the client reads this server's Gmail scheduler metrics from, for its /status
+METRICS_URI = 'gmail://metrics'
+
+file_system = ThreadPoolFileSystem(ContentAddressedFileSystem(base_directory='creds/file_storage'))
+
+# Emails one bulk-save-email-attachments call accepts, and saves at once
+MAX_BULK_EMAILS = 100
+BULK_MAX_CONCURRENT_EMAILS = 4
+
+
+def compact_save_summary(response: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Shrinks the result of saving one email's attachments to what a bulk caller needs.
+
+    Args:
+        response: The save-email-attachments response of the email
+
+    Returns:
+        The email ID, status, saved paths and failed attachments
+    """
+    summary: Dict[str, Any] = {'email_id': response['email_id'], 'status': response['status']}
+    if response['status'] == 'error':
+        summary['message'] = response.get('message', '')
+        return summary
+
+    saved = [a['saved_path'] for a in response['attachments'] if a['status'] == 'success']
+    failed = [
+        {'filename': a['filename'], 'error': a.get('error', '')}
+        for a in response['attachments']
+        if a['status'] != 'success'
+    ]
+    if saved:
+        summary['saved'] = saved
+    if failed:
+        summary['status'] = 'partial' if saved else 'error'
+        summary['failed'] = failed
+    return summary
+
+
+def build_gmail_service(creds_file_path: str, token_path: str) -> 'GmailService':
+    """
+    Builds the shared Gmail service, with the message cache and mail index it serves from.
+
+    gmail_service is imported here rather than at the top of the module: the Google API
+    client and auth stack it pulls in are the largest part of the server's import time,
+    and the client only lists tools before its first call.
+
+    Args:
+        creds_file_path: Path to the OAuth client secrets file
+        token_path: Path to the cached OAuth token
+
+    Returns:
+        The shared Gmail service
+    """
+    from gmail_service import get_shared_gmail_service
+
+    message_cache = MessageCache(
+        os.environ.get('MESSAGE_CACHE_DIR', 'creds/message_cache'),
+        max_bytes=int(os.environ.get('MESSAGE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+    )
+
+    mail_index = MailIndex(os.environ.get('MAIL_INDEX_PATH', 'creds/mail_index.sqlite3'))
+    # Only queries scoped to the label are answered from the index. ALL mirrors the whole
+    # mailbox, so queries without a label are answered from it too
+    sync_label = os.environ.get('MAIL_INDEX_SYNC_LABEL', 'INBOX')
+    # Indexing the text downloads every synced message once, so it is opt-in
+    full_text_index = os.environ.get('MAIL_INDEX_FULL_TEXT', '').lower() in ('1', 'true')
+
+    return get_shared_gmail_service(
+        creds_file_path,
+        token_path,
+        message_cache=message_cache,
+        mail_index=mail_index,
+        sync_label=None if sync_label == 'ALL' else sync_label,
+        full_text_index=full_text_index,
+    )
 
 
 async def gmail_mcp():
@@ -41,13 +140,173 @@ async def gmail_mcp():
     logger.info(f'Using credentials file: {creds_file_path}')
     logger.info(f'Using token path: {token_path}')
 
-    gmail_service = GmailService(creds_file_path, token_path)
+    loaded_service: Optional['GmailService'] = None
+    load_lock = asyncio.Lock()
+
+    async def get_gmail_service() -> 'GmailService':
+        """Returns the Gmail service, building it off the event loop on first use."""
+        nonlocal loaded_service
+        async with load_lock:
+            if loaded_service is None:
+                loop = asyncio.get_running_loop()
+                loaded_service = await loop.run_in_executor(
+                    None, build_gmail_service, creds_file_path, token_path
+                )
+        return loaded_service
+
     server = Server('gmail')
 
     @server.list_prompts()
     async def list_prompts() -> list[types.Prompt]:
         return []  # No prompts, only focusing on the email reading tool
 
+    @server.set_logging_level()
+    async def set_logging_level(level: types.LoggingLevel) -> None:
+        # Registering this declares the logging capability partial results are sent through
+        logger.info(f'Client requested log level {level}')
+
+    @server.list_resources()
+    async def list_resources() -> list[types.Resource]:
+        # Attachments are not enumerated; their URIs come from get-email-attachments
+        return [
+            types.Resource(
+                uri=AnyUrl(METRICS_URI),
+                name='metrics',
+                description='Request, retry and throttling counters of the Gmail scheduler',
+                mimeType='application/json',
+            )
+        ]
+
+    @server.read_resource()
+    async def read_resource(uri: AnyUrl) -> list[ReadResourceContents]:
+        if str(uri) == METRICS_URI:
+            # Reading metrics does not build the service; null until the first tool call
+            metrics = loaded_service.scheduler.metrics() if loaded_service else None
+            return [
+                ReadResourceContents(
+                    content=json.dumps({'scheduler': metrics}), mime_type='application/json'
+                )
+            ]
+
+        gmail_service = await get_gmail_service()
+        email_id, part_id = parse_attachment_uri(str(uri))
+        for attachment in await gmail_service.get_attachment_parts(email_id):
+            if attachment['part_id'] == part_id:
+                content = await gmail_service.download_attachment(email_id, attachment)
+                return [ReadResourceContents(content=content, mime_type=attachment['mime_type'])]
+        raise ValueError(f'Attachment not found: {uri}')
+
+    async def save_email_attachments(
+        email_id: str, progress: Optional[ToolProgress]
+    ) -> Dict[str, Any]:
+        """
+        Streams every attachment of an email to the file system.
+
+        An attachment whose name is taken is saved under a free name next to it; the
+        file system claims names atomically, so concurrent saves never collide.
+
+        Args:
+            email_id: The ID of the email
+            progress: Reporter for per-attachment progress, if the caller wants it
+
+        Returns:
+            The per-attachment results and summary of the save
+        """
+        gmail_service = await get_gmail_service()
+        try:
+            attachments = await gmail_service.get_attachment_parts(email_id)
+        except Exception as e:
+            attachments = f'Error listing attachments: {e}'
+
+        response = {
+            'email_id': email_id,
+            'attachments': [],
+            'summary': {'total': 0, 'successful': 0, 'failed': 0},
+        }
+
+        # Handle error response
+        if not isinstance(attachments, list):
+            response['status'] = 'error'
+            response['message'] = str(attachments)
+            return response
+
+        # Handle no attachments case
+        if len(attachments) == 0:
+            response['status'] = 'success'
+            response['message'] = 'No attachments found in this email'
+            return response
+
+        # Update total count
+        response['summary']['total'] = len(attachments)
+        response['status'] = 'success'
+
+        attachment_results = []
+        filenames = []
+        for attachment in attachments:
+            filename = attachment['filename']
+            attachment_result = {
+                'filename': filename,
+                'mimeType': attachment['mime_type'],
+                'size': attachment['size'],
+                'uri': attachment_uri(email_id, attachment['part_id']),
+            }
+
+            attachment_results.append(attachment_result)
+            filenames.append(os.path.basename(filename))  # Ensure no path traversal
+
+        async def report_saved(index: int, saved_path: Union[str, Exception]):
+            assert progress is not None
+            await progress.advance(1)
+            await progress.partial_result(
+                {
+                    **attachment_results[index],
+                    'status': 'error' if isinstance(saved_path, Exception) else 'success',
+                    'saved_path': None if isinstance(saved_path, Exception) else saved_path,
+                }
+            )
+
+        # Stream the attachments straight to the file system, concurrently
+        if progress is not None:
+            await progress.advance(0, total=len(attachments))
+        saved_paths = await gmail_service.save_attachments(
+            email_id,
+            attachments,
+            file_system,
+            filenames=filenames,
+            overwrite=False,
+            on_result=report_saved if progress is not None else None,
+        )
+
+        for attachment_result, filename, saved_path in zip(
+            attachment_results, filenames, saved_paths
+        ):
+            if isinstance(saved_path, Exception):
+                attachment_result['status'] = 'error'
+                attachment_result['error'] = str(saved_path)
+                response['summary']['failed'] += 1
+            else:
+                attachment_result['status'] = 'success'
+                attachment_result['saved_path'] = saved_path
+                attachment_result['file_uri'] = saved_file_uri(saved_path)
+                if os.path.basename(saved_path) != filename:
+                    attachment_result['saved_filename'] = os.path.basename(saved_path)
+                    attachment_result['renamed'] = True
+                response['summary']['successful'] += 1
+
+            response['attachments'].append(attachment_result)
+
+        # Add overall status message
+        if response['summary']['failed'] == 0:
+            response['message'] = (
+                f'All {response["summary"]["total"]} {"attachments" if len(attachments) > 1 else "attachment"} saved successfully'
+            )
+        else:
+            response['message'] = (
+                f'{response["summary"]["successful"]} of {response["summary"]["total"]} attachments saved successfully'
+            )
+
+        return response
+
     @server.list_tools()
     async def handle_list_tools() -> list[types.Tool]:
         return [
@@ -58,27 +317,77 @@ async def gmail_mcp():
             ),
             types.Tool(
                 name='search-emails',
-                description="Search emails using Gmail's search syntax and include attachments",
+                description="Search emails using Gmail's search syntax. Results are paged: "
+                'pass next_cursor back as cursor to get more.',
                 inputSchema={
                     'type': 'object',
                     'properties': {
                         'query': {
                             'type': 'string',
                             'description': "Gmail search query (e.g., 'from:example@gmail.com', 'subject:hello')",
-                        }
+                        },
+                        'metadata_only': {
+                            'type': 'boolean',
+                            'description': 'Only return subject, sender, date and a short snippet of '
+                            'each email instead of the full body. Much faster for broad searches; '
+                            'use get-email to read the body of the relevant ones. '
+                            "Same as body='snippet'.",
+                        },
+                        'body': {
+                            'type': 'string',
+                            'enum': list(BODY_POLICIES),
+                            'description': "How much of each body to include: 'full', 'truncate' "
+                            "(the first max_body_chars characters, the default) or 'snippet' "
+                            '(no body, only a short snippet).',
+                        },
+                        'max_body_chars': {
+                            'type': 'integer',
+                            'description': f"Body characters kept with body='truncate' "
+                            f'(default {DEFAULT_MAX_BODY_CHARS}).',
+                        },
+                        'page_size': {
+                            'type': 'integer',
+                            'description': f'Maximum emails per page (default {DEFAULT_PAGE_SIZE}, '
+                            f'at most {MAX_PAGE_SIZE}). Pages may hold fewer to stay under the '
+                            'response size limit.',
+                        },
+                        'cursor': {
+                            'type': 'string',
+                            'description': 'The next_cursor of the previous page, to fetch the next '
+                            'page of the same query.',
+                        },
                     },
                     'required': ['query'],
                 },
             ),
             types.Tool(
-                name='get-email-attachments',
-                description='Retrieve attachments from a specific email by its ID',
+                name='get-email',
+                description='Retrieve the full content of a specific email by its ID',
                 inputSchema={
                     'type': 'object',
                     'properties': {'email_id': {'type': 'string'}},
                     'required': ['email_id'],
                 },
             ),
+            types.Tool(
+                name='get-email-attachments',
+                description='Retrieve attachments from a specific email by its ID. Returns a '
+                'manifest of the attachments, with the attachment files as embedded resources '
+                'rather than text. Attachments too large to embed are referenced by their '
+                'resource URI.',
+                inputSchema={
+                    'type': 'object',
+                    'properties': {
+                        'email_id': {'type': 'string'},
+                        'save': {
+                            'type': 'boolean',
+                            'description': 'Save the attachments to the file system and return '
+                            'references to the saved files instead of embedding them.',
+                        },
+                    },
+                    'required': ['email_id'],
+                },
+            ),
             types.Tool(
                 name='get-email-body-as-attachment',
                 description='Retrieve the body of an email as an attachment',
@@ -99,6 +408,29 @@ async def gmail_mcp():
                     'required': ['email_id'],
                 },
             ),
+            types.Tool(
+                name='bulk-save-email-attachments',
+                description='Save the attachments of many emails to a file system in one call. '
+                'Emails are processed concurrently and one compact summary per email is returned.',
+                inputSchema={
+                    'type': 'object',
+                    'properties': {
+                        'email_ids': {
+                            'type': 'array',
+                            'items': {'type': 'string'},
+                            'minItems': 1,
+                            'maxItems': MAX_BULK_EMAILS,
+                        },
+                    },
+                    'required': ['email_ids'],
+                },
+            ),
+            types.Tool(
+                name='sync-mailbox',
+                description='Bring the local mail index up to date with the mailbox and '
+                'report what changed, with the historyId the mailbox is now synced up to',
+                inputSchema={'type': 'object', 'properties': {}, 'required': []},
+            ),
             types.Tool(
                 name='save-email-content-as-attachment',
                 description='Save email content as an attachment to a file system',
@@ -116,32 +448,43 @@ async def gmail_mcp():
     async def handle_call_tool(
         name: str, arguments: dict | None
     ) -> list[types.TextContent | types.ImageContent | types.EmbeddedResource]:
+        gmail_service = await get_gmail_service()
+
         if name == 'get-unread-emails':
-            unread_emails = await gmail_service.get_unread_emails()
-
-            # Format as JSON strings with specific fields for each email
-            if isinstance(unread_emails, list):
-                formatted_emails = []
-                for email in unread_emails:
-                    body = email.get('body', '')
-                    body_preview = body.replace('\n', ' ')
-
-                    formatted_email = {
-                        'id': email.get('id', ''),
-                        'subject': email.get('subject', ''),
-                        'sender': email.get('sender', ''),
-                        'body': body_preview,
-                    }
-                    formatted_emails.append(formatted_email)
+            # Loaded with the service, which is only imported on the first tool call
+            from gmail_service import UNREAD_QUERY
+            from googleapiclient.errors import HttpError
 
-                return [
-                    types.TextContent(
-                        type='text',
-                        text=json.dumps(formatted_emails, indent=2),
-                    )
-                ]
-            else:
-                return [types.TextContent(type='text', text=str(unread_emails))]
+            progress = ToolProgress.for_request(server)
+            formatted_emails = []
+            try:
+                # Report each page as it arrives so the client can start on it early
+                async for page in gmail_service.iter_emails_details(UNREAD_QUERY):
+                    formatted_page = []
+                    for email in page:
+                        body = email.get('body', '')
+                        body_preview = body.replace('\n', ' ')
+
+                        formatted_email = {
+                            'id': email.get('id', ''),
+                            'subject': email.get('subject', ''),
+                            'sender': email.get('sender', ''),
+                            'body': body_preview,
+                        }
+                        formatted_page.append(formatted_email)
+                    formatted_emails.extend(formatted_page)
+                    await progress.advance(len(formatted_page))
+                    await progress.partial_result(formatted_page)
+            except HttpError as error:
+                logger.error(f'An HttpError occurred: {error}')
+                return [types.TextContent(type='text', text=f'An HttpError occurred: {error}')]
+
+            return [
+                types.TextContent(
+                    type='text',
+                    text=json.dumps(formatted_emails, indent=2),
+                )
+            ]
         elif name == 'search-emails':
             if not arguments or 'query' not in arguments:
                 return [
@@ -151,43 +494,139 @@ async def gmail_mcp():
                 ]
 
             query = arguments['query']
-            search_results = await gmail_service.search_emails(query)
-
-            # Format as JSON strings with specific fields for each email
-            if isinstance(search_results, list):
-                formatted_emails = []
-                for email in search_results:
-                    email = cast(dict, email)
-                    body = email.get('body', '')
-
-                    formatted_email = {
-                        'id': email.get('id', ''),
-                        'subject': email.get('subject', ''),
-                        'sender': email.get('sender', ''),
-                        'body': body,  # trim?
-                    }
-                    formatted_emails.append(formatted_email)
-
+            body_policy = arguments.get('body') or (
+                'snippet' if arguments.get('metadata_only') else 'truncate'
+            )
+            if body_policy not in BODY_POLICIES:
                 return [
                     types.TextContent(
                         type='text',
-                        text=json.dumps(formatted_emails, indent=2),
+                        text=f'Invalid body policy {body_policy}, expected one of {BODY_POLICIES}',
                     )
                 ]
+            page_size = min(
+                max(int(arguments.get('page_size') or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE
+            )
+            max_body_chars = int(arguments.get('max_body_chars') or DEFAULT_MAX_BODY_CHARS)
+
+            try:
+                offset = decode_cursor(arguments['cursor'], query) if arguments.get('cursor') else 0
+            except ValueError as e:
+                return [types.TextContent(type='text', text=str(e))]
+
+            try:
+                page = await gmail_service.search_emails_page(
+                    query, offset=offset, limit=page_size, include_body=body_policy != 'snippet'
+                )
+            except Exception as e:
+                logger.error(f'Error searching emails: {e}')
+                return [types.TextContent(type='text', text=f'Error searching emails: {e}')]
+
+            # Keep the response under the byte budget; the rest goes to the next page
+            formatted_emails = fit_to_budget(
+                [format_email(email, body_policy, max_body_chars) for email in page['emails']],
+                max_bytes=DEFAULT_MAX_RESPONSE_BYTES,
+            )
+            if len(formatted_emails) < len(page['emails']):
+                next_offset = page['offsets'][len(formatted_emails)]
             else:
-                return [types.TextContent(type='text', text=str(search_results))]
+                next_offset = page['next_offset']
+
+            return [
+                types.TextContent(
+                    type='text',
+                    text=json.dumps(
+                        {
+                            'emails': formatted_emails,
+                            'next_cursor': encode_cursor(query, next_offset)
+                            if next_offset is not None
+                            else None,
+                        },
+                        indent=2,
+                    ),
+                )
+            ]
+
+        elif name == 'get-email':
+            if not arguments or 'email_id' not in arguments:
+                return [types.TextContent(type='text', text='Missing email_id argument')]
+
+            email_id = cast(str, arguments.get('email_id'))
+            email_details = await gmail_service.get_email_details(email_id)
+            if not isinstance(email_details, dict):
+                return [types.TextContent(type='text', text=str(email_details))]
+
+            return [
+                types.TextContent(
+                    type='text', text=json.dumps(email_details, indent=2, default=str)
+                )
+            ]
 
         elif name == 'get-email-attachments':
             if not arguments or 'email_id' not in arguments:
                 return [
                     types.TextContent(
-                        type='text', text='Query parameter is required for search-emails tool.'
+                        type='text',
+                        text='Email ID parameter is required for get-email-attachments tool.',
                     )
                 ]
 
             email_id = cast(str, arguments.get('email_id'))
-            attachments = await gmail_service.get_email_attachments(email_id)
-            return [types.TextContent(type='text', text=json.dumps(attachments, indent=2))]
+            if arguments.get('save'):
+                # Only references to the saved files go back to the client
+                response = await save_email_attachments(email_id, ToolProgress.for_request(server))
+                return [types.TextContent(type='text', text=json.dumps(response, indent=2))]
+
+            try:
+                attachments = await gmail_service.get_attachment_parts(email_id)
+            except Exception as e:
+                return [types.TextContent(type='text', text=f'Error listing attachments: {e}')]
+
+            embeddable = [
+                attachment
+                for attachment in attachments
+                if attachment['size'] <= MAX_EMBEDDED_ATTACHMENT_BYTES
+            ]
+            downloads = await asyncio.gather(
+                *(
+                    gmail_service.download_attachment(email_id, attachment)
+                    for attachment in embeddable
+                ),
+                return_exceptions=True,
+            )
+            contents = {
+                attachment['part_id']: content for attachment, content in zip(embeddable, downloads)
+            }
+
+            manifest = []
+            resources: list[types.EmbeddedResource] = []
+            for attachment in attachments:
+                uri = attachment_uri(email_id, attachment['part_id'])
+                entry = {
+                    'filename': attachment['filename'],
+                    'mimeType': attachment['mime_type'],
+                    'size': attachment['size'],
+                    'uri': uri,
+                }
+                content = contents.get(attachment['part_id'])
+                if isinstance(content, bytes):
+                    entry['embedded'] = True
+                    resources.append(embedded_attachment(uri, attachment['mime_type'], content))
+                elif isinstance(content, BaseException):
+                    entry['embedded'] = False
+                    entry['error'] = str(content)
+                else:
+                    entry['embedded'] = False
+                    entry['note'] = 'Too large to embed; read the resource uri or use save=true'
+                manifest.append(entry)
+
+            return [
+                types.TextContent(
+                    type='text',
+                    text=json.dumps({'email_id': email_id, 'attachments': manifest}, indent=2),
+                ),
+                *resources,
+            ]
 
         elif name == 'save-email-attachments':
             if not arguments or 'email_id' not in arguments:
@@ -207,89 +646,66 @@ async def gmail_mcp():
             # TODO: add directory to args
             email_id = cast(str, arguments.get('email_id'))
 
-            attachments = await gmail_service.get_email_attachments(email_id)
-
-            response = {
-                'email_id': email_id,
-                'attachments': [],
-                'summary': {'total': 0, 'successful': 0, 'failed': 0},
-            }
-
-            # Handle error response
-            if not isinstance(attachments, list):
-                response['status'] = 'error'
-                response['message'] = str(attachments)
-                return [types.TextContent(type='text', text=json.dumps(response, indent=2))]
-
-            # Handle no attachments case
-            if len(attachments) == 0:
-                response['status'] = 'success'
-                response['message'] = 'No attachments found in this email'
-                return [types.TextContent(type='text', text=json.dumps(response, indent=2))]
-
-            # Update total count
-            response['summary']['total'] = len(attachments)
-            response['status'] = 'success'
+            response = await save_email_attachments(email_id, ToolProgress.for_request(server))
+            return [types.TextContent(type='text', text=json.dumps(response, indent=2))]
 
-            # Process each attachment
-            for attachment in attachments:
-                attachment = cast(dict, attachment)
-                attachment_result = {
-                    'filename': attachment.get('filename', 'unknown'),
-                    'mimeType': attachment.get('mimeType', 'application/octet-stream'),
-                }
+        elif name == 'bulk-save-email-attachments':
+            email_ids = cast(list, (arguments or {}).get('email_ids'))
+            if not email_ids or not all(isinstance(email_id, str) for email_id in email_ids):
+                return [
+                    types.TextContent(
+                        type='text',
+                        text=json.dumps(
+                            {
+                                'status': 'error',
+                                'message': 'A non-empty email_ids list is required for '
+                                'bulk-save-email-attachments tool.',
+                            },
+                            indent=2,
+                        ),
+                    )
+                ]
+            if len(email_ids) > MAX_BULK_EMAILS:
+                return [
+                    types.TextContent(
+                        type='text',
+                        text=json.dumps(
+                            {
+                                'status': 'error',
+                                'message': f'At most {MAX_BULK_EMAILS} emails can be saved per call, '
+                                f'got {len(email_ids)}.',
+                            },
+                            indent=2,
+                        ),
+                    )
+                ]
 
-                try:
-                    filename = attachment.get('filename')
-                    mime_type = attachment.get('mimeType', 'application/octet-stream')
-                    content = attachment.get('data')
-
-                    # Skip invalid attachments but report them
-                    if not filename or not content:
-                        attachment_result['status'] = 'skipped'
-                        attachment_result['reason'] = 'Missing filename or content'
-                        response['summary']['failed'] += 1
-                        response['attachments'].append(attachment_result)
-                        continue
-
-                    safe_filename = os.path.basename(filename)  # Ensure no path traversal
-
-                    # Handle potential duplicate filenames
-                    if os.path.exists(os.path.join(file_system.base_directory, safe_filename)):
-                        now = datetime.now()
-                        current_time = now.strftime('%H:%M:%S')
-                        current_date = now.strftime('%Y-%m-%d')
-                        base, ext = os.path.splitext(safe_filename)
-                        safe_filename = f'{base}_{email_id[:8]}{ext}_{current_date}T{current_time}'
-                        attachment_result['renamed'] = True
-                        attachment_result['original_filename'] = filename
-
-                    # Save file
-                    full_path = file_system.save_file(safe_filename, mime_type, content)
-
-                    # Record success
-                    attachment_result['status'] = 'success'
-                    attachment_result['saved_path'] = full_path
-                    response['summary']['successful'] += 1
-
-                except Exception as e:
-                    attachment_result['status'] = 'error'
-                    attachment_result['error'] = str(e)
-                    response['summary']['failed'] += 1
-
-                response['attachments'].append(attachment_result)
-
-            # Add overall status message
-            if response['summary']['failed'] == 0:
-                response['message'] = (
-                    f'All {response["summary"]["total"]} {"attachments" if len(attachments) > 1 else "attachment"} saved successfully'
-                )
-            else:
-                response['message'] = (
-                    f'{response["summary"]["successful"]} of {response["summary"]["total"]} attachments saved successfully'
+            email_ids = list(dict.fromkeys(email_ids))
+            progress = ToolProgress.for_request(server)
+            await progress.advance(0, total=len(email_ids))
+            email_slots = asyncio.Semaphore(BULK_MAX_CONCURRENT_EMAILS)
+
+            async def save_one(email_id: str) -> dict:
+                async with email_slots:
+                    response = await save_email_attachments(email_id, None)
+                summary = compact_save_summary(response)
+                await progress.advance(1)
+                await progress.partial_result(summary)
+                return summary
+
+            summaries = await asyncio.gather(*(save_one(email_id) for email_id in email_ids))
+            totals = {
+                'emails': len(summaries),
+                'attachments_saved': sum(len(summary.get('saved', [])) for summary in summaries),
+                'attachments_failed': sum(len(summary.get('failed', [])) for summary in summaries),
+                'emails_failed': sum(1 for summary in summaries if summary['status'] == 'error'),
+            }
+            return [
+                types.TextContent(
+                    type='text',
+                    text=json.dumps({'summary': totals, 'emails': summaries}, indent=2),
                 )
-
-            return [types.TextContent(type='text', text=json.dumps(response, indent=2))]
+            ]
 
         elif name == 'get-email-body-as-attachment':
             if not arguments or 'email_id' not in arguments:
@@ -328,18 +744,11 @@ async def gmail_mcp():
                         )
                     ]
 
-                # Save the content to the file system
+                # Save the content to the file system, next to any file of the same name
                 safe_filename = os.path.basename(filename)
-
-                # Handle potential duplicate filenames
-                if os.path.exists(os.path.join(file_system.base_directory, safe_filename)):
-                    now = datetime.now()
-                    timestamp = now.strftime('%Y-%m-%d_%H-%M-%S')
-                    base, ext = os.path.splitext(safe_filename)
-                    safe_filename = f'{base}_{timestamp}{ext}'
-
-                # Save file
-                saved_path = file_system.save_file(safe_filename, mime_type, content)
+                saved_path = await file_system.save_file(
+                    safe_filename, mime_type, content, overwrite=False
+                )
 
                 return [
                     types.TextContent(
@@ -350,7 +759,7 @@ async def gmail_mcp():
                                 'message': 'Email content saved successfully',
                                 'email_id': email_id,
                                 'saved_path': saved_path,
-                                'filename': safe_filename,
+                                'filename': os.path.basename(saved_path),
                                 'mimeType': mime_type,
                             },
                             indent=2,
@@ -372,23 +781,36 @@ async def gmail_mcp():
                     )
                 ]
 
+        elif name == 'sync-mailbox':
+            try:
+                sync_result = await gmail_service.sync_mailbox()
+            except Exception as e:
+                logger.error(f'Error syncing mailbox: {e}')
+                return [types.TextContent(type='text', text=f'Error syncing mailbox: {e}')]
+            return [types.TextContent(type='text', text=json.dumps(sync_result, indent=2))]
+
         else:
             logger.error(f'Unknown tool: {name}')
             raise ValueError(f'Unknown tool: {name}')
 
-    async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
-        await server.run(
-            read_stream,
-            write_stream,
-            InitializationOptions(
-                server_name='gmail',
-                server_version='0.1.0',
-                capabilities=server.get_capabilities(
-                    notification_options=NotificationOptions(),
-                    experimental_capabilities={},
+    try:
+        async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
+            await server.run(
+                read_stream,
+                write_stream,
+                InitializationOptions(
+                    server_name='gmail',
+                    server_version='0.1.0',
+                    capabilities=server.get_capabilities(
+                        notification_options=NotificationOptions(),
+                        experimental_capabilities={},
+                    ),
                 ),
-            ),
-        )
+            )
+    finally:
+        # Stop the token refresh and background indexing with the server
+        if loaded_service is not None:
+            await loaded_service.aclose()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+from contextlib import asynccontextmanager, suppress
+from typing import Dict, List
+from unittest import mock
+
+import gmail_mcp
+from fs import LocalFileSystem, ThreadPoolFileSystem
+from mcp.client.session import ClientSession
+from mcp.shared.memory import create_client_server_memory_streams
+from pydantic import AnyUrl
+
+
+def attachment(part_id: str, filename: str) -> dict:
+    return {
+        'part_id': part_id,
+        'filename': filename,
+        'mime_type': 'application/pdf',
+        'size': 3,
+        'attachment_id': f'att-{part_id}',
+        'data': None,
+    }
+
+
+class FakeScheduler:
+    def metrics(self) -> dict:
+        return {'requests': 0}
+
+
+class FakeGmailService:
+    """Serves the attachments of a few emails; any other email fails to list."""
+
+    def __init__(self, attachments: Dict[str, List[dict]]):
+        self.attachments = attachments
+        self.scheduler = FakeScheduler()
+        self.listed: List[str] = []
+        self.closed = False
+
+    async def get_attachment_parts(self, email_id: str) -> List[dict]:
+        self.listed.append(email_id)
+        if email_id not in self.attachments:
+            raise ValueError(f'No email {email_id}')
+        return self.attachments[email_id]
+
+    async def save_attachments(
+        self, email_id, parts, file_system, filenames=None, overwrite=True, on_result=None
+    ):
+        saved_paths = []
+        for index, (part, filename) in enumerate(zip(parts, filenames or [])):
+            saved_path = await file_system.save_file(
+                filename,
+                part['mime_type'],
+                f'{email_id}/{part["part_id"]}'.encode(),
+                overwrite=overwrite,
+            )
+            if on_result is not None:
+                await on_result(index, saved_path)
+            saved_paths.append(saved_path)
+        return saved_paths
+
+    async def aclose(self):
+        self.closed = True
+
+
+class TestGmailMcp(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.directory = temporary_directory.name
+        self.service = FakeGmailService(
+            {
+                'a': [attachment('1', 'invoice.pdf'), attachment('2', 'receipt.pdf')],
+                'b': [attachment('1', 'invoice.pdf')],
+            }
+        )
+        self.builds = 0
+
+        def build_gmail_service(creds_file_path: str, token_path: str) -> FakeGmailService:
+            self.builds += 1
+            # Slow enough that concurrent first calls all wait for the same build
+            time.sleep(0.05)
+            return self.service
+
+        for patcher in [
+            mock.patch.object(gmail_mcp, 'build_gmail_service', build_gmail_service),
+            mock.patch.object(
+                gmail_mcp,
+                'file_system',
+                ThreadPoolFileSystem(LocalFileSystem(base_directory=self.directory)),
+            ),
+            mock.patch.dict(
+                os.environ,
+                {
+                    'CREDS_FILE_PATH': os.path.join(self.directory, 'credentials.json'),
+                    'TOKEN_JSON_PATH': os.path.join(self.directory, 'token.json'),
+                },
+            ),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @asynccontextmanager
+    async def session(self):
+        """Runs the server over in-memory streams and yields a client session to it."""
+        async with create_client_server_memory_streams() as (client_streams, server_streams):
+
+            @asynccontextmanager
+            async def stdio_server():
+                yield server_streams
+
+            with mock.patch('mcp.server.stdio.stdio_server', stdio_server):
+                server = asyncio.create_task(gmail_mcp.gmail_mcp())
+                try:
+                    async with ClientSession(*client_streams) as session:
+                        await session.initialize()
+                        yield session
+                finally:
+                    server.cancel()
+                    with suppress(asyncio.CancelledError):
+                        await server
+
+    async def call_tool(self, session: ClientSession, name: str, arguments: dict) -> dict:
+        result = await session.call_tool(name, arguments)
+        return json.loads(result.content[0].text)  # pyright: ignore
+
+    async def read_metrics(self, session: ClientSession) -> dict:
+        result = await session.read_resource(AnyUrl(gmail_mcp.METRICS_URI))
+        return json.loads(result.contents[0].text)  # pyright: ignore
+
+    async def test_service_is_built_on_first_tool_call(self):
+        async with self.session() as session:
+            await session.list_tools()
+            self.assertEqual(await self.read_metrics(session), {'scheduler': None})
+            self.assertEqual(self.builds, 0)
+
+            results = await asyncio.gather(
+                *(
+                    self.call_tool(
+                        session, 'bulk-save-email-attachments', {'email_ids': [email_id]}
+                    )
+                    for email_id in ['a', 'b']
+                )
+            )
+            self.assertEqual(self.builds, 1)
+            self.assertEqual([result['summary']['emails_failed'] for result in results], [0, 0])
+            self.assertEqual(await self.read_metrics(session), {'scheduler': {'requests': 0}})
+
+        self.assertTrue(self.service.closed)
+
+    async def test_bulk_save_email_attachments(self):
+        async with self.session() as session:
+            result = await self.call_tool(
+                session, 'bulk-save-email-attachments', {'email_ids': ['a', 'b', 'a', 'missing']}
+            )
+
+        self.assertEqual(
+            result['summary'],
+            {'emails': 3, 'attachments_saved': 3, 'attachments_failed': 0, 'emails_failed': 1},
+        )
+        # Duplicate IDs are saved once, in the order they were first given
+        self.assertEqual([email['email_id'] for email in result['emails']], ['a', 'b', 'missing'])
+        self.assertEqual(sorted(self.service.listed), ['a', 'b', 'missing'])
+
+        saved_a, saved_b, missing = result['emails']
+        self.assertEqual(saved_a['status'], 'success')
+        self.assertEqual(len(saved_a['saved']), 2)
+        self.assertEqual(os.path.basename(saved_a['saved'][1]), 'receipt.pdf')
+        # Whichever invoice.pdf is saved second goes next to the first, not over it
+        self.assertEqual(saved_b['status'], 'success')
+        self.assertNotEqual(saved_b['saved'][0], saved_a['saved'][0])
+        with open(saved_a['saved'][0]) as f:
+            self.assertEqual(f.read(), 'a/1')
+        with open(saved_b['saved'][0]) as f:
+            self.assertEqual(f.read(), 'b/1')
+
+        self.assertEqual(missing['status'], 'error')
+        self.assertIn('No email missing', missing['message'])
+        self.assertTrue(self.service.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
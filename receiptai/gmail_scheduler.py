@@ -0,0 +1,402 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple, TypedDict, TypeVar
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Gmail allows each user 250 quota units per second, averaged over a moving window
+DEFAULT_QUOTA_UNITS_PER_SECOND = 250
+
+# Quota units charged per Gmail API method; a batch is charged for each call in it
+QUOTA_UNITS: Dict[str, int] = {
+    'gmail.users.getProfile': 1,
+    'gmail.users.labels.list': 1,
+    'gmail.users.history.list': 2,
+    'gmail.users.messages.list': 5,
+    'gmail.users.messages.get': 5,
+    'gmail.users.messages.attachments.get': 5,
+}
+DEFAULT_QUOTA_UNITS = 5
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 64.0
+
+# Error reasons Gmail reports with a 403 when a rate limit, not a permission, was hit
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+# Transient server errors that are worth retrying
+RETRYABLE_STATUSES = {500, 502, 503, 504}
+
+
+class SchedulerMetrics(TypedDict):
+    requests: int
+    retries: int
+    rate_limited: int
+    failures: int
+    quota_units: int
+    throttled_seconds: float
+    quota_units_per_second: float
+
+
+def request_cost(request: Any) -> int:
+    """
+    Returns the Gmail quota units a googleapiclient request will be charged.
+
+    Args:
+        request: An HttpRequest, or a BatchHttpRequest charged for every call it holds
+
+    Returns:
+        The quota units of the request
+    """
+    batched = getattr(request, '_requests', None)
+    if isinstance(batched, dict):
+        return sum(request_cost(inner) for inner in batched.values())
+    return QUOTA_UNITS.get(getattr(request, 'methodId', ''), DEFAULT_QUOTA_UNITS)
+
+
+def _error_response(error: BaseException) -> Optional[Tuple[int, Any, str]]:
+    """Returns the (status, headers, body) of an HTTP error from googleapiclient or requests."""
+    # googleapiclient.errors.HttpError
+    resp = getattr(error, 'resp', None)
+    if resp is not None and hasattr(resp, 'status'):
+        content = getattr(error, 'content', b'')
+        body = content.decode('utf-8', errors='replace') if isinstance(content, bytes) else ''
+        return int(resp.status), resp, body
+    # requests.HTTPError
+    response = getattr(error, 'response', None)
+    if response is not None and hasattr(response, 'status_code'):
+        return int(response.status_code), response.headers, response.text
+    return None
+
+
+def _error_reasons(body: str) -> Set[str]:
+    try:
+        details = json.loads(body).get('error', {})
+    except (ValueError, AttributeError):
+        return set()
+    if not isinstance(details, dict):
+        return set()
+    return {item.get('reason') for item in details.get('errors', []) if isinstance(item, dict)}
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """
+    Checks if an error means Gmail's rate limit was exceeded.
+
+    Gmail signals this with a 429, or with a 403 whose reason is rateLimitExceeded or
+    userRateLimitExceeded.
+
+    Args:
+        error: The exception raised by a request
+
+    Returns:
+        True if the request should be retried once the rate has dropped
+    """
+    response = _error_response(error)
+    if response is None:
+        return False
+    status, _, body = response
+    return status == 429 or (status == 403 and bool(_error_reasons(body) & RATE_LIMIT_REASONS))
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """
+    Checks if a request that raised an error is worth retrying.
+
+    Args:
+        error: The exception raised by a request
+
+    Returns:
+        True for rate limit errors and transient server errors
+    """
+    if is_rate_limit_error(error):
+        return True
+    response = _error_response(error)
+    return response is not None and response[0] in RETRYABLE_STATUSES
+
+
+def retry_after_seconds(error: BaseException, now: Optional[float] = None) -> Optional[float]:
+    """
+    Reads the Retry-After header of an HTTP error.
+
+    Args:
+        error: The exception raised by a request
+        now: The current UNIX time, used when the header is an HTTP date
+
+    Returns:
+        The seconds to wait before retrying, or None if the header is missing or invalid
+    """
+    response = _error_response(error)
+    if response is None:
+        return None
+    value = response[1].get('retry-after') or response[1].get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at - (time.time() if now is None else now))
+
+
+class TokenBucket:
+    """
+    An async token bucket that meters Gmail quota units.
+
+    Units refill continuously at rate per second up to capacity. A request costing more
+    than the whole capacity (a large batch) waits for a full bucket and then takes the
+    balance negative, so it still averages out to the configured rate.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep,
+    ):
+        """
+        Initialize the token bucket, starting full.
+
+        Args:
+            rate: Units added per second.
+            capacity: Maximum units held, defaulting to one second's worth.
+            clock: Monotonic clock, in seconds.
+            sleep: Coroutine function used to wait for units.
+        """
+        if rate <= 0:
+            raise ValueError(f'rate must be positive, got {rate}')
+
+        self._rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    @property
+    def rate(self) -> float:
+        """The units added per second."""
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate: float):
+        # Units accumulated so far were earned at the old rate
+        self._refill()
+        self._rate = rate
+
+    @property
+    def available(self) -> float:
+        """The units that can be taken right now without waiting."""
+        self._refill()
+        return self._tokens
+
+    async def acquire(self, units: float) -> float:
+        """
+        Take units from the bucket, waiting until enough have accumulated.
+
+        Waiters are served in arrival order, so a large request is not starved by a
+        stream of small ones.
+
+        Args:
+            units: The units to take.
+
+        Returns:
+            The seconds spent waiting.
+        """
+        waited = 0.0
+        async with self._lock:
+            while True:
+                self._refill()
+                needed = min(units, self.capacity)
+                # Tolerate float rounding, which could otherwise leave a waiter one
+                # rounding error short forever
+                if self._tokens >= needed - 1e-9:
+                    self._tokens -= units
+                    return waited
+                delay = (needed - self._tokens) / self.rate
+                await self._sleep(delay)
+                waited += delay
+
+    def drain(self, seconds: float):
+        """
+        Empty the bucket so that no units are available for the given time.
+
+        Args:
+            seconds: How long every caller should wait before the next request.
+        """
+        self._refill()
+        self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+class GmailScheduler:
+    """
+    Schedules Gmail API calls within the per-user quota and retries rate-limited ones.
+
+    Every call first takes its cost in quota units from a shared token bucket. When
+    Gmail still answers with a rate limit error, the bucket is drained for the
+    Retry-After time (or a jittered exponential backoff) so that all callers pause,
+    and the sustained rate is halved. Each successful call then recovers a little of
+    the rate, until it is back at the configured quota. One scheduler can be shared by
+    every GmailService acting for the same user.
+    """
+
+    def __init__(
+        self,
+        quota_units_per_second: float = DEFAULT_QUOTA_UNITS_PER_SECOND,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        min_quota_units_per_second: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep,
+    ):
+        """
+        Initialize the scheduler.
+
+        Args:
+            quota_units_per_second: The sustained quota rate to schedule calls at.
+            max_retries: Retries of a call before its error is raised.
+            base_delay: Backoff before the first retry, doubled on every further retry.
+            max_delay: Upper bound of a single backoff.
+            min_quota_units_per_second: Lowest rate repeated rate limiting can reduce
+                the schedule to, defaulting to a tenth of the quota.
+            clock: Monotonic clock, in seconds.
+            sleep: Coroutine function used to wait.
+        """
+        if max_retries < 0:
+            raise ValueError(f'max_retries must not be negative, got {max_retries}')
+
+        self.max_quota_units_per_second = quota_units_per_second
+        self.min_quota_units_per_second = (
+            min_quota_units_per_second
+            if min_quota_units_per_second is not None
+            else quota_units_per_second / 10
+        )
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._sleep = sleep
+        self.bucket = TokenBucket(
+            quota_units_per_second, capacity=quota_units_per_second, clock=clock, sleep=sleep
+        )
+
+        self._requests = 0
+        self._retries = 0
+        self._rate_limited = 0
+        self._failures = 0
+        self._quota_units = 0
+        self._throttled_seconds = 0.0
+
+    def backoff_delay(self, attempt: int) -> float:
+        """
+        Returns the jittered exponential backoff before a retry.
+
+        Args:
+            attempt: The number of the retry, starting at 0.
+
+        Returns:
+            A delay drawn uniformly between half and all of the exponential backoff.
+        """
+        delay = min(self.max_delay, self.base_delay * 2**attempt)
+        return random.uniform(delay / 2, delay)
+
+    def _on_success(self):
+        # Additive increase back towards the full quota
+        self.bucket.rate = min(
+            self.max_quota_units_per_second,
+            self.bucket.rate + self.max_quota_units_per_second / 100,
+        )
+
+    def _on_rate_limited(self, delay: float):
+        self._rate_limited += 1
+        # Multiplicative decrease of the sustained rate
+        self.bucket.rate = max(self.min_quota_units_per_second, self.bucket.rate / 2)
+        self.bucket.drain(delay)
+
+    async def run(self, call: Callable[[], Awaitable[T]], cost: int = DEFAULT_QUOTA_UNITS) -> T:
+        """
+        Runs a Gmail API call within the quota, retrying it while it is rate limited.
+
+        Args:
+            call: Coroutine function making the call; it is invoked again for each retry.
+            cost: The quota units the call is charged.
+
+        Returns:
+            The result of the call
+
+        Raises:
+            The call's last exception, if it is not retryable or retries ran out
+        """
+        attempt = 0
+        while True:
+            self._throttled_seconds += await self.bucket.acquire(cost)
+            self._requests += 1
+            self._quota_units += cost
+            try:
+                result = await call()
+            except Exception as error:
+                if not is_retryable_error(error) or attempt >= self.max_retries:
+                    self._failures += 1
+                    raise
+                delay = max(retry_after_seconds(error) or 0.0, self.backoff_delay(attempt))
+                logger.warning(
+                    f'Gmail call failed ({error}), retry {attempt + 1} of {self.max_retries} '
+                    f'in {delay:.1f}s'
+                )
+                self._retries += 1
+                attempt += 1
+                if is_rate_limit_error(error):
+                    # Everyone waits, via the bucket, rather than only this call
+                    self._on_rate_limited(delay)
+                else:
+                    await self._sleep(delay)
+                continue
+            self._on_success()
+            return result
+
+    def record_rate_limited(self, attempt: int, error: Optional[BaseException] = None):
+        """
+        Backs off after part of a call was rate limited, e.g. some items of a batch.
+
+        The bucket is drained, so the retry waits when it acquires its quota units.
+
+        Args:
+            attempt: The number of the retry, starting at 0.
+            error: One of the errors being retried, for its Retry-After header.
+        """
+        delay = self.backoff_delay(attempt)
+        if error is not None:
+            delay = max(retry_after_seconds(error) or 0.0, delay)
+        self._retries += 1
+        self._on_rate_limited(delay)
+
+    def metrics(self) -> SchedulerMetrics:
+        """Return the request, retry and throttling counters and the current quota rate."""
+        return SchedulerMetrics(
+            requests=self._requests,
+            retries=self._retries,
+            rate_limited=self._rate_limited,
+            failures=self._failures,
+            quota_units=self._quota_units,
+            throttled_seconds=self._throttled_seconds,
+            quota_units_per_second=self.bucket.rate,
+        )
@@ -0,0 +1,169 @@
+import json
+import unittest
+
+import httplib2
+from gmail_scheduler import (
+    GmailScheduler,
+    TokenBucket,
+    is_rate_limit_error,
+    is_retryable_error,
+    request_cost,
+    retry_after_seconds,
+)
+from googleapiclient.errors import HttpError
+
+
+def http_error(status: int, reason: str = '', headers=None) -> HttpError:
+    resp = httplib2.Response({'status': str(status), **(headers or {})})
+    content = json.dumps({'error': {'code': status, 'errors': [{'reason': reason}]}}).encode()
+    return HttpError(resp, content)
+
+
+class FakeClock:
+    """A clock that only moves when the code under test sleeps."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeRequest:
+    def __init__(self, method_id: str):
+        self.methodId = method_id
+
+
+class FakeBatch:
+    def __init__(self, requests):
+        self._requests = {str(i): request for i, request in enumerate(requests)}
+
+
+class TestErrors(unittest.TestCase):
+    def test_rate_limit_errors(self):
+        self.assertTrue(is_rate_limit_error(http_error(429)))
+        self.assertTrue(is_rate_limit_error(http_error(403, 'userRateLimitExceeded')))
+        self.assertTrue(is_rate_limit_error(http_error(403, 'rateLimitExceeded')))
+        self.assertFalse(is_rate_limit_error(http_error(403, 'insufficientPermissions')))
+        self.assertFalse(is_rate_limit_error(http_error(404)))
+        self.assertFalse(is_rate_limit_error(ValueError('not http')))
+
+    def test_retryable_errors(self):
+        self.assertTrue(is_retryable_error(http_error(429)))
+        self.assertTrue(is_retryable_error(http_error(503)))
+        self.assertFalse(is_retryable_error(http_error(400)))
+
+    def test_retry_after(self):
+        self.assertEqual(retry_after_seconds(http_error(429, headers={'retry-after': '7'})), 7.0)
+        self.assertEqual(
+            retry_after_seconds(
+                http_error(429, headers={'retry-after': 'Thu, 01 Jan 1970 00:00:30 GMT'}), now=10
+            ),
+            20.0,
+        )
+        self.assertIsNone(retry_after_seconds(http_error(429)))
+
+    def test_request_cost(self):
+        self.assertEqual(request_cost(FakeRequest('gmail.users.getProfile')), 1)
+        self.assertEqual(request_cost(FakeRequest('gmail.users.history.list')), 2)
+        batch = FakeBatch([FakeRequest('gmail.users.messages.get')] * 3)
+        self.assertEqual(request_cost(batch), 15)
+
+
+class TestTokenBucket(unittest.IsolatedAsyncioTestCase):
+    async def test_waits_for_units(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=10, clock=clock, sleep=clock.sleep)
+        self.assertEqual(await bucket.acquire(10), 0)
+        self.assertAlmostEqual(await bucket.acquire(5), 0.5)
+        self.assertAlmostEqual(clock.now, 0.5)
+
+    async def test_request_larger_than_capacity_goes_into_debt(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=10, clock=clock, sleep=clock.sleep)
+        await bucket.acquire(30)
+        self.assertAlmostEqual(await bucket.acquire(10), 3.0)
+
+    async def test_drain(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=10, clock=clock, sleep=clock.sleep)
+        bucket.drain(2)
+        self.assertAlmostEqual(await bucket.acquire(1), 2.1)
+
+
+class TestGmailScheduler(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = GmailScheduler(
+            quota_units_per_second=100, max_retries=3, clock=self.clock, sleep=self.clock.sleep
+        )
+
+    async def test_success(self):
+        async def call():
+            return 'ok'
+
+        self.assertEqual(await self.scheduler.run(call, cost=5), 'ok')
+        metrics = self.scheduler.metrics()
+        self.assertEqual(metrics['requests'], 1)
+        self.assertEqual(metrics['quota_units'], 5)
+        self.assertEqual(metrics['retries'], 0)
+
+    async def test_retries_rate_limit_honouring_retry_after(self):
+        errors = [http_error(429, headers={'retry-after': '30'})]
+
+        async def call():
+            if errors:
+                raise errors.pop()
+            return 'ok'
+
+        self.assertEqual(await self.scheduler.run(call), 'ok')
+        self.assertGreaterEqual(self.clock.now, 30)
+        metrics = self.scheduler.metrics()
+        self.assertEqual(metrics['retries'], 1)
+        self.assertEqual(metrics['rate_limited'], 1)
+        self.assertLess(metrics['quota_units_per_second'], 100)
+
+    async def test_rate_recovers_after_successes(self):
+        self.scheduler.record_rate_limited(0)
+        self.assertEqual(self.scheduler.bucket.rate, 50)
+
+        async def call():
+            return 'ok'
+
+        for _ in range(60):
+            await self.scheduler.run(call, cost=1)
+        self.assertEqual(self.scheduler.bucket.rate, 100)
+
+    async def test_gives_up_after_max_retries(self):
+        async def call():
+            raise http_error(503)
+
+        with self.assertRaises(HttpError):
+            await self.scheduler.run(call)
+        metrics = self.scheduler.metrics()
+        self.assertEqual(metrics['requests'], 4)
+        self.assertEqual(metrics['failures'], 1)
+
+    async def test_does_not_retry_client_errors(self):
+        async def call():
+            raise http_error(404)
+
+        with self.assertRaises(HttpError):
+            await self.scheduler.run(call)
+        self.assertEqual(self.scheduler.metrics()['requests'], 1)
+
+    def test_backoff_is_jittered_and_capped(self):
+        for attempt in range(10):
+            delay = self.scheduler.backoff_delay(attempt)
+            expected = min(self.scheduler.max_delay, self.scheduler.base_delay * 2**attempt)
+            self.assertGreaterEqual(delay, expected / 2)
+            self.assertLessEqual(delay, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,40 +1,225 @@
+import asyncio
 import base64
+import functools
+import html
 import json
 import logging
 import os
-from base64 import urlsafe_b64decode
-from email import message_from_bytes
-from email.header import decode_header
-from typing import Any, Dict, List, Union, cast
-from datetime import datetime
-
-from bs4 import BeautifulSoup, Tag
-from bs4.element import NavigableString
-from fs import AttachmentResponse
-from google.auth.transport.requests import Request
+import tempfile
+import threading
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.parser import BytesHeaderParser
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    TypedDict,
+    TypeVar,
+    Union,
+    cast,
+)
+
+import httplib2
+from attachment_stream import Base64UrlDecoder, decode_json_data_field
+from email_types import Attachment, Email, EmailInterface, LazyEmail
+from fs import AsyncFileSystem, AttachmentResponse, FileSystem
+from gmail_scheduler import QUOTA_UNITS, GmailScheduler, is_rate_limit_error, request_cost
+from google.auth.transport.requests import AuthorizedSession, Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError
-from email_types import EmailInterface, Attachment
-from email_types import Email
-from email.utils import parsedate_to_datetime
+from mail_index import IndexQuery, MailIndex, MessageText, parse_search_query
+from message_cache import MessageCache
+from parsed_message import ParsedMessage, decode_mime_header
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def decode_mime_header(header: str) -> str:
-    """Helper function to decode encoded email headers"""
-    decoded_parts = decode_header(header)
-    decoded_string = ''
-    for part, encoding in decoded_parts:
-        if isinstance(part, bytes):
-            decoded_string += part.decode(encoding or 'utf-8', errors='replace')
-        else:
-            decoded_string += part
-    return decoded_string
+# Gmail rejects batch requests with more than 100 calls and recommends staying at or
+# below 50 to avoid tripping per-user rate limits on the individual calls.
+MAX_BATCH_SIZE = 100
+DEFAULT_BATCH_SIZE = 50
+
+# Gmail starts rejecting requests with "Too many concurrent requests for user" well before
+# its per-user quota of 250 units per second is reached, so keep the in-flight count small.
+DEFAULT_MAX_CONCURRENT_REQUESTS = 10
+
+# Raw bytes of parsed messages kept in memory so one workflow never refetches a message
+DEFAULT_PARSED_MESSAGE_MEMORY_BYTES = 64 * 1024 * 1024
+
+# Searches answered from the mail index sync it first, at most this often
+DEFAULT_INDEX_SYNC_SECONDS = 30.0
+
+# Access tokens are refreshed this long before they expire, so no call ever sees an
+# expired token, and retried this long after a failed refresh
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+TOKEN_REFRESH_RETRY_SECONDS = 30.0
+
+
+class BatchFetchResult(TypedDict):
+    """Result of a batched message fetch.
+
+    messages maps message ID to the Gmail API message resource, in request order.
+    errors maps message ID to the error message for calls that failed.
+    """
+
+    messages: Dict[str, Dict[str, Any]]
+    errors: Dict[str, str]
+
+
+class RawFetchResult(TypedDict):
+    """Result of fetching raw messages through the message cache.
+
+    messages maps message ID to the raw RFC822 bytes of the message, in request order.
+    errors maps message ID to the error message for messages that could not be fetched.
+    """
+
+    messages: Dict[str, bytes]
+    errors: Dict[str, str]
+
+
+class AttachmentPart(TypedDict):
+    """An attachment found in a message's MIME tree, before its content is downloaded.
+
+    Small attachments arrive inline as base64url data; larger ones only carry the
+    attachment_id their content is downloaded with.
+    """
+
+    part_id: str
+    filename: str
+    mime_type: str
+    size: int
+    attachment_id: Optional[str]
+    data: Optional[str]
+
+
+class SearchPage(TypedDict):
+    """One page of search results.
+
+    emails holds LazyEmail objects, with bodies already loaded if they were requested.
+    offsets holds the position of each email in the full results; emails that could
+    not be fetched are missing from the page, so positions may skip.
+    next_offset is where the next page starts, or None if this is the last page.
+    """
+
+    emails: List[LazyEmail]
+    offsets: List[int]
+    next_offset: Optional[int]
+
+
+class SyncResult(TypedDict):
+    """Summary of a mailbox sync."""
+
+    full_sync: bool
+    added: int
+    deleted: int
+    labels_changed: int
+    history_id: str
+
+
+T = TypeVar('T')
+
+# Headers requested when fetching messages with format='metadata'
+METADATA_HEADERS = ['Subject', 'From', 'To', 'Date']
+
+UNREAD_QUERY = 'in:inbox is:unread'
+
+# History record types the mailbox sync applies to the local index
+SYNC_HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+
+GMAIL_API_URL = 'https://gmail.googleapis.com/gmail/v1'
+
+# Messages downloaded at a time when adding synced mail to the full-text index
+TEXT_INDEX_CHUNK_SIZE = 100
+
+# Passes that may fail to download a message before it is indexed without its text
+MAX_TEXT_INDEX_ATTEMPTS = 3
+
+# Encoded bytes read per chunk when streaming an attachment to a file system, which
+# bounds the memory a download needs regardless of the attachment size
+ATTACHMENT_CHUNK_BYTES = 256 * 1024
+
+# Attachments of one message downloaded at once; each also takes a request slot
+DEFAULT_MAX_CONCURRENT_ATTACHMENTS = 4
+
+
+@functools.lru_cache(maxsize=None)
+def gmail_discovery_document() -> Optional[str]:
+    """
+    Returns the Gmail v1 discovery document bundled with googleapiclient.
+
+    It is read once per process. The serialized document is cached rather than the
+    parsed one, because build_from_document modifies the dictionary it is given.
+
+    Returns:
+        The discovery document JSON, or None if this googleapiclient has none bundled
+    """
+    return get_static_doc('gmail', 'v1')
+
+
+def token_refresh_delay(
+    expiry: Optional[datetime], now: datetime, margin: timedelta = TOKEN_REFRESH_MARGIN
+) -> Optional[float]:
+    """
+    Returns how long to wait before refreshing an access token ahead of its expiry.
+
+    Args:
+        expiry: The naive UTC expiry of the token, as google-auth stores it.
+        now: The current naive UTC time.
+        margin: How long before the expiry to refresh.
+
+    Returns:
+        The seconds to wait, 0 if the token should be refreshed now, or None if the
+        token does not expire
+    """
+    if expiry is None:
+        return None
+    return max(0.0, (expiry - margin - now).total_seconds())
+
+
+_shared_services: Dict[Any, 'GmailService'] = {}
+_shared_services_lock = threading.Lock()
+
+
+def get_shared_gmail_service(
+    creds_file_path: str, token_path: str, **kwargs: Any
+) -> 'GmailService':
+    """
+    Returns the process-wide GmailService for a token, creating it on first use.
+
+    Building a service loads and possibly refreshes the token and builds the discovery
+    client, so every caller in the process shares one service instead. The service
+    keeps its token fresh in the background for as long as the process runs.
+
+    Args:
+        creds_file_path: Path to the OAuth client secrets file.
+        token_path: Path to the cached OAuth token.
+        **kwargs: Further GmailService arguments, only used when the service is created.
+
+    Returns:
+        The shared GmailService
+    """
+    key = (os.path.abspath(creds_file_path), os.path.abspath(token_path))
+    with _shared_services_lock:
+        service = _shared_services.get(key)
+        if service is None:
+            service = GmailService(creds_file_path, token_path, **kwargs)
+            _shared_services[key] = service
+        return service
 
 
 class GmailService(EmailInterface):
@@ -43,11 +228,73 @@ class GmailService(EmailInterface):
         creds_file_path: str,
         token_path: str,
         scopes: List[str] = ['https://www.googleapis.com/auth/gmail.readonly'],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_concurrent_requests: int = DEFAULT_MAX_CONCURRENT_REQUESTS,
+        message_cache: Optional[MessageCache] = None,
+        mail_index: Optional[MailIndex] = None,
+        sync_label: Optional[str] = 'INBOX',
+        full_text_index: bool = False,
+        index_sync_seconds: float = DEFAULT_INDEX_SYNC_SECONDS,
+        parsed_message_memory_bytes: int = DEFAULT_PARSED_MESSAGE_MEMORY_BYTES,
+        scheduler: Optional[GmailScheduler] = None,
     ):
-        """Initialize Gmail service with credentials"""
+        """Initialize Gmail service with credentials
+
+        Args:
+            creds_file_path: Path to the OAuth client secrets file.
+            token_path: Path to the cached OAuth token.
+            scopes: OAuth scopes to request.
+            batch_size: Number of message GETs sent per HTTP batch request (1-100).
+            max_concurrent_requests: Maximum number of Gmail API calls in flight at once.
+            message_cache: Optional on-disk cache that raw messages are served from.
+            mail_index: Optional local index kept current with incremental mailbox syncs,
+                used to answer unread and label-only queries without re-listing Gmail.
+            sync_label: The label whose messages are fully mirrored in the mail index, or
+                None to mirror the whole mailbox. Only queries scoped to the label are
+                answered from the index; with None, queries without a label are too.
+            full_text_index: Also index the body text and attachment filenames of synced
+                messages, so free-text searches are answered from the mail index. Each
+                synced message is downloaded once for this, in the background and
+                bypassing the message cache, so it is off unless asked for.
+            index_sync_seconds: Seconds an indexed search trusts the last sync for before
+                syncing again.
+            parsed_message_memory_bytes: Raw message bytes kept in memory as parsed messages.
+            scheduler: Scheduler keeping calls within the Gmail quota, which may be shared
+                by every service acting for the same user.
+        """
+        if not 1 <= batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f'batch_size must be between 1 and {MAX_BATCH_SIZE}, got {batch_size}')
+
         self.creds_file_path = creds_file_path
         self.token_path = token_path
         self.scopes = scopes
+        self.batch_size = batch_size
+        self.message_cache = message_cache
+        self.mail_index = mail_index
+        self.sync_label = sync_label
+        self.full_text_index = full_text_index
+        self.index_sync_seconds = index_sync_seconds
+        self._sync_lock = asyncio.Lock()
+        self._synced_at: Optional[float] = None
+        self._text_index_task: Optional[asyncio.Task[None]] = None
+        self._initial_sync_task: Optional[asyncio.Task[None]] = None
+        self._text_index_requested = False
+        # Failed downloads of each message not yet in the full-text index
+        self._text_index_attempts: Dict[str, int] = {}
+        self.parsed_message_memory_bytes = parsed_message_memory_bytes
+        self._parsed_messages: OrderedDict[str, ParsedMessage] = OrderedDict()
+        self._parsed_messages_bytes = 0
+        self._parsed_message_fetches: Dict[str, asyncio.Future[ParsedMessage]] = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_requests, thread_name_prefix='gmail-api'
+        )
+        self._request_slots = asyncio.Semaphore(max_concurrent_requests)
+        self._thread_local = threading.local()
+        self.scheduler = scheduler or GmailScheduler()
+        # Bumped whenever the token is replaced, so worker threads rebuild their clients
+        self._token_generation = 0
+        self._refresh_task: Optional[asyncio.Task[None]] = None
+        self._closed = False
         self.token = self._get_token()
         self.service = self._get_service()
 
@@ -108,266 +355,1516 @@ class GmailService(EmailInterface):
                 )
 
         if token:
-            with open(self.token_path, 'w') as token_file:
-                token_file.write(token.to_json())
-                logger.info(f'Token saved to {self.token_path}')
+            self._save_token(token)
+            logger.info(f'Token saved to {self.token_path}')
 
         return token
 
+    def _save_token(self, token: Credentials):
+        """
+        Writes the token to a temporary file next to token_path, then renames it into place.
+
+        Another service or process loading the token sees either the previous token or
+        the new one, never a partial write.
+        """
+        temp_fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.token_path)), prefix='.', suffix='.tmp'
+        )
+        try:
+            with os.fdopen(temp_fd, 'w') as token_file:
+                token_file.write(token.to_json())
+            os.replace(temp_path, self.token_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
     def _get_service(self) -> Any:
         """Initialize Gmail API service"""
         try:
-            service = build('gmail', 'v1', credentials=self.token)
-            return service
+            return self._build_service(self.token)
         except HttpError as error:
             logger.error(f'An error occurred building Gmail service: {error}')
             raise ValueError(f'An error occurred: {error}')
 
-    async def get_unread_emails(self) -> Union[List[Dict[str, str]], str]:
+    @staticmethod
+    def _build_service(token: Credentials) -> Any:
+        """Builds the discovery client from the cached discovery document."""
+        document = gmail_discovery_document()
+        if document is None:
+            return build('gmail', 'v1', credentials=token)
+        return build_from_document(document, credentials=token)
+
+    def _get_http(self) -> AuthorizedHttp:
         """
-        Retrieves unread messages from mailbox with details.
-        Returns list of email objects with id, subject, sender, and body.
+        Returns the authorized HTTP object for the calling worker thread.
+
+        httplib2 connections are not thread-safe, so each worker thread gets its own
+        AuthorizedHttp sharing the service credentials.
         """
-        try:
-            user_id = 'me'
-            query = 'in:inbox is:unread'  #
-
-            response = self.service.users().messages().list(userId=user_id, q=query).execute()
-
-            messages = []
-            if 'messages' in response:
-                messages.extend(response['messages'])
-
-            # Handle pagination for large numbers of unread emails
-            while 'nextPageToken' in response:
-                page_token = response['nextPageToken']
-                response = (
-                    self.service.users()
-                    .messages()
-                    .list(userId=user_id, q=query, pageToken=page_token)
-                    .execute()
+        local = self._thread_local
+        if getattr(local, 'http_generation', None) != self._token_generation:
+            local.http = AuthorizedHttp(self.token, http=httplib2.Http())
+            local.http_generation = self._token_generation
+        return local.http
+
+    def _get_session(self) -> AuthorizedSession:
+        """
+        Returns the authorized requests session for the calling worker thread.
+
+        Used for streamed downloads, which googleapiclient cannot do for JSON responses.
+        """
+        local = self._thread_local
+        if getattr(local, 'session_generation', None) != self._token_generation:
+            local.session = AuthorizedSession(self.token)
+            local.session_generation = self._token_generation
+        return local.session
+
+    def _refresh_token_blocking(self) -> Credentials:
+        """Refreshes a copy of the token, so calls using the current one are unaffected."""
+        token = Credentials.from_authorized_user_info(json.loads(self.token.to_json()), self.scopes)
+        token.refresh(Request())
+        self._save_token(token)
+        return token
+
+    async def refresh_token(self):
+        """
+        Refreshes the access token and swaps it in without blocking in-flight calls.
+
+        The refreshed token gets a new discovery client and, on each worker thread, new
+        HTTP clients the next time that thread starts a call. Calls already running keep
+        the objects they started with.
+        """
+        loop = asyncio.get_running_loop()
+        token = await loop.run_in_executor(None, self._refresh_token_blocking)
+        service = await loop.run_in_executor(None, self._build_service, token)
+        self.token = token
+        self.service = service
+        self._token_generation += 1
+        logger.info(f'Token refreshed, next expiry {token.expiry}')
+
+    async def _refresh_token_loop(self):
+        """Keeps the token refreshed ahead of its expiry for as long as the service runs."""
+        while True:
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            delay = token_refresh_delay(self.token.expiry, now)
+            if delay is None:
+                return
+            await asyncio.sleep(delay)
+            try:
+                await self.refresh_token()
+            except Exception as e:
+                logger.error(f'Error refreshing token in the background: {e}')
+                await asyncio.sleep(TOKEN_REFRESH_RETRY_SECONDS)
+
+    def _ensure_token_refresh(self):
+        """Starts the background token refresh on the running event loop, once."""
+        if self._closed:
+            return
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        if not getattr(self.token, 'refresh_token', None):
+            return
+        self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_token_loop())
+
+    def stop_token_refresh(self):
+        """Stops the background token refresh; the next call starts it again."""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    async def aclose(self):
+        """
+        Stops the service's background work and releases its worker threads.
+
+        The token refresh, initial sync and text indexing tasks are cancelled and awaited,
+        and a shared service is dropped from the process-wide registry, so the next caller
+        builds a new one. The message cache and mail index belong to the caller and are
+        left open.
+        """
+        self._closed = True
+        tasks = [
+            task
+            for task in (self._refresh_task, self._initial_sync_task, self._text_index_task)
+            if task is not None
+        ]
+        self._refresh_task = None
+        self._initial_sync_task = None
+        self._text_index_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        with _shared_services_lock:
+            for key, service in list(_shared_services.items()):
+                if service is self:
+                    del _shared_services[key]
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _execute(self, request: Any) -> Any:
+        """
+        Executes a googleapiclient request (or batch request) off the event loop.
+
+        The blocking execute() call runs on the service's bounded thread pool, and the
+        request semaphore caps how many calls are in flight at once so bursts stay
+        under Gmail's per-user concurrency limit. The scheduler keeps calls within the
+        per-user quota and retries rate-limited and transient failures.
+
+        Args:
+            request: An HttpRequest or BatchHttpRequest
+
+        Returns:
+            The deserialized response of the request
+        """
+
+        self._ensure_token_refresh()
+
+        async def call() -> Any:
+            async with self._request_slots:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    self._executor, lambda: request.execute(http=self._get_http())
                 )
-                if 'messages' in response:
-                    messages.extend(response['messages'])
 
-            logger.info(f'Found {len(messages)} unread emails')
+        return await self.scheduler.run(call, cost=request_cost(request))
 
-            # Get detailed information for each message
-            detailed_messages = []
-            for msg in messages:
-                email_details = await self.get_email_details(msg['id'])
-                if isinstance(email_details, dict):
-                    detailed_messages.append(email_details)
+    async def _iter_message_id_pages(
+        self, query: Optional[str] = None, label_ids: Optional[List[str]] = None
+    ) -> AsyncIterator[List[str]]:
+        """
+        Lists the IDs of all messages matching a query, one results page at a time.
 
-            return detailed_messages
+        Args:
+            query: The Gmail search query string
+            label_ids: Label IDs every listed message must carry
 
-        except HttpError as error:
-            error_msg = f'An HttpError occurred: {str(error)}'
-            logger.error(error_msg)
-            return error_msg
+        Yields:
+            The message IDs of each results page in the order Gmail returned them
+        """
+        user_id = 'me'
+        page_token = None
 
-    async def get_email_details(self, email_id: str) -> Dict[str, str] | str:
+        # Handle pagination for large numbers of results
+        while True:
+            response = await self._execute(
+                self.service.users()
+                .messages()
+                .list(userId=user_id, q=query, labelIds=label_ids, pageToken=page_token)
+            )
+            yield [msg['id'] for msg in response.get('messages', [])]
+
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+
+    async def _batch_get_messages(
+        self,
+        email_ids: List[str],
+        format: str = 'raw',
+        metadata_headers: Optional[List[str]] = None,
+    ) -> BatchFetchResult:
         """
-        Retrieves email contents including subject, sender, body content, and attachments.
+        Fetches many messages using Gmail HTTP batch requests.
+
+        Message GETs are grouped into batches of at most self.batch_size calls, so N
+        messages cost ceil(N / batch_size) round trips rather than N, and the batches
+        are sent concurrently. A failure on one message is recorded in the result's
+        errors and does not affect the rest of the batch.
+
+        Args:
+            email_ids: The IDs of the messages to fetch
+            format: The Gmail message format to request
+            metadata_headers: Headers to include when format is 'metadata'
+
+        Returns:
+            A BatchFetchResult with the fetched messages and per-message errors
         """
+        fetched: Dict[str, Dict[str, Any]] = {}
+        errors: Dict[str, str] = {}
+
+        async def execute_batch(chunk: List[str]):
+            pending = chunk
+            attempt = 0
+            while pending:
+                rate_limited: Dict[str, Exception] = {}
+
+                def on_response(
+                    request_id: str, response: Dict[str, Any], exception: Exception | None
+                ):
+                    if exception is None:
+                        fetched[request_id] = response
+                        errors.pop(request_id, None)
+                        return
+                    errors[request_id] = str(exception)
+                    if is_rate_limit_error(exception):
+                        rate_limited[request_id] = exception
+                    else:
+                        logger.warning(f'Error fetching email {request_id}: {exception}')
+
+                batch = self.service.new_batch_http_request(callback=on_response)
+                for email_id in pending:
+                    batch.add(
+                        self.service.users()
+                        .messages()
+                        .get(
+                            userId='me',
+                            id=email_id,
+                            format=format,
+                            metadataHeaders=metadata_headers,
+                        ),
+                        request_id=email_id,
+                    )
+                try:
+                    await self._execute(batch)
+                except HttpError as error:
+                    # The batch request itself failed, so every message in it failed
+                    for email_id in pending:
+                        errors.setdefault(email_id, str(error))
+                    logger.error(f'An HttpError occurred executing batch request: {error}')
+                    return
+
+                # Individual calls in a batch are rate limited separately, so retry those
+                pending = list(rate_limited)
+                if pending and attempt >= self.scheduler.max_retries:
+                    logger.error(f'Giving up on {len(pending)} rate limited emails')
+                    return
+                if pending:
+                    logger.warning(f'Retrying {len(pending)} rate limited emails')
+                    self.scheduler.record_rate_limited(attempt, next(iter(rate_limited.values())))
+                    attempt += 1
+
+        # Duplicate request IDs are rejected by the batch, so dedupe while keeping order
+        unique_ids = list(dict.fromkeys(email_ids))
+        await asyncio.gather(
+            *(
+                execute_batch(unique_ids[start : start + self.batch_size])
+                for start in range(0, len(unique_ids), self.batch_size)
+            )
+        )
+
+        messages = {email_id: fetched[email_id] for email_id in unique_ids if email_id in fetched}
+        return BatchFetchResult(messages=messages, errors=errors)
+
+    def _cache_raw_message(self, email_id: str, raw: bytes, msg: Dict[str, Any]):
+        """
+        Stores a freshly fetched raw message and its metadata in the message cache.
+
+        Args:
+            email_id: The ID of the message
+            raw: The decoded RFC822 bytes of the message
+            msg: The Gmail API message resource the bytes came from
+        """
+        if self.message_cache is None:
+            return
+
+        headers = BytesHeaderParser().parsebytes(raw)
+        metadata = {
+            'id': email_id,
+            'threadId': msg.get('threadId'),
+            'historyId': msg.get('historyId'),
+            'labelIds': msg.get('labelIds', []),
+            'internalDate': msg.get('internalDate'),
+            'sizeEstimate': msg.get('sizeEstimate'),
+            'subject': decode_mime_header(headers.get('subject', 'No Subject')),
+            'sender': headers.get('from', 'Unknown Sender'),
+            'to': headers.get('to', 'Unknown Recipient'),
+            'date': headers.get('date'),
+        }
         try:
-            msg = (
+            self.message_cache.put(email_id, raw, metadata)
+        except Exception as e:
+            logger.error(f'Error caching email {email_id}: {str(e)}')
+
+    def _get_cached_raw_messages_blocking(self, email_ids: List[str]) -> Dict[str, bytes]:
+        """Reads messages from the message cache, leaving out those not cached."""
+        if self.message_cache is None:
+            return {}
+        raw_messages = {}
+        for email_id in email_ids:
+            raw = self.message_cache.get_raw(email_id)
+            if raw is not None:
+                raw_messages[email_id] = raw
+        return raw_messages
+
+    async def _get_cached_raw_messages(self, email_ids: List[str]) -> Dict[str, bytes]:
+        """Reads messages from the message cache on a worker thread, off the event loop."""
+        if self.message_cache is None or not email_ids:
+            return {}
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._get_cached_raw_messages_blocking, email_ids)
+
+    def _store_raw_messages_blocking(
+        self, msgs: Dict[str, Dict[str, Any]], cache: bool = True
+    ) -> Dict[str, bytes]:
+        """Decodes messages fetched with format='raw' and, with cache, adds them to the
+        message cache."""
+        raw_messages = {}
+        for email_id, msg in msgs.items():
+            raw_messages[email_id] = urlsafe_b64decode(msg['raw'])
+            if cache:
+                self._cache_raw_message(email_id, raw_messages[email_id], msg)
+        return raw_messages
+
+    async def _store_raw_messages(
+        self, msgs: Dict[str, Dict[str, Any]], cache: bool = True
+    ) -> Dict[str, bytes]:
+        """Decodes and caches messages fetched with format='raw' on a worker thread."""
+        if not msgs:
+            return {}
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._store_raw_messages_blocking, msgs, cache)
+
+    async def _index_call(self, function: Callable[..., T], *args: Any) -> T:
+        """
+        Calls a mail index method on a worker thread, off the event loop.
+
+        Another process writing to the shared index can keep a call waiting for up to
+        mail_index.BUSY_TIMEOUT_SECONDS, which must not stall the rest of the server.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, function, *args)
+
+    async def _get_indexed_messages(self, email_ids: List[str]) -> List[Dict[str, Any]]:
+        """Reads the indexed metadata of messages, leaving out those not indexed."""
+        assert self.mail_index is not None, 'Indexed queries require a mail index'
+        mail_index = self.mail_index
+
+        def read() -> List[Dict[str, Any]]:
+            indexed = (mail_index.get_message(email_id) for email_id in email_ids)
+            return [message for message in indexed if message is not None]
+
+        return await self._index_call(read)
+
+    async def _get_raw_message(self, email_id: str) -> bytes:
+        """
+        Gets the raw RFC822 bytes of a message, from the message cache when possible.
+
+        Args:
+            email_id: The ID of the message
+
+        Returns:
+            The raw message bytes
+
+        Raises:
+            HttpError: If the message is not cached and could not be fetched
+        """
+        cached = await self._get_cached_raw_messages([email_id])
+        if email_id in cached:
+            return cached[email_id]
+
+        msg = await self._execute(
+            self.service.users().messages().get(userId='me', id=email_id, format='raw')
+        )
+        return (await self._store_raw_messages({email_id: msg}))[email_id]
+
+    async def _get_raw_messages(self, email_ids: List[str], cache: bool = True) -> RawFetchResult:
+        """
+        Gets the raw RFC822 bytes of many messages, batch-fetching only cache misses.
+
+        Args:
+            email_ids: The IDs of the messages to fetch
+            cache: Add the fetched misses to the message cache; bulk downloads leave it
+                out, so they do not evict the messages it is kept for
+
+        Returns:
+            A RawFetchResult with the raw messages and per-message errors
+        """
+        raw_messages = await self._get_cached_raw_messages(email_ids)
+        missing_ids = [email_id for email_id in email_ids if email_id not in raw_messages]
+
+        errors: Dict[str, str] = {}
+        if missing_ids:
+            result = await self._batch_get_messages(missing_ids, format='raw')
+            errors = result['errors']
+            raw_messages.update(await self._store_raw_messages(result['messages'], cache))
+
+        messages = {
+            email_id: raw_messages[email_id]
+            for email_id in dict.fromkeys(email_ids)
+            if email_id in raw_messages
+        }
+        return RawFetchResult(messages=messages, errors=errors)
+
+    def _remember_parsed_message(self, parsed: ParsedMessage):
+        """
+        Keeps a parsed message in memory, dropping the least recently used ones once the
+        raw bytes held exceed the parsed message memory budget.
+
+        Args:
+            parsed: The parsed message
+        """
+        previous = self._parsed_messages.pop(parsed.id, None)
+        if previous is not None:
+            self._parsed_messages_bytes -= len(previous.raw)
+        self._parsed_messages[parsed.id] = parsed
+        self._parsed_messages_bytes += len(parsed.raw)
+
+        while (
+            self._parsed_messages_bytes > self.parsed_message_memory_bytes and self._parsed_messages
+        ):
+            _, evicted = self._parsed_messages.popitem(last=False)
+            self._parsed_messages_bytes -= len(evicted.raw)
+
+    def _recall_parsed_message(self, email_id: str) -> Optional[ParsedMessage]:
+        """
+        Gets a parsed message kept in memory, marking it as recently used.
+
+        Args:
+            email_id: The ID of the message
+
+        Returns:
+            The parsed message, or None if it is not held in memory
+        """
+        parsed = self._parsed_messages.get(email_id)
+        if parsed is not None:
+            self._parsed_messages.move_to_end(email_id)
+        return parsed
+
+    async def _fetch_parsed_message(self, email_id: str) -> ParsedMessage:
+        parsed = ParsedMessage(email_id, await self._get_raw_message(email_id))
+        self._remember_parsed_message(parsed)
+        return parsed
+
+    async def get_parsed_message(self, email_id: str) -> ParsedMessage:
+        """
+        Gets a message parsed from a single raw download.
+
+        Parsed messages are kept in memory and raw bytes in the message cache, so body,
+        metadata and attachment lookups for the same message share one fetch, including
+        lookups made concurrently.
+
+        Args:
+            email_id: The ID of the message
+
+        Returns:
+            The parsed message
+
+        Raises:
+            HttpError: If the message could not be fetched
+        """
+        parsed = self._recall_parsed_message(email_id)
+        if parsed is not None:
+            return parsed
+
+        fetch = self._parsed_message_fetches.get(email_id)
+        if fetch is None:
+            fetch = asyncio.ensure_future(self._fetch_parsed_message(email_id))
+            self._parsed_message_fetches[email_id] = fetch
+            fetch.add_done_callback(lambda _: self._parsed_message_fetches.pop(email_id, None))
+        # Shielded so one caller being cancelled does not cancel the fetch for the others
+        return await asyncio.shield(fetch)
+
+    async def _get_parsed_messages(self, email_ids: List[str]) -> List[ParsedMessage]:
+        """
+        Gets many parsed messages, batch-fetching those not held in memory or cached.
+
+        Args:
+            email_ids: The IDs of the messages to fetch
+
+        Returns:
+            The parsed messages in the order of email_ids, skipping those that could not
+            be fetched
+        """
+        parsed_messages: Dict[str, ParsedMessage] = {}
+        missing_ids = []
+        for email_id in email_ids:
+            parsed = self._recall_parsed_message(email_id)
+            if parsed is not None:
+                parsed_messages[email_id] = parsed
+            else:
+                missing_ids.append(email_id)
+
+        if missing_ids:
+            result = await self._get_raw_messages(missing_ids)
+            if result['errors']:
+                logger.warning(
+                    f'Failed to fetch {len(result["errors"])} of {len(email_ids)} emails: '
+                    f'{list(result["errors"])}'
+                )
+            for email_id, raw in result['messages'].items():
+                parsed = ParsedMessage(email_id, raw)
+                self._remember_parsed_message(parsed)
+                parsed_messages[email_id] = parsed
+
+        return [
+            parsed_messages[email_id]
+            for email_id in dict.fromkeys(email_ids)
+            if email_id in parsed_messages
+        ]
+
+    async def _get_emails_details(self, email_ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        Fetches and parses many messages, skipping those that could not be fetched.
+
+        Args:
+            email_ids: The IDs of the messages to fetch
+
+        Returns:
+            A list of email detail dictionaries, in the order of email_ids
+        """
+        detailed_messages = []
+        for parsed in await self._get_parsed_messages(email_ids):
+            try:
+                detailed_messages.append(parsed.to_details())
+            except Exception as e:
+                logger.error(f'Error parsing email {parsed.id}: {str(e)}')
+        return detailed_messages
+
+    async def _fetch_matching_pages(
+        self, query: str, fetch_page: Callable[[List[str]], Awaitable[List[T]]]
+    ) -> List[T]:
+        """
+        Lists all messages matching a query and fetches them page by page.
+
+        Each results page is fetched as soon as it is listed, so message downloads
+        overlap with listing the remaining pages.
+
+        Args:
+            query: The Gmail search query string
+            fetch_page: Coroutine function fetching the messages of one page of IDs
+
+        Returns:
+            The fetched items of every page, in the order Gmail listed them
+        """
+        page_fetches = []
+        async for page_ids in self._iter_message_id_pages(query):
+            page_fetches.append(asyncio.create_task(fetch_page(page_ids)))
+
+        try:
+            pages = await asyncio.gather(*page_fetches)
+        except BaseException:
+            for page_fetch in page_fetches:
+                page_fetch.cancel()
+            raise
+
+        return [item for page in pages for item in page]
+
+    async def _get_matching_emails_details(self, query: str) -> List[Dict[str, Any]]:
+        """
+        Fetches and parses all messages matching a query.
+
+        Args:
+            query: The Gmail search query string
+
+        Returns:
+            A list of email detail dictionaries, in the order Gmail listed them
+        """
+        return await self._fetch_matching_pages(query, self._get_emails_details)
+
+    async def _get_emails_metadata(self, email_ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        Fetches the headers and snippet of many messages without their bodies.
+
+        Args:
+            email_ids: The IDs of the messages to fetch
+
+        Returns:
+            A list of message metadata dictionaries, in the order of email_ids
+        """
+        result = await self._batch_get_messages(
+            email_ids, format='metadata', metadata_headers=METADATA_HEADERS
+        )
+        if result['errors']:
+            logger.warning(
+                f'Failed to fetch {len(result["errors"])} of {len(email_ids)} emails: '
+                f'{list(result["errors"])}'
+            )
+        return [self._parse_metadata_message(msg) for msg in result['messages'].values()]
+
+    def _lazy_email(self, metadata: Dict[str, Any]) -> LazyEmail:
+        """
+        Builds an Email from message metadata whose body is fetched when it is loaded.
+
+        Args:
+            metadata: A message metadata dictionary from the index or a metadata fetch
+
+        Returns:
+            The lazily loaded email
+        """
+        email_id = metadata['id']
+
+        async def aload_body() -> str:
+            return (await self.get_parsed_message(email_id)).body
+
+        # internalDate is when Gmail received the message, present even without a Date header
+        date = datetime.fromtimestamp(
+            int(metadata.get('internalDate') or 0) / 1000, tz=timezone.utc
+        )
+
+        return LazyEmail.from_metadata(
+            aload_body,
+            id=email_id,
+            subject=metadata.get('subject') or '',
+            from_email=metadata.get('sender') or '',
+            to_email=metadata.get('to') or '',
+            date=date,
+            snippet=html.unescape(metadata.get('snippet') or ''),
+        )
+
+    async def load_bodies(self, emails: List[LazyEmail]):
+        """
+        Loads the bodies of lazily loaded emails, batch-fetching the messages not held
+        in memory or cached.
+
+        Args:
+            emails: The emails, e.g. from a metadata-only search
+
+        Raises:
+            HttpError: If a message could not be fetched
+        """
+        unloaded = [email for email in emails if not email.body_loaded]
+        if not unloaded:
+            return
+        # Fetch the bodies in one batch; load_body() is then served from memory
+        await self._get_parsed_messages([email.id for email in unloaded])
+        await asyncio.gather(*(email.load_body() for email in unloaded))
+
+    def _parse_metadata_message(self, msg: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Parses a message fetched with format='metadata' into an index entry.
+
+        Args:
+            msg: The Gmail API message resource
+
+        Returns:
+            A dictionary with the id, labels, snippet and main headers of the message
+        """
+        headers = {
+            header['name'].lower(): header['value']
+            for header in msg.get('payload', {}).get('headers', [])
+        }
+        return {
+            'id': msg['id'],
+            'threadId': msg.get('threadId'),
+            'historyId': msg.get('historyId'),
+            'internalDate': msg.get('internalDate'),
+            'labelIds': msg.get('labelIds', []),
+            'snippet': msg.get('snippet', ''),
+            'subject': decode_mime_header(headers.get('subject', 'No Subject')),
+            'sender': headers.get('from', 'Unknown Sender'),
+            'to': headers.get('to', 'Unknown Recipient'),
+            'date': headers.get('date'),
+        }
+
+    async def _index_messages(self, mail_index: MailIndex, email_ids: List[str]):
+        """
+        Fetches the metadata of messages and stores it in the mail index.
+
+        Args:
+            mail_index: The index to update
+            email_ids: The IDs of the messages to index
+        """
+        result = await self._batch_get_messages(
+            email_ids, format='metadata', metadata_headers=METADATA_HEADERS
+        )
+        if result['errors']:
+            # Usually messages deleted since they were listed
+            logger.warning(f'Could not index {len(result["errors"])} emails')
+        await self._index_call(
+            mail_index.upsert_messages,
+            [self._parse_metadata_message(msg) for msg in result['messages'].values()],
+        )
+
+    async def _full_sync(self, mail_index: MailIndex) -> SyncResult:
+        """
+        Rebuilds the mail index from every message carrying the sync label.
+
+        Args:
+            mail_index: The index to rebuild
+
+        Returns:
+            A SyncResult describing the sync
+        """
+        # Read the historyId first so changes made while listing are picked up next sync
+        profile = await self._execute(self.service.users().getProfile(userId='me'))
+        history_id = str(profile['historyId'])
+
+        email_ids = []
+        label_ids = [self.sync_label] if self.sync_label is not None else None
+        async for page_ids in self._iter_message_id_pages(label_ids=label_ids):
+            email_ids.extend(page_ids)
+
+        await self._index_call(mail_index.clear)
+        await self._index_messages(mail_index, email_ids)
+        await self._index_call(mail_index.set_state, 'history_id', history_id)
+
+        logger.info(f'Full mailbox sync indexed {len(email_ids)} emails at history {history_id}')
+        return SyncResult(
+            full_sync=True,
+            added=len(email_ids),
+            deleted=0,
+            labels_changed=0,
+            history_id=history_id,
+        )
+
+    async def _incremental_sync(self, mail_index: MailIndex, start_history_id: str) -> SyncResult:
+        """
+        Applies the mailbox changes made since start_history_id to the mail index.
+
+        Args:
+            mail_index: The index to update
+            start_history_id: The historyId the index is synced up to
+
+        Returns:
+            A SyncResult describing the sync
+
+        Raises:
+            HttpError: With status 404 if start_history_id is too old to sync from
+        """
+        # Ordered sets of message IDs, keyed for cheap removal
+        added: Dict[str, None] = {}
+        deleted: Dict[str, None] = {}
+        labels_changed = 0
+        history_id = start_history_id
+        page_token = None
+
+        while True:
+            response = await self._execute(
                 self.service.users()
-                .messages()
-                .get(userId='me', id=email_id, format='raw')
-                .execute()
+                .history()
+                .list(
+                    userId='me',
+                    startHistoryId=start_history_id,
+                    historyTypes=SYNC_HISTORY_TYPES,
+                    pageToken=page_token,
+                )
             )
-            email_metadata = {}
 
-            email_metadata['id'] = email_id
+            for record in response.get('history', []):
+                for item in record.get('messagesAdded', []):
+                    added[item['message']['id']] = None
+                for item in record.get('messagesDeleted', []):
+                    email_id = item['message']['id']
+                    added.pop(email_id, None)
+                    deleted[email_id] = None
+                for item in record.get('labelsAdded', []):
+                    email_id = item['message']['id']
+                    label_ids = item.get('labelIds', [])
+                    if await self._index_call(mail_index.update_labels, email_id, label_ids, []):
+                        labels_changed += 1
+                    elif email_id not in deleted and (
+                        self.sync_label is None or self.sync_label in label_ids
+                    ):
+                        # An older message entered the synced label, e.g. moved to the inbox
+                        added[email_id] = None
+                for item in record.get('labelsRemoved', []):
+                    if await self._index_call(
+                        mail_index.update_labels,
+                        item['message']['id'],
+                        [],
+                        item.get('labelIds', []),
+                    ):
+                        labels_changed += 1
+
+            history_id = str(response.get('historyId', history_id))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+
+        if added:
+            await self._index_messages(mail_index, list(added))
+        if deleted:
+            await self._index_call(mail_index.delete_messages, list(deleted))
+        await self._index_call(mail_index.set_state, 'history_id', history_id)
+
+        logger.info(
+            f'Incremental mailbox sync from history {start_history_id} to {history_id}: '
+            f'{len(added)} added, {len(deleted)} deleted, {labels_changed} label changes'
+        )
+        return SyncResult(
+            full_sync=False,
+            added=len(added),
+            deleted=len(deleted),
+            labels_changed=labels_changed,
+            history_id=history_id,
+        )
+
+    async def sync_mailbox(self) -> SyncResult:
+        """
+        Brings the mail index up to date with the mailbox.
 
-            raw_data = msg['raw']
-            decoded_data = urlsafe_b64decode(raw_data)
+        The first sync indexes every message carrying the sync label. Later syncs only pull
+        the changes recorded since the last synced historyId through users.history.list, so
+        their cost grows with the number of new changes rather than the mailbox size. The
+        text of the messages a sync added is indexed afterwards, in the background.
 
-            mime_message = message_from_bytes(decoded_data)
-            date_str = mime_message.get('date')
-            if date_str:
+        Returns:
+            A SyncResult describing the sync
+
+        Raises:
+            ValueError: If the service has no mail index
+        """
+        if self.mail_index is None:
+            raise ValueError('Mailbox sync requires a mail index')
+
+        async with self._sync_lock:
+            return await self._sync_and_index_text(self.mail_index)
+
+    async def _sync_if_stale(self, mail_index: MailIndex) -> bool:
+        """
+        Syncs the mail index unless it was synced within index_sync_seconds.
+
+        An index that was never synced needs a full sync, which can take minutes on a large
+        mailbox, so it is started in the background rather than waited for.
+
+        Args:
+            mail_index: The index to sync
+
+        Returns:
+            Whether the index is synced, or False while its first sync runs
+        """
+        if await self._index_call(mail_index.get_state, 'history_id') is None:
+            self._start_initial_sync(mail_index)
+            return False
+        async with self._sync_lock:
+            if (
+                self._synced_at is not None
+                and time.monotonic() - self._synced_at < self.index_sync_seconds
+            ):
+                return True
+            await self._sync_and_index_text(mail_index)
+        return True
+
+    def _start_initial_sync(self, mail_index: MailIndex):
+        """Runs the first, full sync of the mail index in the background, once at a time."""
+        if self._closed:
+            return
+        if self._initial_sync_task is None or self._initial_sync_task.done():
+            self._initial_sync_task = asyncio.get_running_loop().create_task(
+                self._initial_sync(mail_index)
+            )
+
+    async def _initial_sync(self, mail_index: MailIndex):
+        try:
+            async with self._sync_lock:
+                # Another sync, e.g. one asked for with sync_mailbox, may have got there first
+                if await self._index_call(mail_index.get_state, 'history_id') is None:
+                    await self._sync_and_index_text(mail_index)
+        except Exception as e:
+            # The next indexed search starts it again
+            logger.error(f'Error running the initial mailbox sync: {e}')
+
+    async def _sync_and_index_text(self, mail_index: MailIndex) -> SyncResult:
+        """Syncs the index, then starts indexing the text of new messages; holds the sync lock."""
+        started_at = time.monotonic()
+        result = await self._sync_mail_index(mail_index)
+        self._synced_at = started_at
+        if self.full_text_index:
+            self._start_text_indexing(mail_index)
+        return result
+
+    def _start_text_indexing(self, mail_index: MailIndex):
+        """Indexes the text of synced messages in the background, once at a time."""
+        if self._closed:
+            return
+        self._text_index_requested = True
+        if self._text_index_task is None or self._text_index_task.done():
+            self._text_index_task = asyncio.get_running_loop().create_task(
+                self._index_text_in_background(mail_index)
+            )
+
+    async def _index_text_in_background(self, mail_index: MailIndex):
+        # A sync while a pass runs asks for another, for the messages it added
+        while self._text_index_requested:
+            self._text_index_requested = False
+            try:
+                indexed = await self._index_missing_text(mail_index)
+            except Exception as e:
+                logger.error(f'Error indexing the text of synced emails: {e}')
+                return
+            if indexed:
+                logger.info(f'Added the text of {indexed} emails to the full-text index')
+
+    async def _sync_mail_index(self, mail_index: MailIndex) -> SyncResult:
+        """Syncs the index incrementally, or in full if it was never synced or is too old."""
+        start_history_id = await self._index_call(mail_index.get_state, 'history_id')
+        if start_history_id is None:
+            return await self._full_sync(mail_index)
+
+        try:
+            return await self._incremental_sync(mail_index, start_history_id)
+        except HttpError as error:
+            # Gmail only keeps history for a limited time, after which a full sync is needed
+            if error.resp.status == 404:
+                logger.warning(f'History {start_history_id} has expired, running a full sync')
+                return await self._full_sync(mail_index)
+            raise
+
+    async def _index_missing_text(self, mail_index: MailIndex) -> int:
+        """
+        Adds the body text and attachment filenames of synced messages to the full-text index.
+
+        Only messages whose text is not indexed yet are downloaded, so after the first
+        sync this only fetches the messages the sync added. Downloads bypass the message
+        cache and the parsed messages kept in memory, which a backfill would flood.
+
+        A message that cannot be parsed, or fails to download MAX_TEXT_INDEX_ATTEMPTS
+        times, is indexed without its text, so it does not keep free-text queries from
+        the index for good.
+
+        Args:
+            mail_index: The index to update
+
+        Returns:
+            The number of messages whose text was indexed
+        """
+        email_ids = await self._index_call(mail_index.message_ids_without_text)
+        indexed = 0
+        for start in range(0, len(email_ids), TEXT_INDEX_CHUNK_SIZE):
+            texts = []
+            chunk = email_ids[start : start + TEXT_INDEX_CHUNK_SIZE]
+            parsed_messages: Dict[str, ParsedMessage] = {}
+            for email_id in chunk:
+                parsed = self._recall_parsed_message(email_id)
+                if parsed is not None:
+                    parsed_messages[email_id] = parsed
+            missing_ids = [email_id for email_id in chunk if email_id not in parsed_messages]
+            if missing_ids:
+                result = await self._get_raw_messages(missing_ids, cache=False)
+                for email_id, raw in result['messages'].items():
+                    parsed_messages[email_id] = ParsedMessage(email_id, raw)
+
+            for email_id in chunk:
+                parsed = parsed_messages.get(email_id)
+                if parsed is None:
+                    attempts = self._text_index_attempts.get(email_id, 0) + 1
+                    self._text_index_attempts[email_id] = attempts
+                    if attempts < MAX_TEXT_INDEX_ATTEMPTS:
+                        continue
+                    logger.error(
+                        f'Indexing email {email_id} without its text after {attempts} failed downloads'
+                    )
+                    texts.append(MessageText(id=email_id, body='', attachment_filenames=[]))
+                    continue
                 try:
-                    # Parse the email date string into a datetime object
-                    email_date = parsedate_to_datetime(date_str)
-                    email_metadata['date'] = email_date
+                    texts.append(
+                        MessageText(
+                            id=email_id,
+                            body=parsed.body,
+                            attachment_filenames=parsed.attachment_filenames,
+                        )
+                    )
                 except Exception as e:
-                    logger.error(f"Error parsing email date '{date_str}': {str(e)}")
-                    email_metadata['date'] = None  # Set to None instead of defaulting to now
-            else:
-                logger.warning(f"No date found in email {email_id}")
-                email_metadata['date'] = None
+                    logger.error(
+                        f'Error parsing email {email_id}, indexing it without its text: {str(e)}'
+                    )
+                    texts.append(MessageText(id=email_id, body='', attachment_filenames=[]))
+            await self._index_call(mail_index.index_message_texts, texts)
+            for text in texts:
+                self._text_index_attempts.pop(text['id'], None)
+            indexed += len(texts)
+        return indexed
+
+    async def _search_index(self, query: str, limit: Optional[int] = None) -> Optional[List[str]]:
+        """
+        Lists the IDs of the messages matching a query from the mail index, if it can.
+
+        The index is synced first, unless it was synced within index_sync_seconds. Queries
+        are left to Gmail while the index's first sync runs in the background, and free-text
+        queries while the text of synced messages is still being indexed, so they never
+        miss new mail.
+
+        Args:
+            query: The Gmail search query string
+            limit: The maximum number of IDs to return
+
+        Returns:
+            The matching message IDs, newest first, or None if Gmail must run the query
+        """
+        index_query = self._index_query_for(query)
+        if index_query is None:
+            return None
+        assert self.mail_index is not None, 'Indexed queries require a mail index'
+        if not await self._sync_if_stale(self.mail_index):
+            return None
+        if index_query['match'] is not None and await self._index_call(
+            self.mail_index.has_messages_without_text
+        ):
+            return None
+        return await self._index_call(
+            functools.partial(self.mail_index.search, index_query, limit=limit)
+        )
+
+    def _index_query_for(self, query: str) -> Optional[IndexQuery]:
+        """
+        Checks whether a query can be answered from the mail index.
+
+        The index mirrors every message carrying the sync label, so only queries scoped to
+        that label qualify. With no sync label the whole mailbox is mirrored, and a query
+        without a label, which Gmail runs over the whole mailbox, qualifies as well.
 
-            body_content = None
+        Args:
+            query: The Gmail search query string
+
+        Returns:
+            The query of the index, or None if Gmail must run the query
+        """
+        if self.mail_index is None:
+            return None
+        index_query = parse_search_query(query)
+        if index_query is None:
+            return None
+        if index_query['match'] is not None and not self.full_text_index:
+            return None
+        if self.sync_label is not None and self.sync_label not in index_query['label_ids']:
+            return None
+        return index_query
+
+    async def iter_emails_details(self, query: str) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Fetches the messages matching a query, yielding each page as soon as it is parsed.
+
+        Pages are fetched concurrently while the remaining IDs are still being listed,
+        but yielded in the order Gmail listed them, so callers can start on the first
+        results before the last ones arrive. Closing the iterator cancels the fetches
+        still in flight.
+
+        Args:
+            query: The Gmail search query string
+
+        Yields:
+            Lists of email detail dictionaries, one per page of results
+        """
+        page_fetches: asyncio.Queue[Optional[asyncio.Task[List[Dict[str, Any]]]]] = asyncio.Queue()
+
+        async def list_pages():
+            try:
+                email_ids = await self._search_index(query)
+                if email_ids is not None:
+                    for start in range(0, len(email_ids), self.batch_size):
+                        page_ids = email_ids[start : start + self.batch_size]
+                        page_fetches.put_nowait(
+                            asyncio.create_task(self._get_emails_details(page_ids))
+                        )
+                else:
+                    async for page_ids in self._iter_message_id_pages(query):
+                        page_fetches.put_nowait(
+                            asyncio.create_task(self._get_emails_details(page_ids))
+                        )
+            finally:
+                page_fetches.put_nowait(None)
 
-            # Try to get plain text first
-            for part in mime_message.walk():
-                if part.get_content_type() == 'text/plain':
-                    body = part.get_payload(decode=True)
-                    if body and isinstance(body, bytes):
-                        body_content = body.decode(errors='replace')
+        lister = asyncio.create_task(list_pages())
+        fetches: List[asyncio.Task[List[Dict[str, Any]]]] = []
+        try:
+            while True:
+                page_fetch = await page_fetches.get()
+                if page_fetch is None:
                     break
+                fetches.append(page_fetch)
+                yield await page_fetch
+            # Surface a listing error once every listed page has been yielded
+            await lister
+        finally:
+            lister.cancel()
+            while not page_fetches.empty():
+                page_fetch = page_fetches.get_nowait()
+                if page_fetch is not None:
+                    fetches.append(page_fetch)
+            for page_fetch in fetches:
+                page_fetch.cancel()
 
-            if body_content is None:
-                for part in mime_message.walk():
-                    if part.get_content_type() == 'text/html':
-                        html_body = part.get_payload(decode=True)
-                        if html_body and isinstance(html_body, bytes):
-                            soup = BeautifulSoup(html_body.decode(errors='replace'), 'html.parser')
-
-                            # Remove script and style elements
-                            for script in soup(['script', 'style']):
-                                script.extract()
-
-                            # Handle links - preserve URL information by replacing with "[text](url)"
-                            for link_element in soup.find_all('a'):
-                                link = cast(Tag, link_element)
-                                href = link.get('href')
-                                if href:
-                                    link_text = link.get_text(strip=True) or href
-                                    replacement_string = f'{link_text} {href}'
-                                    link.replace_with(NavigableString(replacement_string))
-
-                            # Extract text with better formatting
-                            lines = []
-                            for element_raw in soup.find_all(
-                                ['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'div', 'li']
-                            ):
-                                element = cast(Tag, element_raw)
-                                text = element.get_text(strip=True)
-                                if text:
-                                    if element.name.startswith('h'):
-                                        level = int(element.name[1])
-                                        if level == 1:
-                                            lines.append(
-                                                f'\n{"=" * len(text)}\n{text}\n{"=" * len(text)}'
-                                            )
-                                        elif level == 2:
-                                            lines.append(f'\n{text}\n{"-" * len(text)}')
-                                        else:
-                                            lines.append(f'\n{text}')
-                                    elif element.name == 'li':
-                                        lines.append(f'• {text}')
-                                    else:
-                                        lines.append(text)
-
-                            # If no structured elements found, fall back to regular text extraction
-                            if not lines:
-                                lines = soup.get_text(separator='\n', strip=True).split('\n')
-
-                            # Filter out empty lines and join with double newlines for paragraph separation
-                            body_content = '\n'.join(line for line in lines if line.strip())
-                        break
-
-            email_metadata['body'] = body_content or '[No text content found]'
-
-            # Extract metadata
-            email_metadata['subject'] = decode_mime_header(
-                mime_message.get('subject', 'No Subject')
-            )
-            email_metadata['sender'] = mime_message.get('from', 'Unknown Sender')
-            email_metadata['to'] = mime_message.get('to', 'Unknown Recipient')
+    async def get_unread_emails(self) -> Union[List[Dict[str, str]], str]:
+        """
+        Retrieves unread messages from mailbox with details.
+        Returns list of email objects with id, subject, sender, and body.
+        """
+        try:
+            # Get detailed information for each message
+            detailed_messages = [
+                email async for page in self.iter_emails_details(UNREAD_QUERY) for email in page
+            ]
 
-            logger.info(f'Retrieved details for email: {email_id}')
+            logger.info(f'Found {len(detailed_messages)} unread emails')
+
+            return detailed_messages
 
-            return email_metadata
+        except HttpError as error:
+            error_msg = f'An HttpError occurred: {str(error)}'
+            logger.error(error_msg)
+            return error_msg
+
+    async def get_email_details(self, email_id: str) -> Dict[str, str] | str:
+        """
+        Retrieves email contents including subject, sender, body content, and attachments.
+        """
+        try:
+            parsed = await self.get_parsed_message(email_id)
+            return parsed.to_details()
         except HttpError as error:
             error_msg = f'An HttpError occurred while getting email details: {str(error)}'
             logger.error(error_msg)
             return error_msg
 
-    async def search_emails(self, query: str) -> List[Email]:
+    async def search_emails(self, query: str, metadata_only: bool = False) -> List[Email]:
         """
         Searches emails based on a query string.
 
         Args:
             query: The search query string
+            metadata_only: Only fetch headers and snippets, returning LazyEmail objects
+                whose body is downloaded by load_bodies() or their load_body()
 
         Returns:
             A list of email objects that match the search criteria
         """
         try:
-            user_id = 'me'
-
-            response = self.service.users().messages().list(userId=user_id, q=query).execute()
-
-            messages = []
-            if 'messages' in response:
-                messages.extend(response['messages'])
-
-            # Handle pagination for large numbers of search results
-            while 'nextPageToken' in response:
-                page_token = response['nextPageToken']
-                response = (
-                    self.service.users()
-                    .messages()
-                    .list(userId=user_id, q=query, pageToken=page_token)
-                    .execute()
-                )
-                if 'messages' in response:
-                    messages.extend(response['messages'])
+            if metadata_only:
+                return await self._search_emails_metadata(query)
+
+            email_ids = await self._search_index(query)
+            if email_ids is not None:
+                detailed_messages = await self._get_emails_details(email_ids)
+            else:
+                detailed_messages = await self._get_matching_emails_details(query)
 
-            logger.info(f'Found {len(messages)} emails matching query: {query}')
+            logger.info(f'Found {len(detailed_messages)} emails matching query: {query}')
 
             email_list = []
-            for msg in messages:
-                email_details = await self.get_email_details(msg['id'])
-                if isinstance(email_details, dict):
-                    # Convert dictionary to Email object
-                    try:
-                        email = Email(
-                            id=email_details.get('id', ''),
-                            subject=email_details.get('subject', ''),
-                            body=email_details.get('body', ''),
-                            from_email=email_details.get('sender', ''),
-                            to_email=email_details.get('to', ''),
-                            date= cast(datetime, email_details.get('date', '')),
-                        )
-                        email_list.append(email)
-                    except Exception as e:
-                        logger.error(f"Error creating Email object: {str(e)}")
+            for email_details in detailed_messages:
+                # Convert dictionary to Email object
+                try:
+                    email = Email(
+                        id=email_details.get('id', ''),
+                        subject=email_details.get('subject', ''),
+                        body=email_details.get('body', ''),
+                        from_email=email_details.get('sender', ''),
+                        to_email=email_details.get('to', ''),
+                        date=cast(datetime, email_details.get('date', '')),
+                    )
+                    email_list.append(email)
+                except Exception as e:
+                    logger.error(f'Error creating Email object: {str(e)}')
             return email_list
 
         except HttpError as error:
             logger.error(f'An HttpError occurred: {str(error)}')
             return []
 
-    async def get_email_attachments(self, email_id: str) -> List[Attachment]:
+    async def _search_emails_metadata(self, query: str) -> List[Email]:
         """
-        Retrieves attachment(s) for a specific email.
+        Searches emails fetching only their headers and snippet.
 
         Args:
-            email_id: The unique identifier for the email
+            query: The search query string
 
         Returns:
-            The attachment data for the specified email
+            A list of LazyEmail objects that match the search criteria
         """
-        try:
-            message = (
-                self.service.users()
-                .messages()
-                .get(userId='me', id=email_id, format='full')
-                .execute()
+        email_ids = await self._search_index(query)
+        if email_ids is not None:
+            # The index already holds the metadata, so no message needs fetching
+            messages = await self._get_indexed_messages(email_ids)
+        else:
+            messages = await self._fetch_matching_pages(query, self._get_emails_metadata)
+
+        logger.info(f'Found {len(messages)} emails matching query: {query}')
+        return [self._lazy_email(message) for message in messages]
+
+    async def search_emails_page(
+        self, query: str, offset: int = 0, limit: int = 20, include_body: bool = True
+    ) -> SearchPage:
+        """
+        Searches emails, returning only one page of the results.
+
+        Only the IDs up to the end of the page are listed, and only the messages on the
+        page are fetched, so the cost of a call is bounded by offset + limit rather than
+        by the number of matching emails.
+
+        Args:
+            query: The search query string
+            offset: The number of matching emails to skip
+            limit: The maximum number of emails to return
+            include_body: Batch-fetch the bodies of the page's emails, instead of leaving
+                them to be loaded with load_bodies()
+
+        Returns:
+            A SearchPage with the emails of the page, newest first
+        """
+        # One extra ID tells whether another page follows
+        wanted = offset + limit + 1
+        indexed_ids = await self._search_index(query, limit=wanted)
+        if indexed_ids is not None:
+            email_ids = indexed_ids
+        else:
+            email_ids = []
+            async for page_ids in self._iter_message_id_pages(query):
+                email_ids.extend(page_ids)
+                if len(email_ids) >= wanted:
+                    break
+
+        page_ids = email_ids[offset : offset + limit]
+        if indexed_ids is not None:
+            messages = await self._get_indexed_messages(page_ids)
+        else:
+            messages = await self._get_emails_metadata(page_ids)
+
+        emails = [self._lazy_email(message) for message in messages]
+        positions = {email_id: offset + index for index, email_id in enumerate(page_ids)}
+        if include_body:
+            await self.load_bodies(emails)
+
+        return SearchPage(
+            emails=emails,
+            offsets=[positions[email.id] for email in emails],
+            next_offset=offset + limit if len(email_ids) > offset + limit else None,
+        )
+
+    def _find_attachment_parts(self, payload: Dict[str, Any]) -> List[AttachmentPart]:
+        """
+        Lists the attachments in a message payload, in MIME-tree order.
+
+        Args:
+            payload: The payload of a message fetched with format='full'
+
+        Returns:
+            The attachment parts, without their content
+        """
+        parts = []
+        filename = payload.get('filename')
+        if filename:
+            body = payload.get('body', {})
+            parts.append(
+                AttachmentPart(
+                    part_id=payload.get('partId', ''),
+                    filename=decode_mime_header(filename),
+                    mime_type=payload.get('mimeType', 'application/octet-stream'),
+                    size=body.get('size', 0),
+                    attachment_id=body.get('attachmentId'),
+                    data=body.get('data'),
+                )
             )
+        for part in payload.get('parts', []):
+            parts.extend(self._find_attachment_parts(part))
+        return parts
+
+    async def _get_cached_parsed_message(self, email_id: str) -> Optional[ParsedMessage]:
+        """
+        Gets a parsed message held in memory or in the message cache, without fetching it.
+
+        Args:
+            email_id: The ID of the message
 
-            payload = message.get('payload', {})
-            attachments_data = []
-            self._extract_attachments(payload, email_id, attachments_data)
+        Returns:
+            The parsed message, or None if it would have to be downloaded
+        """
+        parsed = self._recall_parsed_message(email_id)
+        if parsed is not None:
+            return parsed
+        raw = (await self._get_cached_raw_messages([email_id])).get(email_id)
+        if raw is None:
+            return None
+        parsed = ParsedMessage(email_id, raw)
+        self._remember_parsed_message(parsed)
+        return parsed
+
+    async def get_attachment_parts(self, email_id: str) -> List[AttachmentPart]:
+        """
+        Lists the attachments of an email without downloading their content.
 
-            # Convert to Attachment objects
-            attachments = []
-            for attachment_data in attachments_data:
-                # Decode from base64 to get raw bytes
-                content_bytes = base64.b64decode(attachment_data['data'])
+        A message held in memory or in the message cache already has every attachment
+        in it, so its parts are returned with their content inline and need no further
+        request. Only other messages are fetched, without their attachment content.
 
-                attachment = Attachment(
-                    filename=attachment_data['filename'],
-                    content_type=attachment_data['mimeType'],
-                    content=content_bytes
+        Args:
+            email_id: The unique identifier for the email
+
+        Returns:
+            The attachment parts of the email, in MIME-tree order
+        """
+        parsed = await self._get_cached_parsed_message(email_id)
+        if parsed is not None:
+            loop = asyncio.get_running_loop()
+            attachments = await loop.run_in_executor(None, lambda: parsed.attachments_by_part_id)
+            return [
+                AttachmentPart(
+                    part_id=part_id,
+                    filename=attachment.filename,
+                    mime_type=attachment.content_type,
+                    size=len(attachment.content),
+                    attachment_id=None,
+                    data=urlsafe_b64encode(attachment.content).decode('ascii'),
+                )
+                for part_id, attachment in attachments.items()
+            ]
+
+        msg = await self._execute(
+            self.service.users()
+            .messages()
+            .get(userId='me', id=email_id, format='full', fields='payload')
+        )
+        return self._find_attachment_parts(msg.get('payload', {}))
+
+    def _iter_attachment_chunks(self, email_id: str, part: AttachmentPart) -> Iterator[bytes]:
+        """
+        Yields the decoded content of an attachment as it is downloaded.
+
+        The attachments.get response is streamed and its base64url data decoded chunk by
+        chunk, so neither the encoded response nor the decoded file is held in memory.
+
+        Args:
+            email_id: The unique identifier for the email
+            part: The attachment part to download
+
+        Yields:
+            The decoded attachment content, in order
+        """
+        if part['attachment_id'] is None:
+            # Small attachments are returned inline with the message
+            decoder = Base64UrlDecoder()
+            yield decoder.feed(part['data'] or '') + decoder.finish()
+            return
+
+        url = f'{GMAIL_API_URL}/users/me/messages/{email_id}/attachments/{part["attachment_id"]}'
+        with self._get_session().get(url, params={'fields': 'data'}, stream=True) as response:
+            response.raise_for_status()
+            yield from decode_json_data_field(response.iter_content(ATTACHMENT_CHUNK_BYTES))
+
+    async def save_attachment(
+        self,
+        email_id: str,
+        part: AttachmentPart,
+        file_system: Union[FileSystem, AsyncFileSystem],
+        filename: Optional[str] = None,
+        overwrite: bool = True,
+    ) -> str:
+        """
+        Downloads an attachment straight into a file system.
+
+        The content is decoded once and written as it arrives, so peak memory is bounded
+        by ATTACHMENT_CHUNK_BYTES rather than the attachment size.
+
+        Args:
+            email_id: The unique identifier for the email
+            part: The attachment part to download, from get_attachment_parts
+            file_system: The file system to save the attachment to
+            filename: The name to save the attachment as, defaulting to its own filename
+            overwrite: Replace an existing file of the same name, rather than saving
+                under a free name next to it
+
+        Returns:
+            The path of the saved file
+        """
+        save_name = filename or part['filename']
+
+        async def call() -> str:
+            async with self._request_slots:
+                chunks = self._iter_attachment_chunks(email_id, part)
+                if isinstance(file_system, AsyncFileSystem):
+                    return await file_system.save_stream(
+                        save_name, part['mime_type'], chunks, overwrite=overwrite
+                    )
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    self._executor,
+                    lambda: file_system.save_stream(
+                        save_name, part['mime_type'], chunks, overwrite=overwrite
+                    ),
                 )
-                attachments.append(attachment)
 
-            return attachments
+        # A failed download leaves no partial file behind, so it can simply be retried
+        cost = QUOTA_UNITS['gmail.users.messages.attachments.get'] if part['attachment_id'] else 0
+        return await self.scheduler.run(call, cost=cost)
+
+    async def download_attachment(self, email_id: str, part: AttachmentPart) -> bytes:
+        """
+        Downloads the content of one attachment into memory.
+
+        Prefer save_attachment for attachments that are only written to a file system.
+
+        Args:
+            email_id: The unique identifier for the email
+            part: The attachment part to download, from get_attachment_parts
+
+        Returns:
+            The decoded attachment content
+        """
+
+        async def call() -> bytes:
+            async with self._request_slots:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    self._executor, lambda: b''.join(self._iter_attachment_chunks(email_id, part))
+                )
+
+        cost = QUOTA_UNITS['gmail.users.messages.attachments.get'] if part['attachment_id'] else 0
+        return await self.scheduler.run(call, cost=cost)
+
+    async def save_attachments(
+        self,
+        email_id: str,
+        parts: List[AttachmentPart],
+        file_system: Union[FileSystem, AsyncFileSystem],
+        filenames: Optional[List[str]] = None,
+        overwrite: bool = True,
+        max_concurrent: int = DEFAULT_MAX_CONCURRENT_ATTACHMENTS,
+        on_result: Optional[Callable[[int, Union[str, Exception]], Awaitable[None]]] = None,
+    ) -> List[Union[str, Exception]]:
+        """
+        Downloads several attachments of an email into a file system concurrently.
+
+        At most max_concurrent downloads run at once, so an email with several invoice
+        PDFs pays roughly one download latency instead of one per attachment, and a
+        failed download does not stop the others.
+
+        Args:
+            email_id: The unique identifier for the email
+            parts: The attachment parts to download, from get_attachment_parts
+            file_system: The file system to save the attachments to
+            filenames: The names to save the attachments as, one per part
+            overwrite: Replace existing files of the same names, rather than saving
+                under free names next to them
+            max_concurrent: Maximum number of downloads in flight at once
+            on_result: Coroutine function called with the index of each part and its
+                saved path or exception as soon as that download finishes
+
+        Returns:
+            The saved path, or the exception that failed the download, of each part in
+            the order the parts were given
+        """
+        if filenames is not None and len(filenames) != len(parts):
+            raise ValueError(f'Got {len(filenames)} filenames for {len(parts)} attachments')
+
+        slots = asyncio.Semaphore(max_concurrent)
+
+        async def save(index: int, part: AttachmentPart) -> str:
+            async with slots:
+                filename = filenames[index] if filenames is not None else None
+                try:
+                    path = await self.save_attachment(
+                        email_id, part, file_system, filename=filename, overwrite=overwrite
+                    )
+                except Exception as error:
+                    if on_result is not None:
+                        await on_result(index, error)
+                    raise
+            if on_result is not None:
+                await on_result(index, path)
+            return path
+
+        results = await asyncio.gather(
+            *(save(index, part) for index, part in enumerate(parts)), return_exceptions=True
+        )
+        for part, result in zip(parts, results):
+            if isinstance(result, BaseException) and not isinstance(result, Exception):
+                raise result
+            if isinstance(result, Exception):
+                logger.error(f'Error saving attachment {part["filename"]} of {email_id}: {result}')
+        return cast(List[Union[str, Exception]], results)
+
+    async def get_email_attachments(self, email_id: str) -> List[Attachment]:
+        """
+        Retrieves attachment(s) for a specific email.
+
+        Args:
+            email_id: The unique identifier for the email
+
+        Returns:
+            The attachment data for the specified email
+        """
+        try:
+            parsed = await self.get_parsed_message(email_id)
+            return parsed.attachments
 
         except HttpError as error:
             error_msg = f'An error occurred when fetching email attachments: {error}'
@@ -385,20 +1882,10 @@ class GmailService(EmailInterface):
             Union[AttachmentResponse, str]: AttachmentResponse with HTML data or plain text string
         """
         try:
-            # Get the raw message
-            msg = (
-                self.service.users()
-                .messages()
-                .get(userId='me', id=email_id, format='raw')
-                .execute()
-            )
-
-            raw_data = msg['raw']
-            decoded_data = urlsafe_b64decode(raw_data)
-            mime_message = message_from_bytes(decoded_data)
+            parsed = await self.get_parsed_message(email_id)
 
             # Extract subject for filename
-            subject = decode_mime_header(mime_message.get('subject', 'No Subject'))
+            subject = parsed.subject
             # Use standard library function to sanitize filename
             import re
 
@@ -406,31 +1893,24 @@ class GmailService(EmailInterface):
             safe_subject = re.sub(r'\s+', '_', safe_subject)
 
             # Check for HTML content first
-            for part in mime_message.walk():
-                if part.get_content_type() == 'text/html':
-                    html_body = part.get_payload(decode=True)
-                    if html_body and isinstance(html_body, bytes):
-                        html_content = html_body.decode(errors='replace')
-                        html_bytes = html_content.encode('utf-8')
-                        html_encoded = base64.b64encode(html_bytes).decode('utf-8')
-
-                        # Create an AttachmentResponse instance
-                        return cast(
-                            AttachmentResponse,
-                            {
-                                'email': email_id,
-                                'filename': f'Email_{safe_subject[:30]}_{email_id[:8]}',
-                                'mimeType': 'text/html',
-                                'data': html_encoded,
-                            },
-                        )
+            if parsed.html_body:
+                html_bytes = parsed.html_body.encode('utf-8')
+                html_encoded = base64.b64encode(html_bytes).decode('utf-8')
+
+                # Create an AttachmentResponse instance
+                return cast(
+                    AttachmentResponse,
+                    {
+                        'email': email_id,
+                        'filename': f'Email_{safe_subject[:30]}_{email_id[:8]}',
+                        'mimeType': 'text/html',
+                        'data': html_encoded,
+                    },
+                )
 
             # If no HTML, return plain text as string
-            for part in mime_message.walk():
-                if part.get_content_type() == 'text/plain':
-                    text_body = part.get_payload(decode=True)
-                    if text_body and isinstance(text_body, bytes):
-                        return text_body.decode(errors='replace')
+            if parsed.text_body:
+                return parsed.text_body
 
             return 'No content found in email body'
 
@@ -438,57 +1918,3 @@ class GmailService(EmailInterface):
             error_msg = f'An error occurred extracting email body: {error}'
             logger.error(error_msg)
             return error_msg
-
-    def _extract_attachments(
-        self, payload: Dict[str, Any], email_id: str, attachments_list: List[Dict[str, Any]]
-    ):
-        """
-        Recursively traverses the parts of an email payload to find attachments.
-
-        If an attachment is found (identified by filename and attachmentId), it downloads the attachment data,
-        decodes it from its URL-safe Base64 encoding, and then re-encodes it to a standard Base64 string
-        for inclusion in the attachments list.
-
-        Args:
-            payload (Dict[str, Any]): The payload of the email message, which may contain nested parts.
-            email_id (str): The ID of the email message.
-            attachments_list (List[Dict[str, Any]]): A list to which the extracted attachment information will be appended.
-        """
-        parts = payload.get('parts', [])
-        for part in parts:
-            filename = part.get('filename')
-            body = part.get('body', {})
-            mime_type = part.get('mimeType')
-            attachment_id = body.get('attachmentId')
-
-            # If the part has a filename and an attachmentId, it's likely an attachment
-            if filename and attachment_id:
-                attachment_data = (
-                    self.service.users()
-                    .messages()
-                    .attachments()
-                    .get(userId='me', messageId=email_id, id=attachment_id)
-                    .execute()
-                )
-
-                data = attachment_data.get('data', '')
-
-                if isinstance(data, str):
-                    data = data.encode('utf-8')
-
-                file_data = urlsafe_b64decode(data)
-
-                file_data_encoded = base64.b64encode(file_data).decode('utf-8')
-
-                attachments_list.append(
-                    {
-                        'email': email_id,
-                        'filename': filename,
-                        'mimeType': mime_type,
-                        'data': file_data_encoded,
-                    }
-                )
-
-            # If there are nested parts, recurse
-            if 'parts' in part:
-                self._extract_attachments(part, email_id, attachments_list)
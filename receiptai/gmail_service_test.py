@@ -0,0 +1,634 @@
+import asyncio
+import base64
+import contextlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime
+from email.message import EmailMessage
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from unittest import mock
+
+import httplib2
+import requests
+from email_types import BodyNotLoadedError
+from fs import LocalFileSystem
+from gmail_scheduler import GmailScheduler
+from gmail_service import AttachmentPart, GmailService, SyncResult
+from googleapiclient.errors import HttpError
+from mail_index import MailIndex
+from message_cache import MessageCache
+from parsed_message import ParsedMessage
+
+
+def http_error(status: int, reason: str = '') -> HttpError:
+    resp = httplib2.Response({'status': str(status)})
+    content = json.dumps({'error': {'code': status, 'errors': [{'reason': reason}]}}).encode()
+    return HttpError(resp, content)
+
+
+def raw_email(
+    email_id: str, body: str = 'Hello', subject: str = 'Receipt', attachments: int = 0
+) -> bytes:
+    message = EmailMessage()
+    message['Subject'] = f'{subject} {email_id}'
+    message['From'] = 'shop@example.com'
+    message['To'] = 'me@example.com'
+    message['Date'] = 'Fri, 25 Apr 2025 10:00:00 +0000'
+    message.set_content(body)
+    for index in range(attachments):
+        message.add_attachment(
+            f'%PDF-1.0 {email_id} {index}'.encode(),
+            maintype='application',
+            subtype='pdf',
+            filename=f'receipt-{index}.pdf',
+        )
+    return message.as_bytes()
+
+
+class FakeClock:
+    """A clock that only moves when the code under test sleeps."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps: List[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeRequest:
+    def __init__(self, method_id: str, respond: Callable[[], Any]):
+        self.methodId = method_id
+        self._respond = respond
+
+    def execute(self, http: Any = None, num_retries: int = 0) -> Any:
+        return self._respond()
+
+
+class FakeBatch:
+    def __init__(self, gmail: 'FakeGmail', callback: Callable[[str, Any, Any], None]):
+        self._gmail = gmail
+        self._callback = callback
+        self._requests: Dict[str, FakeRequest] = {}
+
+    def add(self, request: FakeRequest, request_id: str):
+        self._requests[request_id] = request
+
+    def execute(self, http: Any = None):
+        self._gmail.batches.append(list(self._requests))
+        for request_id, request in self._requests.items():
+            try:
+                self._callback(request_id, request.execute(), None)
+            except HttpError as error:
+                self._callback(request_id, None, error)
+
+
+class FakeGmail:
+    """Stands in for the googleapiclient Gmail resource, serving messages from memory."""
+
+    def __init__(self, messages: Dict[str, bytes]):
+        self.raw = messages
+        # Errors raised by the next gets of a message, in order
+        self.failures: Dict[str, List[HttpError]] = {}
+        self.gets: List[tuple] = []
+        self.batches: List[List[str]] = []
+
+    def users(self) -> 'FakeGmail':
+        return self
+
+    def messages(self) -> 'FakeGmail':
+        return self
+
+    def new_batch_http_request(self, callback: Callable[[str, Any, Any], None]) -> FakeBatch:
+        return FakeBatch(self, callback)
+
+    def get(
+        self,
+        userId: str,
+        id: str,
+        format: str = 'full',
+        metadataHeaders: Optional[List[str]] = None,
+        fields: Optional[str] = None,
+    ) -> FakeRequest:
+        def respond() -> Dict[str, Any]:
+            self.gets.append((id, format))
+            if self.failures.get(id):
+                raise self.failures[id].pop(0)
+            if id not in self.raw:
+                raise http_error(404, 'notFound')
+            resource: Dict[str, Any] = {'id': id, 'threadId': id, 'labelIds': ['INBOX']}
+            if format == 'raw':
+                resource['raw'] = base64.urlsafe_b64encode(self.raw[id]).decode()
+            elif format == 'full':
+                # Attachments are listed with the ID their content is downloaded by
+                parsed = ParsedMessage(id, self.raw[id])
+                resource['payload'] = {
+                    'partId': '',
+                    'parts': [
+                        {
+                            'partId': part_id,
+                            'filename': attachment.filename,
+                            'mimeType': attachment.content_type,
+                            'body': {
+                                'size': len(attachment.content),
+                                'attachmentId': f'{id}-{part_id}',
+                            },
+                        }
+                        for part_id, attachment in parsed.attachments_by_part_id.items()
+                    ],
+                }
+            return resource
+
+        return FakeRequest('gmail.users.messages.get', respond)
+
+
+def make_service(gmail: Any, clock: Optional[FakeClock] = None, **kwargs: Any) -> GmailService:
+    """Builds a GmailService over a fake Gmail resource, without touching OAuth."""
+    clock = clock or FakeClock()
+    with (
+        mock.patch.object(GmailService, '_get_token', return_value=mock.Mock(refresh_token=None)),
+        mock.patch.object(GmailService, '_get_service', return_value=gmail),
+    ):
+        return GmailService(
+            'creds.json',
+            'token.json',
+            scheduler=GmailScheduler(clock=clock, sleep=clock.sleep),
+            **kwargs,
+        )
+
+
+class TestBatchGetMessages(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.gmail = FakeGmail({f'm{index}': raw_email(f'm{index}') for index in range(120)})
+        self.service = make_service(self.gmail, batch_size=50)
+        self.addAsyncCleanup(self.service.aclose)
+
+    async def test_fetches_in_batches(self):
+        email_ids = [f'm{index}' for index in range(120)]
+        result = await self.service._batch_get_messages(email_ids + ['m0'])
+
+        self.assertEqual(list(result['messages']), email_ids)
+        self.assertEqual(result['errors'], {})
+        self.assertEqual(sorted(len(batch) for batch in self.gmail.batches), [20, 50, 50])
+
+    async def test_partially_failed_batch(self):
+        self.gmail.failures['m1'] = [http_error(500)]
+        result = await self.service._batch_get_messages(['m0', 'm1', 'missing', 'm2'])
+
+        self.assertEqual(list(result['messages']), ['m0', 'm2'])
+        self.assertEqual(set(result['errors']), {'m1', 'missing'})
+        # Only rate limited calls are retried; the rest of the batch is kept
+        self.assertEqual(len(self.gmail.batches), 1)
+
+    async def test_rate_limited_item_is_retried_alone(self):
+        self.gmail.failures['m1'] = [http_error(429), http_error(403, 'userRateLimitExceeded')]
+        result = await self.service._batch_get_messages(['m0', 'm1', 'm2'])
+
+        self.assertEqual(list(result['messages']), ['m0', 'm1', 'm2'])
+        self.assertEqual(result['errors'], {})
+        self.assertEqual(self.gmail.batches, [['m0', 'm1', 'm2'], ['m1'], ['m1']])
+        metrics = self.service.scheduler.metrics()
+        self.assertEqual(metrics['retries'], 2)
+        self.assertEqual(metrics['rate_limited'], 2)
+
+    async def test_rate_limited_item_gives_up_after_max_retries(self):
+        retries = self.service.scheduler.max_retries
+        self.gmail.failures['m1'] = [http_error(429) for _ in range(retries + 1)]
+        result = await self.service._batch_get_messages(['m0', 'm1'])
+
+        self.assertEqual(list(result['messages']), ['m0'])
+        self.assertIn('m1', result['errors'])
+        self.assertEqual(len(self.gmail.batches), retries + 1)
+
+
+class TestExecute(unittest.IsolatedAsyncioTestCase):
+    async def test_calls_run_off_the_loop_within_the_concurrency_limit(self):
+        service = make_service(FakeGmail({}), max_concurrent_requests=2)
+        self.addAsyncCleanup(service.aclose)
+        lock = threading.Lock()
+        running = 0
+        peak = 0
+        threads = set()
+
+        def respond() -> str:
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+                threads.add(threading.current_thread().name)
+            time.sleep(0.02)
+            with lock:
+                running -= 1
+            return 'ok'
+
+        results = await asyncio.gather(
+            *(service._execute(FakeRequest('gmail.users.getProfile', respond)) for _ in range(6))
+        )
+        self.assertEqual(results, ['ok'] * 6)
+        self.assertEqual(peak, 2)
+        self.assertTrue(all(name.startswith('gmail-api') for name in threads))
+
+    async def test_rate_limited_call_is_retried(self):
+        clock = FakeClock()
+        service = make_service(FakeGmail({}), clock=clock)
+        self.addAsyncCleanup(service.aclose)
+        errors = [http_error(429)]
+
+        def respond() -> str:
+            if errors:
+                raise errors.pop()
+            return 'ok'
+
+        self.assertEqual(
+            await service._execute(FakeRequest('gmail.users.getProfile', respond)), 'ok'
+        )
+        self.assertEqual(service.scheduler.metrics()['rate_limited'], 1)
+        # The retry waited for the drained bucket, on the scheduler's clock
+        self.assertGreater(clock.now, 0)
+
+    async def test_error_that_is_not_retryable_is_raised(self):
+        service = make_service(FakeGmail({}))
+        self.addAsyncCleanup(service.aclose)
+
+        def respond():
+            raise http_error(404, 'notFound')
+
+        with self.assertRaises(HttpError):
+            await service._execute(FakeRequest('gmail.users.messages.get', respond))
+        self.assertEqual(service.scheduler.metrics()['retries'], 0)
+
+
+class TestIndexedSearch(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.mail_index = MailIndex(os.path.join(self.temp_dir, 'index.sqlite3'))
+        self.addCleanup(self.mail_index.close)
+        self.gmail = FakeGmail({'m0': raw_email('m0', body='Total 66.00 EUR')})
+        self.syncs = 0
+        # Synced before, so searches sync incrementally rather than in the background
+        self.mail_index.set_state('history_id', '1')
+
+    def make_service(self, **kwargs: Any) -> GmailService:
+        service = make_service(self.gmail, mail_index=self.mail_index, **kwargs)
+        self.addAsyncCleanup(service.aclose)
+
+        async def sync(mail_index: MailIndex) -> SyncResult:
+            self.syncs += 1
+            mail_index.upsert_messages(
+                [
+                    {
+                        'id': email_id,
+                        'internalDate': '1000',
+                        'labelIds': ['INBOX'],
+                        'subject': f'Receipt {email_id}',
+                    }
+                    for email_id in self.gmail.raw
+                ]
+            )
+            mail_index.set_state('history_id', '1')
+            return SyncResult(full_sync=False, added=0, deleted=0, labels_changed=0, history_id='1')
+
+        service._sync_mail_index = sync  # type: ignore[method-assign]
+        return service
+
+    async def test_sync_is_throttled(self):
+        service = self.make_service(full_text_index=False, index_sync_seconds=60)
+        self.assertEqual(await service._search_index('in:inbox'), ['m0'])
+        self.assertEqual(await service._search_index('in:inbox is:unread'), [])
+        self.assertEqual(self.syncs, 1)
+
+        service = self.make_service(full_text_index=False, index_sync_seconds=0)
+        await service._search_index('in:inbox')
+        await service._search_index('in:inbox')
+        self.assertEqual(self.syncs, 3)
+
+    async def test_index_is_read_off_the_loop(self):
+        service = self.make_service()
+        threads = []
+        for name in ['get_state', 'search', 'get_message']:
+
+            def record(
+                *args: Any, original: Callable[..., Any] = getattr(self.mail_index, name), **kwargs
+            ) -> Any:
+                threads.append(threading.current_thread())
+                return original(*args, **kwargs)
+
+            setattr(self.mail_index, name, record)
+
+        emails = await service._search_emails_metadata('in:inbox')
+        self.assertEqual([email.id for email in emails], ['m0'])
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(threading.main_thread(), threads)
+
+    async def test_first_sync_runs_in_the_background(self):
+        self.mail_index.clear()
+        service = self.make_service()
+        # Gmail answers until the full sync has finished
+        self.assertIsNone(await service._search_index('in:inbox'))
+        self.assertIsNone(await service._search_index('in:inbox'))
+        self.assertIsNotNone(service._initial_sync_task)
+        await service._initial_sync_task
+
+        self.assertEqual(await service._search_index('in:inbox'), ['m0'])
+        self.assertEqual(self.syncs, 1)
+
+    async def test_text_is_indexed_in_the_background(self):
+        service = self.make_service(full_text_index=True)
+        # Until the new message's text is indexed, free-text queries are left to Gmail
+        self.assertIsNone(await service._search_index('in:inbox "66.00"'))
+        self.assertIsNotNone(service._text_index_task)
+        await service._text_index_task
+        self.assertFalse(self.mail_index.has_messages_without_text())
+        self.assertEqual(await service._search_index('in:inbox "66.00"'), ['m0'])
+
+    async def test_queries_without_a_label_need_a_full_mirror(self):
+        service = self.make_service(full_text_index=True)
+        self.assertIsNone(await service._search_index('receipt'))
+        self.assertEqual(self.syncs, 0)
+
+        # With no sync label the index mirrors the whole mailbox, as Gmail searches it
+        service = self.make_service(full_text_index=True, sync_label=None)
+        await service._search_index('receipt')
+        await service._text_index_task
+        self.assertEqual(await service._search_index('receipt'), ['m0'])
+
+    async def test_text_backfill_bypasses_the_caches(self):
+        cache = MessageCache(os.path.join(self.temp_dir, 'cache'))
+        service = self.make_service(full_text_index=True, message_cache=cache)
+        await service._sync_if_stale(self.mail_index)
+        await service._text_index_task
+
+        self.assertFalse(self.mail_index.has_messages_without_text())
+        self.assertIsNone(cache.get_raw('m0'))
+        self.assertEqual(len(service._parsed_messages), 0)
+
+    async def test_message_that_fails_to_download_is_indexed_without_text(self):
+        service = self.make_service(full_text_index=True)
+        self.mail_index.upsert_messages(
+            [{'id': 'gone', 'internalDate': '2000', 'labelIds': ['INBOX'], 'subject': 'Gone'}]
+        )
+        for _ in range(2):
+            self.assertEqual(await service._index_missing_text(self.mail_index), 0)
+            self.assertTrue(self.mail_index.has_messages_without_text())
+
+        # The last attempt gives up on its text, so free-text queries use the index again
+        self.assertEqual(await service._index_missing_text(self.mail_index), 1)
+        self.assertFalse(self.mail_index.has_messages_without_text())
+        self.assertEqual(self.gmail.gets, [('gone', 'raw')] * 3)
+
+
+class TestMessageCache(unittest.IsolatedAsyncioTestCase):
+    async def test_cache_is_read_and_written_off_the_loop(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        cache = MessageCache(temp_dir)
+        threads = []
+        for name in ['get_raw', 'put']:
+
+            def record(*args: Any, original: Callable[..., Any] = getattr(cache, name)) -> Any:
+                threads.append(threading.current_thread())
+                return original(*args)
+
+            setattr(cache, name, record)
+        gmail = FakeGmail({'m0': raw_email('m0'), 'm1': raw_email('m1')})
+        service = make_service(gmail, message_cache=cache)
+        self.addAsyncCleanup(service.aclose)
+
+        self.assertEqual(await service._get_raw_message('m0'), gmail.raw['m0'])
+        result = await service._get_raw_messages(['m0', 'm1'])
+        self.assertEqual(result['messages']['m1'], gmail.raw['m1'])
+        # m0 came from the cache the second time
+        self.assertEqual(gmail.gets, [('m0', 'raw'), ('m1', 'raw')])
+        self.assertEqual(len(threads), 5)
+        self.assertNotIn(threading.main_thread(), threads)
+
+
+class TestAttachments(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.gmail = FakeGmail({'m0': raw_email('m0', attachments=2)})
+        self.service = make_service(
+            self.gmail, message_cache=MessageCache(os.path.join(self.temp_dir, 'cache'))
+        )
+        self.addAsyncCleanup(self.service.aclose)
+
+    async def test_parts_of_a_cached_message_need_no_request(self):
+        await self.service._get_raw_messages(['m0'])
+        self.gmail.gets.clear()
+        # Drop the parsed copy, so the parts come from the on-disk cache
+        self.service._parsed_messages.clear()
+
+        parts = await self.service.get_attachment_parts('m0')
+        self.assertEqual([part['part_id'] for part in parts], ['1', '2'])
+        self.assertEqual([part['filename'] for part in parts], ['receipt-0.pdf', 'receipt-1.pdf'])
+        file_system = LocalFileSystem(os.path.join(self.temp_dir, 'files'))
+        path = await self.service.save_attachment('m0', parts[1], file_system)
+        self.assertEqual(file_system.retrieve_file(path), b'%PDF-1.0 m0 1')
+        self.assertEqual(self.gmail.gets, [])
+
+    async def test_uncached_message_is_listed_by_the_api(self):
+        parts = await self.service.get_attachment_parts('m0')
+        self.assertEqual(self.gmail.gets, [('m0', 'full')])
+        self.assertEqual([part['part_id'] for part in parts], ['1', '2'])
+        self.assertEqual([part['attachment_id'] for part in parts], ['m0-1', 'm0-2'])
+
+
+class TestLazyEmails(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.gmail = FakeGmail(
+            {f'm{index}': raw_email(f'm{index}', body=f'Body {index}') for index in range(3)}
+        )
+        self.service = make_service(self.gmail)
+        self.addAsyncCleanup(self.service.aclose)
+        self.emails = [
+            self.service._lazy_email({'id': email_id, 'subject': f'Receipt {email_id}'})
+            for email_id in ['m0', 'm1']
+        ]
+
+    async def test_body_must_be_loaded_before_use(self):
+        email = self.emails[0]
+        with self.assertRaises(BodyNotLoadedError):
+            email.body
+        with self.assertRaises(BodyNotLoadedError):
+            email.model_dump()
+        with self.assertRaises(BodyNotLoadedError):
+            email.model_dump_json()
+        self.assertNotIn('body', email.model_dump(exclude={'body'}))
+        # Nothing was downloaded behind the caller's back
+        self.assertEqual(self.gmail.gets, [])
+
+        self.assertEqual(await email.load_body(), 'Body 0\n')
+        self.assertEqual(email.model_dump()['body'], 'Body 0\n')
+
+    async def test_load_bodies_fetches_through_the_scheduler_in_one_batch(self):
+        await self.service.load_bodies(self.emails)
+
+        self.assertEqual([email.body for email in self.emails], ['Body 0\n', 'Body 1\n'])
+        self.assertEqual(self.gmail.batches, [['m0', 'm1']])
+        self.assertEqual(self.service.scheduler.metrics()['quota_units'], 10)
+
+        # Loaded bodies are not fetched again
+        await self.service.load_bodies(self.emails)
+        self.assertEqual(len(self.gmail.gets), 2)
+
+
+class FakeSession:
+    """Serves attachments.get downloads, recording how many run at once."""
+
+    def __init__(self, contents: Dict[str, bytes]):
+        self.contents = contents
+        self._lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    @contextlib.contextmanager
+    def get(self, url: str, params: Any = None, stream: bool = False) -> Iterator[mock.Mock]:
+        attachment_id = url.rsplit('/', 1)[1]
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            time.sleep(0.02)
+            response = mock.Mock()
+            if attachment_id not in self.contents:
+                response.raise_for_status.side_effect = requests.HTTPError('404 Not Found')
+            data = base64.urlsafe_b64encode(self.contents.get(attachment_id, b''))
+            response.iter_content.return_value = [b'{"size": 1, "data": "', data, b'"}']
+            yield response
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+class TestSaveAttachments(unittest.IsolatedAsyncioTestCase):
+    async def test_downloads_run_concurrently_and_failures_stay_per_part(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        contents = {f'a{index}': f'%PDF-1.0 {index}'.encode() for index in range(4)}
+        session = FakeSession(contents)
+        service = make_service(FakeGmail({}), max_concurrent_requests=8)
+        self.addAsyncCleanup(service.aclose)
+        service._get_session = lambda: session  # type: ignore[method-assign]
+        parts = [
+            AttachmentPart(
+                part_id=str(index),
+                filename=f'{attachment_id}.pdf',
+                mime_type='application/pdf',
+                size=0,
+                attachment_id=attachment_id,
+                data=None,
+            )
+            for index, attachment_id in enumerate([*contents, 'missing'])
+        ]
+        reported: Dict[int, Any] = {}
+
+        async def on_result(index: int, result: Any):
+            reported[index] = result
+
+        file_system = LocalFileSystem(temp_dir)
+        results = await service.save_attachments(
+            'm0', parts, file_system, max_concurrent=3, on_result=on_result
+        )
+
+        for index in range(4):
+            self.assertEqual(file_system.retrieve_file(results[index]), contents[f'a{index}'])
+        self.assertIsInstance(results[4], requests.HTTPError)
+        self.assertEqual(reported, dict(enumerate(results)))
+        self.assertGreater(session.peak, 1)
+        self.assertLessEqual(session.peak, 3)
+
+
+class TestSharedStores(unittest.IsolatedAsyncioTestCase):
+    async def test_two_services_share_one_directory(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        gmail = FakeGmail({f'm{index}': raw_email(f'm{index}') for index in range(3)})
+
+        # Each service opens the stores itself, as the MCP server processes of a pool do
+        services = []
+        for _ in range(2):
+            mail_index = MailIndex(os.path.join(temp_dir, 'mail_index.sqlite3'))
+            self.addCleanup(mail_index.close)
+            service = make_service(
+                gmail,
+                message_cache=MessageCache(os.path.join(temp_dir, 'message_cache')),
+                mail_index=mail_index,
+            )
+            self.addAsyncCleanup(service.aclose)
+            services.append(service)
+        first, second = services
+
+        result = await first._get_raw_messages(['m0', 'm1'])
+        self.assertEqual(set(result['messages']), {'m0', 'm1'})
+        # The second service reads what the first cached, and only fetches the rest
+        result = await second._get_raw_messages(['m0', 'm1', 'm2'])
+        self.assertEqual(result['messages']['m0'], gmail.raw['m0'])
+        self.assertEqual(gmail.batches, [['m0', 'm1'], ['m2']])
+
+        first.mail_index.upsert_messages([{'id': 'm0', 'internalDate': '1', 'labelIds': ['INBOX']}])
+        first.mail_index.set_state('history_id', '7')
+        self.assertEqual(second.mail_index.history_id, '7')
+        self.assertIn('m0', second.mail_index)
+
+
+class TestLifecycle(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.token_path = os.path.join(self.temp_dir, 'token.json')
+
+    async def test_aclose_cancels_the_token_refresh(self):
+        token = mock.Mock(refresh_token='refresh', expiry=datetime(2100, 1, 1))
+        with (
+            mock.patch.object(GmailService, '_get_token', return_value=token),
+            mock.patch.object(GmailService, '_get_service', return_value=FakeGmail({})),
+        ):
+            service = GmailService('creds.json', self.token_path)
+
+        service._ensure_token_refresh()
+        refresh_task = service._refresh_task
+        assert refresh_task is not None
+        await asyncio.sleep(0)
+        self.assertFalse(refresh_task.done())
+
+        await service.aclose()
+        self.assertTrue(refresh_task.cancelled())
+        # A closed service does not start refreshing again
+        service._ensure_token_refresh()
+        self.assertIsNone(service._refresh_task)
+
+    async def test_token_is_written_atomically(self):
+        service = make_service(FakeGmail({}))
+        self.addAsyncCleanup(service.aclose)
+        service.token_path = self.token_path
+        with open(self.token_path, 'w') as f:
+            f.write('{"token": "old"}')
+
+        service._save_token(mock.Mock(to_json=lambda: '{"token": "new"}'))
+        with open(self.token_path) as f:
+            self.assertEqual(f.read(), '{"token": "new"}')
+
+        def fail() -> str:
+            raise ValueError('serialization failed')
+
+        with self.assertRaises(ValueError):
+            service._save_token(mock.Mock(to_json=fail))
+        # The previous token survives a failed write, and no temporary file is left
+        with open(self.token_path) as f:
+            self.assertEqual(f.read(), '{"token": "new"}')
+        self.assertEqual(os.listdir(self.temp_dir), ['token.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
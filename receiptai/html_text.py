@@ -0,0 +1,133 @@
+import re
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+
+# Elements whose text is emitted as its own line
+BLOCK_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'div', 'li', 'br', 'tr', 'table', 'ul', 'ol'}
+
+# Elements whose content is never part of the readable text
+SKIPPED_TAGS = {'script', 'style', 'head'}
+
+# Table cells are inline, but adjacent cells must not run their text together
+CELL_TAGS = {'td', 'th'}
+
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+# Invisible characters marketing emails use as preheader padding
+INVISIBLE_CHARACTERS = re.compile('[\u00ad\u034f\u200b\u200c\u200d\u2060\ufeff]')
+WHITESPACE = re.compile(r'\s+')
+
+
+class HtmlTextExtractor(HTMLParser):
+    """
+    Single-pass HTML to text converter for email bodies.
+
+    Text is buffered until the next block boundary and then emitted once, formatted by
+    the innermost heading or list item containing it, so deeply nested layouts cost
+    linear time instead of re-extracting the text of every ancestor element.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines: List[str] = []
+        self._buffer: List[str] = []
+        self._block_stack: List[str] = []
+        self._skip_depth = 0
+        # (href, buffer position where the link text starts) of the open link
+        self._link: Optional[Tuple[str, int]] = None
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif self._skip_depth:
+            return
+        elif tag == 'a':
+            href = dict(attrs).get('href')
+            self._link = (href, len(self._buffer)) if href else None
+        elif tag in CELL_TAGS:
+            self._buffer.append(' ')
+        elif tag in BLOCK_TAGS:
+            self._flush()
+            if tag != 'br':
+                self._block_stack.append(tag)
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        # Self-closing tags such as <br/> never contain text
+        if tag in BLOCK_TAGS and not self._skip_depth:
+            self._flush()
+
+    def handle_endtag(self, tag: str):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif self._skip_depth:
+            return
+        elif tag == 'a':
+            self._close_link()
+        elif tag in CELL_TAGS:
+            self._buffer.append(' ')
+        elif tag in BLOCK_TAGS and tag != 'br':
+            self._flush()
+            # Pop up to the matching element, tolerating unclosed children
+            if tag in self._block_stack:
+                while self._block_stack.pop() != tag:
+                    pass
+
+    def handle_data(self, data: str):
+        if not self._skip_depth:
+            self._buffer.append(data)
+
+    def _close_link(self):
+        if self._link is None:
+            return
+        href, start = self._link
+        self._link = None
+        link_text = _normalize(''.join(self._buffer[start:]))
+        # Preserve URL information by writing links as "text url"
+        del self._buffer[start:]
+        self._buffer.append(f' {link_text or href} {href} ')
+
+    def _flush(self):
+        """Emit the buffered text as a line formatted by its enclosing block."""
+        self._close_link()
+        text = _normalize(''.join(self._buffer))
+        self._buffer = []
+        if not text:
+            return
+
+        heading = next((tag for tag in reversed(self._block_stack) if tag in HEADING_TAGS), None)
+        if heading == 'h1':
+            self.lines.append(f'\n{"=" * len(text)}\n{text}\n{"=" * len(text)}')
+        elif heading == 'h2':
+            self.lines.append(f'\n{text}\n{"-" * len(text)}')
+        elif heading is not None:
+            self.lines.append(f'\n{text}')
+        elif 'li' in self._block_stack:
+            self.lines.append(f'• {text}')
+        else:
+            self.lines.append(text)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def _normalize(text: str) -> str:
+    return WHITESPACE.sub(' ', INVISIBLE_CHARACTERS.sub('', text)).strip()
+
+
+def html_to_text(html: str) -> str:
+    """
+    Converts an HTML email body to readable plain text.
+
+    Headings are underlined, list items are bulleted and links keep their URL.
+
+    Args:
+        html: The HTML content
+
+    Returns:
+        The extracted text
+    """
+    extractor = HtmlTextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return '\n'.join(line for line in extractor.lines if line.strip())
@@ -0,0 +1,58 @@
+import unittest
+
+from html_text import html_to_text
+
+
+class TestHtmlToText(unittest.TestCase):
+    def test_headings(self):
+        self.assertEqual(
+            html_to_text('<h1>Receipt</h1><h2>Items</h2><h3>Notes</h3>'),
+            '\n=======\nReceipt\n=======\n\nItems\n-----\n\nNotes',
+        )
+
+    def test_list_items(self):
+        self.assertEqual(html_to_text('<ul><li>One</li><li>Two</li></ul>'), '• One\n• Two')
+
+    def test_links_keep_url(self):
+        self.assertEqual(
+            html_to_text('<p>View <a href="https://example.com/r">your receipt</a> online</p>'),
+            'View your receipt https://example.com/r online',
+        )
+
+    def test_link_without_text_uses_href(self):
+        self.assertEqual(
+            html_to_text('<a href="https://example.com"><img src="logo.png"></a>'),
+            'https://example.com https://example.com',
+        )
+
+    def test_skips_script_style_and_head(self):
+        html = (
+            '<html><head><title>Ignored</title><style>p { color: red }</style></head>'
+            '<body><script>alert(1)</script><p>Total: $10</p></body></html>'
+        )
+        self.assertEqual(html_to_text(html), 'Total: $10')
+
+    def test_table_cells_are_separated(self):
+        html = '<table><tr><td>Item</td><td>$5</td></tr><tr><td>Tax</td><td>$1</td></tr></table>'
+        self.assertEqual(html_to_text(html), 'Item $5\nTax $1')
+
+    def test_nested_blocks_are_not_duplicated(self):
+        html = '<div><div><div><p>Thanks for your order</p></div></div></div>'
+        self.assertEqual(html_to_text(html), 'Thanks for your order')
+
+    def test_line_breaks_and_entities(self):
+        self.assertEqual(
+            html_to_text('Fish &amp; chips<br>&pound;5<br/>Paid'), 'Fish & chips\n£5\nPaid'
+        )
+
+    def test_removes_invisible_characters(self):
+        self.assertEqual(html_to_text('<p>Hello\u200c\u034f \u00ad world</p>'), 'Hello world')
+
+    def test_tolerates_unclosed_tags(self):
+        self.assertEqual(
+            html_to_text('<div><p>First<p>Second</div><p>Third'), 'First\nSecond\nThird'
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,12 @@
+import functools
 import os
 import logging
 
 from email_types import Email
 from langgraph.graph import StateGraph
 from typing import Any, TypedDict, Literal, Union, List
-from gmail_service import GmailService
+from gmail_service import GmailService, get_shared_gmail_service
+from mail_index import MailIndex
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -25,7 +27,6 @@ if not token_path:
     logger.error('TOKEN_JSON_PATH environment variable is not set')
     raise ValueError('TOKEN_JSON_PATH environment variable is required')
 
-gmail_service = GmailService(creds_file_path, token_path)
 
 class InvoiceInquiryItem(TypedDict):
     timestamp: str
@@ -98,6 +99,26 @@ def build_search_query(state: InvoiceSearchState) -> InvoiceSearchState:
     new_state["defined_query"] = query if query else None
     return new_state
 
+@functools.cache
+def get_gmail_service() -> GmailService:
+    """
+    Returns the shared Gmail service for the workflow.
+
+    The workflow's queries name no label, so a mail index can only answer them when it
+    mirrors the whole mailbox. With MAIL_INDEX_SYNC_LABEL=ALL the service keeps its own
+    index at WORKFLOW_MAIL_INDEX_PATH; otherwise every query is run by Gmail.
+    """
+    if os.environ.get('MAIL_INDEX_SYNC_LABEL', 'INBOX') != 'ALL':
+        return get_shared_gmail_service(creds_file_path, token_path)
+    return get_shared_gmail_service(
+        creds_file_path,
+        token_path,
+        mail_index=MailIndex(
+            os.environ.get('WORKFLOW_MAIL_INDEX_PATH', 'creds/workflow_mail_index.sqlite3')
+        ),
+        sync_label=None,
+    )
+
 async def process_query(state: InvoiceSearchState) -> InvoiceSearchState:
     new_state = state.copy()
     query = new_state.get("defined_query", None)
@@ -106,7 +127,7 @@ async def process_query(state: InvoiceSearchState) -> InvoiceSearchState:
         new_state["query_results"] = None
         return new_state
 
-    query_result = await _process_query(query, gmail_service)
+    query_result = await _process_query(query, get_gmail_service())
 
     new_state["query_results"] = [query_result] if query_result else None
 
@@ -0,0 +1,611 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple, TypedDict, cast
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Gmail search operators that map directly onto system label IDs
+QUERY_OPERATOR_LABELS: Dict[str, str] = {
+    'in:inbox': 'INBOX',
+    'in:sent': 'SENT',
+    'in:drafts': 'DRAFT',
+    'in:spam': 'SPAM',
+    'in:trash': 'TRASH',
+    'is:unread': 'UNREAD',
+    'is:starred': 'STARRED',
+    'is:important': 'IMPORTANT',
+    'label:inbox': 'INBOX',
+    'label:sent': 'SENT',
+    'label:unread': 'UNREAD',
+    'label:starred': 'STARRED',
+    'label:important': 'IMPORTANT',
+}
+
+
+# Gmail search operators answered from the full-text index, and the column they search
+QUERY_OPERATOR_COLUMNS: Dict[str, str] = {
+    'subject': 'subject',
+    'from': 'sender',
+    'body': 'body',
+    'filename': 'attachment_filenames',
+}
+
+# Labels Gmail leaves out of a search unless the query asks for them
+EXCLUDED_SEARCH_LABELS = ['SPAM', 'TRASH']
+
+# Seconds a write waits for another process's write to the index to finish
+BUSY_TIMEOUT_SECONDS = 30.0
+
+_QUERY_TOKEN = re.compile(
+    r'\s*(?:(\()|(\))|(-)?(?:([a-z]+):)?(?:"([^"]*)"|([^\s()"]+)))', re.IGNORECASE
+)
+
+
+class IndexQuery(TypedDict):
+    """A Gmail query translated for the mail index.
+
+    match is the FTS5 query over the message text, or None if the query only has labels.
+    label_ids are the labels a message must carry to match.
+    """
+
+    match: Optional[str]
+    label_ids: List[str]
+
+
+class MessageText(TypedDict):
+    """The text of a message added to the full-text index."""
+
+    id: str
+    body: str
+    attachment_filenames: List[str]
+
+
+def parse_label_query(query: str) -> Optional[List[str]]:
+    """
+    Converts a Gmail query made only of label operators into the label IDs it requires.
+
+    Args:
+        query: The Gmail search query string, e.g. 'in:inbox is:unread'
+
+    Returns:
+        The label IDs a message must carry to match, or None if the query uses anything
+        other than label operators and must be answered by Gmail.
+    """
+    terms = re.split(r'\s+', query.strip().lower())
+    if terms == ['']:
+        return None
+
+    labels = []
+    for term in terms:
+        label = QUERY_OPERATOR_LABELS.get(term)
+        if label is None:
+            return None
+        if label not in labels:
+            labels.append(label)
+    return labels
+
+
+def _fts_phrase(value: str) -> Optional[str]:
+    """Quotes a search value as an FTS5 phrase, or returns None if it has no words."""
+    if not re.search(r'\w', value):
+        return None
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _tokenize_query(query: str) -> Optional[List[Tuple[str, ...]]]:
+    """Splits a Gmail query into ('(',), (')',), ('OR',) and ('term', negated, operator, value)."""
+    tokens: List[Tuple[str, ...]] = []
+    position = 0
+    query = query.strip()
+    while position < len(query):
+        match = _QUERY_TOKEN.match(query, position)
+        if match is None or match.end() == position:
+            return None
+        position = match.end()
+        opening, closing, negated, operator, quoted, word = match.groups()
+        if opening:
+            tokens.append(('(',))
+        elif closing:
+            tokens.append((')',))
+        elif word == 'OR' and not negated and not operator:
+            tokens.append(('OR',))
+        elif word == 'AND' and not negated and not operator:
+            # Gmail's explicit AND is the same as juxtaposition
+            continue
+        elif word is not None and re.search(r'[:{}]', word):
+            # Operators without a value, or Gmail's {a b} OR groups
+            return None
+        else:
+            value = quoted if quoted is not None else word
+            tokens.append(('term', '-' if negated else '', (operator or '').lower(), value))
+    return tokens
+
+
+def parse_search_query(query: str) -> Optional[IndexQuery]:
+    """
+    Translates a Gmail search query into a query of the mail index.
+
+    Free text, quoted phrases, the subject:, from:, body: and filename: operators, OR,
+    negation and parentheses are translated to FTS5. Label operators are supported
+    when they apply to the whole query.
+
+    Args:
+        query: The Gmail search query string, e.g. 'from:shop (receipt OR invoice)'
+
+    Returns:
+        The IndexQuery, or None if the query uses anything else and must be answered by
+        Gmail.
+    """
+    tokens = _tokenize_query(query)
+    if not tokens:
+        return None
+
+    label_ids: List[str] = []
+    position = 0
+
+    def parse_or(top_level: bool) -> Optional[str]:
+        nonlocal position
+        alternatives = [parse_and(top_level)]
+        while position < len(tokens) and tokens[position][0] == 'OR':
+            position += 1
+            alternatives.append(parse_and(False))
+        if len(alternatives) > 1:
+            # Label operators inside an OR cannot be applied as filters
+            if any(alternative is None for alternative in alternatives):
+                raise ValueError('Unsupported OR operand')
+            return '(' + ' OR '.join(cast(List[str], alternatives)) + ')'
+        return alternatives[0]
+
+    def parse_and(top_level: bool) -> Optional[str]:
+        nonlocal position
+        included: List[str] = []
+        excluded: List[str] = []
+        while position < len(tokens) and tokens[position][0] not in ('OR', ')'):
+            token = tokens[position]
+            position += 1
+            if token[0] == '(':
+                group = parse_or(False)
+                if position >= len(tokens) or tokens[position][0] != ')':
+                    raise ValueError('Unbalanced parentheses')
+                position += 1
+                if group is not None:
+                    included.append(group)
+                continue
+
+            _, negated, operator, value = token
+            if operator in ('in', 'is', 'label'):
+                label = QUERY_OPERATOR_LABELS.get(f'{operator}:{value.lower()}')
+                if label is None or negated or not top_level:
+                    raise ValueError(f'Unsupported label operator {operator}:{value}')
+                if label not in label_ids:
+                    label_ids.append(label)
+                continue
+            if operator and operator not in QUERY_OPERATOR_COLUMNS:
+                raise ValueError(f'Unsupported operator {operator}')
+            phrase = _fts_phrase(value)
+            if phrase is None:
+                raise ValueError(f'Unsupported search value {value}')
+            if operator:
+                phrase = f'{QUERY_OPERATOR_COLUMNS[operator]} : {phrase}'
+            (excluded if negated else included).append(phrase)
+
+        if not included:
+            # FTS5 NOT needs something to subtract from
+            if excluded:
+                raise ValueError('Negation without a positive term')
+            return None
+        expression = ' AND '.join(included)
+        if len(included) > 1 or excluded:
+            expression = f'({expression})'
+        for phrase in excluded:
+            expression = f'({expression} NOT {phrase})'
+        return expression
+
+    try:
+        match = parse_or(True)
+    except ValueError as e:
+        logger.debug(f'Query {query!r} cannot be answered from the index: {e}')
+        return None
+    if position != len(tokens) or (match is None and not label_ids):
+        return None
+    return IndexQuery(match=match, label_ids=label_ids)
+
+
+class MailIndex:
+    """
+    A local SQLite index of mailbox message metadata, kept current by incremental sync.
+
+    The index records the Gmail historyId it is synced up to, so the next sync only needs
+    to pull the changes made since then through users.history.list. The subject, sender,
+    body text and attachment filenames of messages can also be added to an FTS5
+    full-text index, so searches of synced mail never leave the machine.
+
+    Several processes can share the database. It runs in WAL mode, so reads never wait
+    for a write, and a write waits up to BUSY_TIMEOUT_SECONDS for another to finish.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the mail index.
+
+        Args:
+            path: The path of the SQLite database file.
+        """
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.path, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False
+        )
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._create_tables()
+        logger.info(f'MailIndex initialized at {self.path}')
+
+    def _create_tables(self):
+        with self._lock, self._connection:
+            self._connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS messages (
+                    id TEXT PRIMARY KEY,
+                    thread_id TEXT,
+                    history_id TEXT,
+                    internal_date INTEGER,
+                    subject TEXT,
+                    sender TEXT,
+                    recipient TEXT,
+                    date TEXT,
+                    snippet TEXT
+                );
+                CREATE TABLE IF NOT EXISTS message_labels (
+                    message_id TEXT NOT NULL,
+                    label_id TEXT NOT NULL,
+                    PRIMARY KEY (message_id, label_id)
+                );
+                CREATE INDEX IF NOT EXISTS message_labels_by_label
+                    ON message_labels (label_id, message_id);
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                -- Rows share the rowid of their message
+                CREATE VIRTUAL TABLE IF NOT EXISTS message_text USING fts5(
+                    subject, sender, body, attachment_filenames
+                );
+                """
+            )
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._connection.close()
+
+    def get_state(self, key: str) -> Optional[str]:
+        """
+        Get a sync state value.
+
+        Args:
+            key: The state key.
+
+        Returns:
+            The stored value, or None if it has not been set.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT value FROM sync_state WHERE key = ?', (key,)
+            ).fetchone()
+        return row['value'] if row else None
+
+    def set_state(self, key: str, value: str):
+        """
+        Set a sync state value.
+
+        Args:
+            key: The state key.
+            value: The value to store.
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)', (key, value)
+            )
+
+    @property
+    def history_id(self) -> Optional[str]:
+        """The Gmail historyId the index is synced up to, if it has been synced."""
+        return self.get_state('history_id')
+
+    def upsert_messages(self, messages: List[Dict[str, Any]]):
+        """
+        Insert or replace message metadata.
+
+        Args:
+            messages: Message dictionaries with id, threadId, historyId, internalDate,
+                labelIds, subject, sender, to, date and snippet keys.
+        """
+        with self._lock, self._connection:
+            for message in messages:
+                # An upsert rather than a replace keeps the rowid the message text is under
+                self._connection.execute(
+                    """
+                    INSERT INTO messages
+                        (id, thread_id, history_id, internal_date, subject, sender, recipient,
+                         date, snippet)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (id) DO UPDATE SET
+                        thread_id = excluded.thread_id,
+                        history_id = excluded.history_id,
+                        internal_date = excluded.internal_date,
+                        subject = excluded.subject,
+                        sender = excluded.sender,
+                        recipient = excluded.recipient,
+                        date = excluded.date,
+                        snippet = excluded.snippet
+                    """,
+                    (
+                        message['id'],
+                        message.get('threadId'),
+                        message.get('historyId'),
+                        int(message.get('internalDate') or 0),
+                        message.get('subject'),
+                        message.get('sender'),
+                        message.get('to'),
+                        message.get('date'),
+                        message.get('snippet'),
+                    ),
+                )
+                self._replace_labels(message['id'], message.get('labelIds', []))
+
+    def _replace_labels(self, message_id: str, label_ids: List[str]):
+        self._connection.execute('DELETE FROM message_labels WHERE message_id = ?', (message_id,))
+        self._connection.executemany(
+            'INSERT INTO message_labels (message_id, label_id) VALUES (?, ?)',
+            [(message_id, label_id) for label_id in label_ids],
+        )
+
+    def update_labels(self, message_id: str, added: List[str], removed: List[str]) -> bool:
+        """
+        Apply label changes to an indexed message.
+
+        Args:
+            message_id: The Gmail message ID.
+            added: Label IDs added to the message.
+            removed: Label IDs removed from the message.
+
+        Returns:
+            True if the message is indexed, False if it is unknown.
+        """
+        with self._lock, self._connection:
+            if not self._contains(message_id):
+                return False
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO message_labels (message_id, label_id) VALUES (?, ?)',
+                [(message_id, label_id) for label_id in added],
+            )
+            self._connection.executemany(
+                'DELETE FROM message_labels WHERE message_id = ? AND label_id = ?',
+                [(message_id, label_id) for label_id in removed],
+            )
+            return True
+
+    def delete_messages(self, message_ids: List[str]):
+        """
+        Remove messages from the index.
+
+        Args:
+            message_ids: The Gmail message IDs to remove.
+        """
+        with self._lock, self._connection:
+            for message_id in message_ids:
+                self._connection.execute(
+                    'DELETE FROM message_labels WHERE message_id = ?', (message_id,)
+                )
+                self._connection.execute(
+                    'DELETE FROM message_text WHERE rowid = (SELECT rowid FROM messages WHERE id = ?)',
+                    (message_id,),
+                )
+                self._connection.execute('DELETE FROM messages WHERE id = ?', (message_id,))
+
+    def clear(self):
+        """Remove every message and all sync state, e.g. before a full resync."""
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM message_labels')
+            self._connection.execute('DELETE FROM message_text')
+            self._connection.execute('DELETE FROM messages')
+            self._connection.execute('DELETE FROM sync_state')
+
+    def _contains(self, message_id: str) -> bool:
+        row = self._connection.execute(
+            'SELECT 1 FROM messages WHERE id = ?', (message_id,)
+        ).fetchone()
+        return row is not None
+
+    def __contains__(self, message_id: str) -> bool:
+        with self._lock:
+            return self._contains(message_id)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+    def get_message(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the indexed metadata of a message.
+
+        Args:
+            message_id: The Gmail message ID.
+
+        Returns:
+            The message dictionary, or None if the message is not indexed.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT * FROM messages WHERE id = ?', (message_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            labels = self._connection.execute(
+                'SELECT label_id FROM message_labels WHERE message_id = ? ORDER BY label_id',
+                (message_id,),
+            ).fetchall()
+        return {
+            'id': row['id'],
+            'threadId': row['thread_id'],
+            'historyId': row['history_id'],
+            'internalDate': row['internal_date'],
+            'labelIds': [label['label_id'] for label in labels],
+            'subject': row['subject'],
+            'sender': row['sender'],
+            'to': row['recipient'],
+            'date': row['date'],
+            'snippet': row['snippet'],
+        }
+
+    def message_ids_with_labels(self, label_ids: List[str]) -> List[str]:
+        """
+        List the IDs of indexed messages carrying all of the given labels.
+
+        Args:
+            label_ids: The label IDs every returned message must have.
+
+        Returns:
+            The matching message IDs, newest first like Gmail search results.
+        """
+        placeholders = ', '.join('?' for _ in label_ids)
+        with self._lock:
+            rows = self._connection.execute(
+                f"""
+                SELECT m.id FROM messages m
+                JOIN message_labels l ON l.message_id = m.id
+                WHERE l.label_id IN ({placeholders})
+                GROUP BY m.id
+                HAVING COUNT(DISTINCT l.label_id) = ?
+                ORDER BY m.internal_date DESC
+                """,
+                (*label_ids, len(label_ids)),
+            ).fetchall()
+        return [row['id'] for row in rows]
+
+    def index_message_texts(self, texts: List[MessageText]):
+        """
+        Add the text of indexed messages to the full-text index.
+
+        The subject and sender are taken from the indexed metadata; messages that are not
+        indexed are skipped.
+
+        Args:
+            texts: The body text and attachment filenames of each message.
+        """
+        with self._lock, self._connection:
+            for text in texts:
+                row = self._connection.execute(
+                    'SELECT rowid, subject, sender FROM messages WHERE id = ?', (text['id'],)
+                ).fetchone()
+                if row is None:
+                    continue
+                self._connection.execute(
+                    """
+                    INSERT OR REPLACE INTO message_text
+                        (rowid, subject, sender, body, attachment_filenames)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (
+                        row['rowid'],
+                        row['subject'] or '',
+                        row['sender'] or '',
+                        text['body'],
+                        ' '.join(text['attachment_filenames']),
+                    ),
+                )
+
+    def message_ids_without_text(self) -> List[str]:
+        """
+        List the IDs of indexed messages whose text is not in the full-text index yet.
+
+        Returns:
+            The message IDs, newest first.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                """
+                SELECT id FROM messages
+                WHERE rowid NOT IN (SELECT rowid FROM message_text)
+                ORDER BY internal_date DESC
+                """
+            ).fetchall()
+        return [row['id'] for row in rows]
+
+    def has_messages_without_text(self) -> bool:
+        """
+        Check whether any indexed message is missing from the full-text index.
+
+        Returns:
+            True if some message's text still has to be indexed.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                """
+                SELECT 1 FROM messages
+                WHERE rowid NOT IN (SELECT rowid FROM message_text)
+                LIMIT 1
+                """
+            ).fetchone()
+        return row is not None
+
+    def search(self, query: IndexQuery, limit: Optional[int] = None) -> List[str]:
+        """
+        List the IDs of indexed messages matching a query.
+
+        Messages whose text is not in the full-text index only match queries without
+        text. As in Gmail, spam and trash only match if the query asks for them.
+
+        Args:
+            query: The query, as returned by parse_search_query.
+            limit: The maximum number of IDs to return.
+
+        Returns:
+            The matching message IDs, newest first like Gmail search results.
+        """
+        conditions = []
+        parameters: List[Any] = []
+        if query['match'] is not None:
+            conditions.append(
+                'm.rowid IN (SELECT rowid FROM message_text WHERE message_text MATCH ?)'
+            )
+            parameters.append(query['match'])
+        if query['label_ids']:
+            placeholders = ', '.join('?' for _ in query['label_ids'])
+            conditions.append(
+                f"""
+                m.id IN (
+                    SELECT message_id FROM message_labels
+                    WHERE label_id IN ({placeholders})
+                    GROUP BY message_id
+                    HAVING COUNT(DISTINCT label_id) = ?
+                )
+                """
+            )
+            parameters.extend([*query['label_ids'], len(query['label_ids'])])
+        excluded = [label for label in EXCLUDED_SEARCH_LABELS if label not in query['label_ids']]
+        if excluded:
+            placeholders = ', '.join('?' for _ in excluded)
+            conditions.append(
+                f'm.id NOT IN (SELECT message_id FROM message_labels WHERE label_id IN ({placeholders}))'
+            )
+            parameters.extend(excluded)
+
+        sql = 'SELECT m.id FROM messages m'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY m.internal_date DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            parameters.append(limit)
+
+        with self._lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+        return [row['id'] for row in rows]
@@ -0,0 +1,206 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mail_index import IndexQuery, MailIndex, parse_label_query, parse_search_query
+
+
+class TestParseLabelQuery(unittest.TestCase):
+    def test_label_operators(self):
+        self.assertEqual(parse_label_query('in:inbox is:unread'), ['INBOX', 'UNREAD'])
+        self.assertEqual(parse_label_query('  IS:STARRED  '), ['STARRED'])
+
+    def test_other_operators_are_not_supported(self):
+        self.assertIsNone(parse_label_query('in:inbox from:billing@example.com'))
+        self.assertIsNone(parse_label_query('receipt'))
+        self.assertIsNone(parse_label_query(''))
+
+
+class TestParseSearchQuery(unittest.TestCase):
+    def test_free_text_and_operators(self):
+        self.assertEqual(
+            parse_search_query('from:shop.com (receipt OR invoice) -refund'),
+            IndexQuery(
+                match='((sender : "shop.com" AND ("receipt" OR "invoice")) NOT "refund")',
+                label_ids=[],
+            ),
+        )
+        self.assertEqual(
+            parse_search_query('in:inbox subject:"Your order"'),
+            IndexQuery(match='subject : "Your order"', label_ids=['INBOX']),
+        )
+
+    def test_label_only_query(self):
+        self.assertEqual(
+            parse_search_query('in:inbox is:unread'),
+            IndexQuery(match=None, label_ids=['INBOX', 'UNREAD']),
+        )
+
+    def test_unsupported_queries(self):
+        for query in [
+            '',
+            'after:2024/01/01 receipt',
+            'to:me receipt',
+            'in:inbox OR receipt',
+            '-receipt',
+            '{receipt invoice}',
+            'subject:(receipt invoice)',
+            '(receipt',
+        ]:
+            with self.subTest(query=query):
+                self.assertIsNone(parse_search_query(query))
+
+
+class TestMailIndex(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory for testing
+        self.temp_dir = tempfile.mkdtemp()
+        self.index = MailIndex(os.path.join(self.temp_dir, 'index.sqlite3'))
+        self.index.upsert_messages(
+            [
+                {'id': 'old', 'internalDate': '1000', 'labelIds': ['INBOX', 'UNREAD']},
+                {'id': 'new', 'internalDate': '2000', 'labelIds': ['INBOX', 'UNREAD']},
+                {'id': 'read', 'internalDate': '3000', 'labelIds': ['INBOX']},
+            ]
+        )
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_message_ids_with_labels_newest_first(self):
+        self.assertEqual(self.index.message_ids_with_labels(['INBOX', 'UNREAD']), ['new', 'old'])
+        self.assertEqual(self.index.message_ids_with_labels(['INBOX']), ['read', 'new', 'old'])
+
+    def test_update_labels(self):
+        self.assertTrue(self.index.update_labels('old', [], ['UNREAD']))
+        self.assertTrue(self.index.update_labels('read', ['UNREAD'], []))
+        self.assertEqual(self.index.message_ids_with_labels(['UNREAD']), ['read', 'new'])
+
+    def test_update_labels_of_unknown_message(self):
+        self.assertFalse(self.index.update_labels('missing', ['UNREAD'], []))
+        self.assertNotIn('missing', self.index)
+
+    def test_delete_messages(self):
+        self.index.delete_messages(['new'])
+        self.assertNotIn('new', self.index)
+        self.assertEqual(self.index.message_ids_with_labels(['UNREAD']), ['old'])
+
+    def test_history_id_persists(self):
+        self.assertIsNone(self.index.history_id)
+        self.index.set_state('history_id', '1234')
+        self.index.close()
+
+        self.index = MailIndex(os.path.join(self.temp_dir, 'index.sqlite3'))
+        self.assertEqual(self.index.history_id, '1234')
+        self.assertEqual(len(self.index), 3)
+
+    def test_connections_share_the_database(self):
+        other = MailIndex(os.path.join(self.temp_dir, 'index.sqlite3'))
+        self.addCleanup(other.close)
+        other.upsert_messages([{'id': 'other', 'internalDate': '4000', 'labelIds': ['INBOX']}])
+        other.set_state('history_id', '1234')
+
+        self.assertIn('other', self.index)
+        self.assertEqual(self.index.history_id, '1234')
+        mode = self.index._connection.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual(mode, 'wal')
+
+    def test_clear(self):
+        self.index.set_state('history_id', '1234')
+        self.index.clear()
+        self.assertIsNone(self.index.history_id)
+        self.assertEqual(len(self.index), 0)
+
+
+class TestMailIndexSearch(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.index = MailIndex(os.path.join(self.temp_dir, 'index.sqlite3'))
+        self.index.upsert_messages(
+            [
+                {
+                    'id': 'casa',
+                    'internalDate': '1000',
+                    'labelIds': ['INBOX'],
+                    'subject': 'Your receipt from CASA',
+                    'sender': 'billing@casa.example',
+                },
+                {
+                    'id': 'stable',
+                    'internalDate': '2000',
+                    'labelIds': ['INBOX', 'UNREAD'],
+                    'subject': 'Invoice ORD-1745343236226',
+                    'sender': 'Stable <billing@stable.example>',
+                },
+                {
+                    'id': 'spam',
+                    'internalDate': '3000',
+                    'labelIds': ['SPAM'],
+                    'subject': 'Your receipt',
+                    'sender': 'spam@example.com',
+                },
+            ]
+        )
+        self.index.index_message_texts(
+            [
+                {'id': 'casa', 'body': 'Total 66.00 EUR', 'attachment_filenames': []},
+                {
+                    'id': 'stable',
+                    'body': 'Thanks for your order',
+                    'attachment_filenames': ['Receipt-2099-8486.pdf'],
+                },
+                {'id': 'spam', 'body': 'Total 66.00 EUR', 'attachment_filenames': []},
+            ]
+        )
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.temp_dir)
+
+    def search(self, query: str):
+        index_query = parse_search_query(query)
+        assert index_query is not None
+        return self.index.search(index_query)
+
+    def test_search_columns(self):
+        self.assertEqual(self.search('receipt'), ['stable', 'casa'])
+        self.assertEqual(self.search('subject:receipt'), ['casa'])
+        self.assertEqual(self.search('from:stable.example'), ['stable'])
+        self.assertEqual(self.search('filename:pdf'), ['stable'])
+        self.assertEqual(self.search('body:"66.00"'), ['casa'])
+
+    def test_search_workflow_query(self):
+        query = '(body:"CASA" OR subject:"CASA") OR (body:"ORD-1745343236226" OR subject:"ORD-1745343236226")'
+        self.assertEqual(self.search(query), ['stable', 'casa'])
+
+    def test_search_with_labels_and_negation(self):
+        self.assertEqual(self.search('in:inbox is:unread receipt'), ['stable'])
+        self.assertEqual(self.search('receipt -invoice'), ['casa'])
+        self.assertEqual(self.search('in:spam receipt'), ['spam'])
+        self.assertEqual(
+            self.index.search(IndexQuery(match=None, label_ids=['INBOX']), limit=1), ['stable']
+        )
+
+    def test_messages_without_text(self):
+        self.assertFalse(self.index.has_messages_without_text())
+        self.index.upsert_messages([{'id': 'new', 'internalDate': '4000', 'labelIds': ['INBOX']}])
+        self.assertTrue(self.index.has_messages_without_text())
+        self.assertEqual(self.index.message_ids_without_text(), ['new'])
+        self.assertEqual(self.search('in:inbox'), ['new', 'stable', 'casa'])
+
+    def test_reindexed_message_keeps_text(self):
+        self.index.upsert_messages([{'id': 'casa', 'internalDate': '1000', 'labelIds': []}])
+        self.assertEqual(self.index.message_ids_without_text(), [])
+        self.assertEqual(self.search('body:"66.00"'), ['casa'])
+
+    def test_delete_and_clear_remove_text(self):
+        self.index.delete_messages(['casa'])
+        self.assertEqual(self.search('receipt'), ['stable'])
+        self.index.clear()
+        self.assertEqual(self.search('receipt'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,379 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, TypedDict, TypeVar
+
+from file_lock import FileLock
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class CacheStats(TypedDict):
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    size_bytes: int
+
+
+class MessageCache:
+    """
+    A size-bounded, on-disk LRU cache of raw Gmail messages keyed by message ID.
+
+    Gmail message content is immutable, so the raw RFC822 bytes of a message never need
+    to be downloaded twice. Each entry is stored as <id>.eml next to a <id>.json file
+    holding parsed metadata (including the historyId the message was fetched at). File
+    modification times record recency, so the LRU order survives restarts.
+
+    Several processes can share the directory. Writes and evictions hold a lock file and
+    append what they changed to a change log, which every process replays from where it
+    left off before evicting, so the cache stays within max_bytes however many processes
+    fill it without rescanning the directory. Reads append the entries they used, so the
+    LRU order is shared too. When the log grows well past the number of entries, it is
+    rewritten as one line per entry. Entries another process stored are picked up on
+    read.
+    """
+
+    RAW_SUFFIX = '.eml'
+    METADATA_SUFFIX = '.json'
+    TEMP_SUFFIX = '.tmp'
+    LOCK_FILENAME = '.lock'
+    LOG_FILENAME = '.changes'
+    # The log is compacted once it has this many lines per entry, and at least MIN_LOG_LINES
+    LOG_LINES_PER_ENTRY = 4
+    MIN_LOG_LINES = 1024
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Initialize the message cache.
+
+        Args:
+            directory: The directory the cache entries are stored in.
+            max_bytes: The maximum total size of the cache entries on disk.
+        """
+        if max_bytes <= 0:
+            raise ValueError(f'max_bytes must be positive, got {max_bytes}')
+
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(os.path.join(self.directory, self.LOCK_FILENAME))
+        self.log_path = os.path.join(self.directory, self.LOG_FILENAME)
+        # The first line of the change log, which a compaction replaces
+        self._log_header: Optional[bytes] = None
+        # How far into the change log has been replayed, and how many lines that was
+        self._log_offset = 0
+        self._log_lines = 0
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._size_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        with self._lock, self._file_lock:
+            self._scan()
+        logger.info(
+            f'MessageCache initialized with {len(self._entries)} entries '
+            f'({self._size_bytes} bytes) in {self.directory}'
+        )
+
+    def _scan(self):
+        """
+        Rebuild the entries from the directory, oldest first, and compact the change log
+        to match; hold both locks.
+        """
+        self._entries.clear()
+        self._size_bytes = 0
+        found = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(self.TEMP_SUFFIX):
+                # Left behind by a writer that died; live writers hold the lock
+                os.remove(os.path.join(self.directory, filename))
+                continue
+            if not filename.endswith(self.RAW_SUFFIX):
+                continue
+            message_id = filename[: -len(self.RAW_SUFFIX)]
+            raw_path = self._raw_path(message_id)
+            metadata_path = self._metadata_path(message_id)
+            if not os.path.exists(metadata_path):
+                # Left behind by an interrupted write
+                os.remove(raw_path)
+                continue
+            size = os.path.getsize(raw_path) + os.path.getsize(metadata_path)
+            found.append((os.path.getmtime(raw_path), message_id, size))
+
+        for _, message_id, size in sorted(found):
+            self._entries[message_id] = size
+            self._size_bytes += size
+        self._evict()
+        self._compact_log()
+
+    def _compact_log(self):
+        """Rewrite the change log as one line per entry, oldest first; hold both locks."""
+        header = f'{uuid.uuid4().hex}\n'.encode()
+        lines = b''.join(
+            f'put {message_id} {size}\n'.encode() for message_id, size in self._entries.items()
+        )
+        self._write_atomically(self.log_path, header + lines)
+        self._log_header = header
+        self._log_offset = len(header) + len(lines)
+        self._log_lines = len(self._entries)
+
+    def _append_log(self, lines: List[str]):
+        """
+        Append lines to the change log in one write, so appends never interleave.
+
+        Raises:
+            FileNotFoundError: If the change log is missing; it is only created with its
+                header, under the file lock.
+        """
+        fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(fd, ''.join(f'{line}\n' for line in lines).encode())
+        finally:
+            os.close(fd)
+
+    def _refresh(self):
+        """
+        Replay the changes other processes appended to the change log since the last
+        call; hold both locks.
+
+        A log compacted by another process is replayed from the start, and a missing log
+        is rebuilt from the directory.
+        """
+        try:
+            with open(self.log_path, 'rb') as f:
+                header = f.readline()
+                if header != self._log_header:
+                    self._entries.clear()
+                    self._size_bytes = 0
+                    self._log_header = header
+                    self._log_offset = len(header)
+                    self._log_lines = 0
+                f.seek(self._log_offset)
+                data = f.read()
+        except FileNotFoundError:
+            self._scan()
+            return
+
+        # A line without its newline is still being appended, and is replayed next time
+        complete = data[: data.rfind(b'\n') + 1]
+        self._log_offset += len(complete)
+        for line in complete.decode('utf-8', errors='replace').splitlines():
+            self._log_lines += 1
+            change = line.split()
+            if len(change) < 2 or not change[1].isalnum():
+                logger.warning(f'Skipping invalid change log line: {line.strip()}')
+                continue
+            operation, message_id = change[0], change[1]
+            if operation == 'put' and len(change) == 3 and change[2].isdigit():
+                self._forget(message_id)
+                self._entries[message_id] = int(change[2])
+                self._size_bytes += int(change[2])
+            elif operation == 'del':
+                self._forget(message_id)
+            elif operation == 'use':
+                if message_id in self._entries:
+                    self._entries.move_to_end(message_id)
+            else:
+                logger.warning(f'Skipping invalid change log line: {line.strip()}')
+
+    def _raw_path(self, message_id: str) -> str:
+        return os.path.join(self.directory, f'{message_id}{self.RAW_SUFFIX}')
+
+    def _metadata_path(self, message_id: str) -> str:
+        return os.path.join(self.directory, f'{message_id}{self.METADATA_SUFFIX}')
+
+    def _validate_message_id(self, message_id: str):
+        if not message_id or not message_id.isalnum():
+            raise ValueError(f'Invalid message ID: {message_id}')
+
+    def _touch(self, message_id: str):
+        """Mark an entry as most recently used, in memory, on disk and in the change log."""
+        self._entries.move_to_end(message_id)
+        try:
+            os.utime(self._raw_path(message_id))
+            # Appended without the file lock, so reads stay parallel; a use logged just
+            # before a compaction is lost, which only costs the order of that entry
+            self._append_log([f'use {message_id}'])
+        except FileNotFoundError:
+            # Evicted by another process since it was read, or the log is being rebuilt
+            pass
+
+    def _adopt(self, message_id: str) -> bool:
+        """Start tracking an entry another process stored, if it is complete."""
+        if not message_id.isalnum():
+            return False
+        try:
+            size = os.path.getsize(self._raw_path(message_id)) + os.path.getsize(
+                self._metadata_path(message_id)
+            )
+        except FileNotFoundError:
+            return False
+        self._entries[message_id] = size
+        self._size_bytes += size
+        return True
+
+    def _forget(self, message_id: str):
+        """Stop tracking an entry, leaving its files to whoever holds the file lock."""
+        size = self._entries.pop(message_id, None)
+        if size is not None:
+            self._size_bytes -= size
+
+    def _remove(self, message_id: str):
+        """Delete an entry; hold both locks."""
+        self._forget(message_id)
+        for path in (self._raw_path(message_id), self._metadata_path(message_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _evict(self) -> List[str]:
+        """
+        Drop least recently used entries until the cache fits in max_bytes; hold both locks.
+
+        Returns:
+            The IDs of the evicted messages.
+        """
+        evicted = []
+        while self._size_bytes > self.max_bytes and self._entries:
+            message_id = next(iter(self._entries))
+            self._remove(message_id)
+            self._evictions += 1
+            evicted.append(message_id)
+            logger.info(f'Evicted message {message_id} from cache')
+        return evicted
+
+    def _write_atomically(self, path: str, data: bytes):
+        """Write a file through a temporary file, so readers never see it half written."""
+        temp_fd, temp_path = tempfile.mkstemp(
+            dir=self.directory, prefix='.', suffix=self.TEMP_SUFFIX
+        )
+        try:
+            with os.fdopen(temp_fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _read_entry(self, message_id: str, path: str, load: Callable[[BinaryIO], T]) -> Optional[T]:
+        """
+        Read a file of an entry without holding the lock, so reads run in parallel.
+
+        Entry files are written atomically and only deleted under the file lock, so a
+        read sees the whole file or none of it.
+        """
+        if not message_id.isalnum():
+            with self._lock:
+                self._misses += 1
+            return None
+        try:
+            with open(path, 'rb') as f:
+                value = load(f)
+        except (FileNotFoundError, ValueError):
+            # Never cached, or evicted by another process
+            with self._lock:
+                self._forget(message_id)
+                self._misses += 1
+            return None
+
+        with self._lock:
+            if message_id not in self._entries and not self._adopt(message_id):
+                # Still being written by another process
+                self._misses += 1
+                return None
+            self._touch(message_id)
+            self._hits += 1
+        return value
+
+    def get_raw(self, message_id: str) -> Optional[bytes]:
+        """
+        Get the raw RFC822 bytes of a cached message.
+
+        Args:
+            message_id: The Gmail message ID.
+
+        Returns:
+            The raw message bytes, or None if the message is not cached.
+        """
+        return self._read_entry(message_id, self._raw_path(message_id), lambda f: f.read())
+
+    def get_metadata(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the parsed metadata of a cached message.
+
+        Args:
+            message_id: The Gmail message ID.
+
+        Returns:
+            The metadata dictionary, or None if the message is not cached.
+        """
+        return self._read_entry(message_id, self._metadata_path(message_id), json.load)
+
+    def put(self, message_id: str, raw: bytes, metadata: Dict[str, Any]):
+        """
+        Store a message in the cache, evicting least recently used entries if needed.
+
+        Storing a message that is already cached replaces its metadata, e.g. with the
+        labels and historyId of a newer fetch.
+
+        Args:
+            message_id: The Gmail message ID.
+            raw: The raw RFC822 bytes of the message.
+            metadata: JSON-serializable metadata about the message.
+        """
+        self._validate_message_id(message_id)
+        metadata_bytes = json.dumps(metadata, default=str).encode('utf-8')
+        size = len(raw) + len(metadata_bytes)
+        if size > self.max_bytes:
+            logger.warning(f'Message {message_id} ({size} bytes) is larger than the cache')
+            return
+
+        with self._lock, self._file_lock:
+            self._refresh()
+            self._forget(message_id)
+
+            # Metadata is written last, so a raw file without metadata marks a partial write
+            self._write_atomically(self._raw_path(message_id), raw)
+            self._write_atomically(self._metadata_path(message_id), metadata_bytes)
+
+            self._entries[message_id] = size
+            self._size_bytes += size
+            evicted = self._evict()
+            self._append_log(
+                [f'put {message_id} {size}'] + [f'del {evicted_id}' for evicted_id in evicted]
+            )
+            self._refresh()
+            if self._log_lines > max(
+                self.MIN_LOG_LINES, self.LOG_LINES_PER_ENTRY * len(self._entries)
+            ):
+                self._compact_log()
+
+    def __contains__(self, message_id: str) -> bool:
+        with self._lock:
+            return message_id in self._entries
+
+    def stats(self) -> CacheStats:
+        """Return the hit, miss and eviction counters and the current cache size."""
+        with self._lock:
+            return CacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                entries=len(self._entries),
+                size_bytes=self._size_bytes,
+            )
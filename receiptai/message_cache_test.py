@@ -0,0 +1,163 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from message_cache import MessageCache
+
+
+def fill_cache(directory: str, max_bytes: int, prefix: str, count: int):
+    cache = MessageCache(directory, max_bytes=max_bytes)
+    for index in range(count):
+        cache.put(f'{prefix}{index}', b'x' * 100, {})
+
+
+class TestMessageCache(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory for testing
+        self.temp_dir = tempfile.mkdtemp()
+        self.raw = b'Subject: Receipt\r\n\r\nThanks for your order'
+        self.metadata = {'id': 'abc123', 'historyId': '42', 'subject': 'Receipt'}
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_put_and_get(self):
+        cache = MessageCache(self.temp_dir)
+        cache.put('abc123', self.raw, self.metadata)
+
+        self.assertEqual(cache.get_raw('abc123'), self.raw)
+        self.assertEqual(cache.get_metadata('abc123'), self.metadata)
+        self.assertIn('abc123', cache)
+
+    def test_hit_and_miss_counters(self):
+        cache = MessageCache(self.temp_dir)
+        self.assertIsNone(cache.get_raw('abc123'))
+        cache.put('abc123', self.raw, self.metadata)
+        cache.get_raw('abc123')
+        cache.get_raw('abc123')
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['entries'], 1)
+
+    def test_persists_across_instances(self):
+        MessageCache(self.temp_dir).put('abc123', self.raw, self.metadata)
+
+        cache = MessageCache(self.temp_dir)
+        self.assertEqual(cache.get_raw('abc123'), self.raw)
+
+    def test_evicts_least_recently_used(self):
+        entry_size = len(self.raw) + len(b'{}')
+        cache = MessageCache(self.temp_dir, max_bytes=entry_size * 2)
+        cache.put('first', self.raw, {})
+        cache.put('second', self.raw, {})
+        # Reading the first entry makes the second the least recently used
+        cache.get_raw('first')
+        cache.put('third', self.raw, {})
+
+        self.assertIn('first', cache)
+        self.assertNotIn('second', cache)
+        self.assertIn('third', cache)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'second.eml')))
+
+    def test_replaces_existing_entry(self):
+        cache = MessageCache(self.temp_dir)
+        cache.put('abc123', self.raw, self.metadata)
+        cache.put('abc123', self.raw, {**self.metadata, 'historyId': '43'})
+
+        self.assertEqual(cache.get_metadata('abc123')['historyId'], '43')
+        self.assertEqual(cache.stats()['entries'], 1)
+
+    def test_discards_partial_writes(self):
+        with open(os.path.join(self.temp_dir, 'partial.eml'), 'wb') as f:
+            f.write(self.raw)
+
+        cache = MessageCache(self.temp_dir)
+        self.assertNotIn('partial', cache)
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'partial.eml')))
+
+    def test_rejects_invalid_message_id(self):
+        cache = MessageCache(self.temp_dir)
+        with self.assertRaises(ValueError):
+            cache.put('../escape', self.raw, {})
+
+    def test_instances_share_a_directory(self):
+        entry_size = len(self.raw) + len(b'{}')
+        first = MessageCache(self.temp_dir, max_bytes=entry_size * 2)
+        second = MessageCache(self.temp_dir, max_bytes=entry_size * 2)
+        first.put('one', self.raw, {})
+        # Entries the other instance stored are picked up on read
+        self.assertEqual(second.get_raw('one'), self.raw)
+
+        second.put('two', self.raw, {})
+        first.put('three', self.raw, {})
+        # The instance that wrote last saw all three entries and evicted one of them
+        self.assertEqual(len(os.listdir(self.temp_dir)), 2 * 2 + 2)
+        evicted = [name for name in ['one', 'two', 'three'] if second.get_raw(name) is None]
+        self.assertEqual(len(evicted), 1)
+
+    def test_changes_are_replayed_without_rescanning(self):
+        entry_size = len(self.raw) + len(b'{}')
+        first = MessageCache(self.temp_dir, max_bytes=entry_size * 3)
+        second = MessageCache(self.temp_dir, max_bytes=entry_size * 3)
+        for message_id in ['one', 'two', 'three']:
+            first.put(message_id, self.raw, {})
+        # Reading an entry makes it the most recently used one in every process
+        self.assertEqual(first.get_raw('one'), self.raw)
+
+        with mock.patch('message_cache.os.listdir', side_effect=AssertionError('rescanned')):
+            second.put('four', self.raw, {})
+        self.assertEqual(second.stats()['entries'], 3)
+        self.assertIsNone(second.get_raw('two'))
+        self.assertEqual(second.get_raw('one'), self.raw)
+
+    def test_change_log_is_compacted(self):
+        entry_size = len(self.raw) + len(b'{}')
+        first = MessageCache(self.temp_dir, max_bytes=entry_size * 2)
+        second = MessageCache(self.temp_dir, max_bytes=entry_size * 2)
+        with mock.patch.object(MessageCache, 'MIN_LOG_LINES', 4):
+            for index in range(20):
+                first.put(f'm{index}', self.raw, {})
+                first.get_raw(f'm{index}')
+            with open(os.path.join(self.temp_dir, MessageCache.LOG_FILENAME)) as f:
+                # Without compaction it would hold 20 puts, 18 deletions and 20 uses
+                self.assertLess(len(f.readlines()), 12)
+
+            # The other instance replays the compacted log from the start
+            second.put('last', self.raw, {})
+        self.assertEqual(second.stats()['entries'], 2)
+        self.assertEqual(second.stats()['size_bytes'], entry_size * 2)
+        self.assertEqual(
+            sorted(os.listdir(self.temp_dir)),
+            sorted(['.changes', '.lock', 'm19.eml', 'm19.json', 'last.eml', 'last.json']),
+        )
+
+    def test_processes_share_a_directory_within_max_bytes(self):
+        entry_size = 100 + len(b'{}')
+        max_bytes = entry_size * 10
+        context = multiprocessing.get_context('spawn')
+        processes = [
+            context.Process(target=fill_cache, args=(self.temp_dir, max_bytes, prefix, 40))
+            for prefix in ['a', 'b']
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(30)
+            self.assertEqual(process.exitcode, 0)
+
+        names = os.listdir(self.temp_dir)
+        entries = [name[: -len('.eml')] for name in names if name.endswith('.eml')]
+        self.assertLessEqual(len(entries) * entry_size, max_bytes)
+        for entry in entries:
+            self.assertIn(f'{entry}.json', names)
+        self.assertFalse([name for name in names if name.endswith('.tmp')])
+
+
+if __name__ == '__main__':
+    unittest.main()
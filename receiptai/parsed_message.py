@@ -0,0 +1,175 @@
+import logging
+from datetime import datetime
+from email import message_from_bytes
+from email.header import decode_header
+from email.message import Message
+from email.parser import BytesHeaderParser
+from email.utils import parsedate_to_datetime
+from functools import cached_property
+from typing import Any, Dict, List, Optional, cast
+
+from email_types import Attachment
+from html_text import html_to_text
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def decode_mime_header(header: str) -> str:
+    """Helper function to decode encoded email headers"""
+    decoded_parts = decode_header(header)
+    decoded_string = ''
+    for part, encoding in decoded_parts:
+        if isinstance(part, bytes):
+            decoded_string += part.decode(encoding or 'utf-8', errors='replace')
+        else:
+            decoded_string += part
+    return decoded_string
+
+
+class ParsedMessage:
+    """
+    An email message parsed from a single raw RFC822 download.
+
+    Headers, body text, HTML and attachment payloads are all derived from the same raw
+    bytes, and each is only parsed the first time it is accessed, so one fetch of the
+    message serves every later lookup.
+    """
+
+    def __init__(self, message_id: str, raw: bytes):
+        """
+        Initialize the parsed message.
+
+        Args:
+            message_id: The Gmail message ID.
+            raw: The raw RFC822 bytes of the message.
+        """
+        self.id = message_id
+        self.raw = raw
+
+    @cached_property
+    def headers(self) -> Message:
+        """The message headers, parsed without touching the body."""
+        return BytesHeaderParser().parsebytes(self.raw)
+
+    @cached_property
+    def mime_message(self) -> Message:
+        """The full MIME tree of the message."""
+        return message_from_bytes(self.raw)
+
+    @property
+    def subject(self) -> str:
+        return decode_mime_header(self.headers.get('subject', 'No Subject'))
+
+    @property
+    def sender(self) -> str:
+        return self.headers.get('from', 'Unknown Sender')
+
+    @property
+    def to(self) -> str:
+        return self.headers.get('to', 'Unknown Recipient')
+
+    @cached_property
+    def date(self) -> Optional[datetime]:
+        """The Date header as a datetime, or None if it is missing or invalid."""
+        date_str = self.headers.get('date')
+        if not date_str:
+            logger.warning(f'No date found in email {self.id}')
+            return None
+        try:
+            # Parse the email date string into a datetime object
+            return parsedate_to_datetime(date_str)
+        except Exception as e:
+            logger.error(f"Error parsing email date '{date_str}': {str(e)}")
+            return None  # None instead of defaulting to now
+
+    def _first_part_content(self, content_type: str) -> Optional[str]:
+        """Decode the first MIME part of the given content type, if there is one."""
+        for part in self.mime_message.walk():
+            if part.get_content_type() == content_type:
+                payload = part.get_payload(decode=True)
+                if payload and isinstance(payload, bytes):
+                    return payload.decode(errors='replace')
+                return None
+        return None
+
+    @cached_property
+    def text_body(self) -> Optional[str]:
+        """The first text/plain part of the message."""
+        return self._first_part_content('text/plain')
+
+    @cached_property
+    def html_body(self) -> Optional[str]:
+        """The first text/html part of the message."""
+        return self._first_part_content('text/html')
+
+    @cached_property
+    def body(self) -> str:
+        """The readable body: plain text if present, otherwise text extracted from HTML."""
+        if self.text_body is not None:
+            return self.text_body
+        if self.html_body is not None:
+            return html_to_text(self.html_body) or '[No text content found]'
+        return '[No text content found]'
+
+    @cached_property
+    def attachment_filenames(self) -> List[str]:
+        """The filenames of the attachments, without decoding their payloads."""
+        return [
+            decode_mime_header(filename)
+            for part in self.mime_message.walk()
+            if not part.is_multipart() and (filename := part.get_filename())
+        ]
+
+    @cached_property
+    def attachments_by_part_id(self) -> Dict[str, Attachment]:
+        """
+        The attachment payloads of the message by part ID, in MIME-tree order.
+
+        Parts are numbered as the Gmail API numbers them: the root part is '', and the
+        children of a multipart part count up from 0 after its ID and a dot.
+        """
+        attachments: Dict[str, Attachment] = {}
+        parts = [('', self.mime_message)]
+        while parts:
+            part_id, part = parts.pop()
+            if part.is_multipart():
+                children = cast(List[Message], part.get_payload())
+                prefix = f'{part_id}.' if part_id else ''
+                # Reversed, so the first child is popped first
+                parts.extend(
+                    (f'{prefix}{index}', child)
+                    for index, child in reversed(list(enumerate(children)))
+                )
+                continue
+            filename = part.get_filename()
+            if not filename:
+                continue
+            content = part.get_payload(decode=True)
+            attachments[part_id] = Attachment(
+                filename=decode_mime_header(filename),
+                content_type=part.get_content_type(),
+                content=content if isinstance(content, bytes) else b'',
+            )
+        return attachments
+
+    @property
+    def attachments(self) -> List[Attachment]:
+        """The attachment payloads of the message, in MIME-tree order."""
+        return list(self.attachments_by_part_id.values())
+
+    def to_details(self) -> Dict[str, Any]:
+        """
+        Returns the email detail dictionary used by GmailService.
+
+        Returns:
+            A dictionary with the id, date, body, subject, sender and to of the email
+        """
+        return {
+            'id': self.id,
+            'date': self.date,
+            'body': self.body,
+            'subject': self.subject,
+            'sender': self.sender,
+            'to': self.to,
+        }
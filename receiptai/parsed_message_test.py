@@ -0,0 +1,73 @@
+import os
+import unittest
+
+from html_text import html_to_text
+from parsed_message import ParsedMessage
+
+EMAILS_DIR = os.path.join(os.path.dirname(__file__), 'evals', 'emails')
+
+
+def load_email(name: str) -> ParsedMessage:
+    with open(os.path.join(EMAILS_DIR, name), 'rb') as f:
+        return ParsedMessage(name, f.read())
+
+
+class TestParsedMessage(unittest.TestCase):
+    def test_headers(self):
+        message = load_email('2.eml')
+        self.assertEqual(message.subject, 'Your receipt from Stable #2099-8486')
+        self.assertIsNotNone(message.date)
+        self.assertNotEqual(message.sender, 'Unknown Sender')
+
+    def test_attachments_in_mime_order(self):
+        message = load_email('2.eml')
+        self.assertEqual(
+            [attachment.filename for attachment in message.attachments],
+            ['Invoice-D856F13D-0016.pdf', 'Receipt-2099-8486.pdf'],
+        )
+        for attachment in message.attachments:
+            self.assertEqual(attachment.content_type, 'application/pdf')
+            self.assertTrue(attachment.content.startswith(b'%PDF-'))
+
+    def test_attachments_by_gmail_part_id(self):
+        message = load_email('2.eml')
+        # multipart/mixed holds multipart/alternative (0) and then the two PDFs
+        self.assertEqual(list(message.attachments_by_part_id), ['1', '2'])
+        self.assertEqual(message.attachments_by_part_id['2'].filename, 'Receipt-2099-8486.pdf')
+
+    def test_attachment_filenames(self):
+        message = load_email('2.eml')
+        self.assertEqual(
+            message.attachment_filenames, ['Invoice-D856F13D-0016.pdf', 'Receipt-2099-8486.pdf']
+        )
+
+    def test_headers_do_not_parse_body(self):
+        message = load_email('1.eml')
+        self.assertTrue(message.subject)
+        self.assertNotIn('mime_message', message.__dict__)
+
+    def test_details(self):
+        details = load_email('1.eml').to_details()
+        self.assertEqual(details['id'], '1.eml')
+        self.assertTrue(details['body'])
+        self.assertEqual(set(details), {'id', 'date', 'body', 'subject', 'sender', 'to'})
+
+    def test_html_only_body(self):
+        raw = (
+            b'Subject: Receipt\r\n'
+            b'Content-Type: text/html; charset=utf-8\r\n\r\n'
+            b'<h2>Total</h2><p>Paid <a href="https://example.com/r">receipt</a></p>'
+        )
+        message = ParsedMessage('html', raw)
+        self.assertIsNone(message.text_body)
+        self.assertEqual(message.body, html_to_text(message.html_body or ''))
+        self.assertIn('receipt https://example.com/r', message.body)
+
+    def test_missing_date(self):
+        message = ParsedMessage('nodate', b'Subject: Hi\r\n\r\nhello')
+        self.assertIsNone(message.date)
+        self.assertEqual(message.body, 'hello')
+
+
+if __name__ == '__main__':
+    unittest.main()
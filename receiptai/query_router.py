@@ -0,0 +1,318 @@
+import asyncio
+import json
+import logging
+import re
+from datetime import date, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypedDict
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Words that make a query about one transaction's receipt
+RECEIPT_KEYWORDS = {
+    'receipt',
+    'receipts',
+    'invoice',
+    'invoices',
+    'transaction',
+    'transactions',
+    'order',
+    'orders',
+    'payment',
+    'purchase',
+    'charge',
+}
+
+# Words a structured query may contain besides its keywords and fields; any other word
+# makes the query free-form, and it is left to the agent
+FILLER_WORDS = {
+    'a',
+    'amount',
+    'an',
+    'at',
+    'by',
+    'date',
+    'dated',
+    'email',
+    'emails',
+    'fetch',
+    'find',
+    'for',
+    'from',
+    'get',
+    'give',
+    'id',
+    'look',
+    'mail',
+    'me',
+    'my',
+    'no',
+    'number',
+    'of',
+    'on',
+    'paid',
+    'please',
+    'ref',
+    'reference',
+    'search',
+    'show',
+    'the',
+    'to',
+    'total',
+    'up',
+    'with',
+}
+
+CURRENCY_SYMBOLS = {'$': 'USD', '€': 'EUR', '£': 'GBP'}
+CURRENCY_CODES = {'USD', 'EUR', 'GBP', 'CAD', 'AUD', 'CHF', 'JPY', 'SEK', 'NOK', 'DKK'}
+
+# Candidate emails fetched for the matcher, and matching emails returned
+MAX_CANDIDATE_EMAILS = 20
+DEFAULT_MAX_RESULTS = 5
+
+# Days either side of a given date that a receipt may have been sent
+DATE_WINDOW_DAYS = 3
+
+_DATE = re.compile(r'\b(\d{4})-(\d{2})-(\d{2})\b')
+_TRANSACTION_ID = re.compile(
+    r'#[A-Za-z0-9][\w-]*'
+    r'|\b(?=[\w-]*\d)(?=[\w-]*[A-Za-z])[A-Za-z0-9]+(?:-[A-Za-z0-9]+)+\b'
+    r'|\b(?=\w*\d)(?=\w*[A-Za-z])[A-Za-z0-9]{5,}\b'
+    r'|\b\d{6,}\b'
+)
+_CURRENCY_CODE = '|'.join(sorted(CURRENCY_CODES))
+_AMOUNT = re.compile(
+    rf'(?:(?P<symbol>[$€£])\s?|\b(?P<code_before>{_CURRENCY_CODE})\s?)?'
+    r'(?P<value>\d+(?:[.,]\d{1,2})?)'
+    rf'(?:\s?(?P<code_after>{_CURRENCY_CODE})\b)?'
+)
+# A merchant is capitalised words; a year or a number is never taken as one
+_MERCHANT_WORD = r"(?![\d.,]+(?![\w&'.-]))[A-Z0-9&][\w&'.-]*"
+_MERCHANT = re.compile(rf'\b(?:from|at)\s+(?P<merchant>{_MERCHANT_WORD}(?:\s+{_MERCHANT_WORD})*)')
+_WORD = re.compile(r"[\w'&.-]+")
+
+
+class ReceiptQuery(TypedDict):
+    transaction_id: Optional[str]
+    amount: Optional[str]
+    currency: Optional[str]
+    merchant: Optional[str]
+    date: Optional[date]
+
+
+def _take(pattern: re.Pattern, text: str) -> Tuple[Optional[re.Match], str]:
+    """Finds the first match of pattern and blanks it out of the text."""
+    match = pattern.search(text)
+    if match is None:
+        return None, text
+    return match, text[: match.start()] + ' ' + text[match.end() :]
+
+
+def _take_amount(text: str) -> Tuple[Optional[re.Match], str]:
+    """Finds the first amount, which needs a currency or decimals to tell it from a count."""
+    for match in _AMOUNT.finditer(text):
+        has_currency = match['symbol'] or match['code_before'] or match['code_after']
+        if has_currency or re.search(r'[.,]\d{2}$', match['value']):
+            return match, text[: match.start()] + ' ' + text[match.end() :]
+    return None, text
+
+
+def parse_receipt_query(text: str) -> Optional[ReceiptQuery]:
+    """
+    Recognises a request for the receipt of one transaction.
+
+    The query must name a receipt, invoice, transaction or order, give a transaction ID
+    or an amount, and contain nothing else besides a merchant, a date and filler words.
+    Anything more is treated as free-form.
+
+    Args:
+        text: The user's query.
+
+    Returns:
+        The fields of the transaction, or None if the query is not such a request.
+    """
+    rest = text.strip().rstrip('?.!')
+
+    date_match, rest = _take(_DATE, rest)
+    receipt_date = None
+    if date_match is not None:
+        try:
+            receipt_date = date(*(int(part) for part in date_match.groups()))
+        except ValueError:
+            return None
+
+    id_match, rest = _take(_TRANSACTION_ID, rest)
+    amount_match, rest = _take_amount(rest)
+    merchant_match, rest = _take(_MERCHANT, rest)
+
+    if id_match is None and amount_match is None:
+        return None
+    words = {word.lower().strip('.') for word in _WORD.findall(rest)} - {''}
+    if not words & RECEIPT_KEYWORDS or words - RECEIPT_KEYWORDS - FILLER_WORDS:
+        return None
+
+    amount = currency = None
+    if amount_match is not None:
+        amount = f'{float(amount_match["value"].replace(",", ".")):.2f}'
+        currency = (
+            CURRENCY_SYMBOLS.get(amount_match['symbol'] or '')
+            or amount_match['code_before']
+            or amount_match['code_after']
+        )
+    return ReceiptQuery(
+        transaction_id=id_match.group().lstrip('#') if id_match else None,
+        amount=amount,
+        currency=currency,
+        merchant=merchant_match['merchant'] if merchant_match else None,
+        date=receipt_date,
+    )
+
+
+def _amount_pattern(amount: str) -> re.Pattern:
+    """Matches an amount written with a point or a comma, e.g. 66.00 or 66,00."""
+    whole, cents = amount.split('.')
+    return re.compile(rf'(?<![\d.,]){whole}[.,]{cents}(?!\d)')
+
+
+def build_gmail_query(query: ReceiptQuery) -> str:
+    """
+    Builds the Gmail search for the candidate emails of a receipt query.
+
+    A transaction ID is specific enough on its own; otherwise the amount, merchant and
+    a window around the date narrow the search.
+
+    Args:
+        query: The parsed receipt query.
+
+    Returns:
+        The Gmail search query.
+    """
+    if query['transaction_id']:
+        return f'"{query["transaction_id"]}"'
+
+    terms = []
+    if query['amount']:
+        terms.append(f'("{query["amount"]}" OR "{query["amount"].replace(".", ",")}")')
+    if query['merchant']:
+        terms.append(f'"{query["merchant"]}"')
+    if query['date']:
+        after = query['date'] - timedelta(days=DATE_WINDOW_DAYS)
+        before = query['date'] + timedelta(days=DATE_WINDOW_DAYS + 1)
+        terms.append(f'after:{after:%Y/%m/%d} before:{before:%Y/%m/%d}')
+    return ' '.join(terms)
+
+
+def matches_receipt(query: ReceiptQuery, email: Dict[str, Any]) -> bool:
+    """
+    Checks that an email mentions every field the query gave.
+
+    Gmail's search is fuzzy about punctuation and word forms, so each candidate is
+    checked again, exactly, against its subject, sender and body.
+
+    Args:
+        query: The parsed receipt query.
+        email: The email, with subject, sender and body keys.
+
+    Returns:
+        Whether the email is a receipt for the transaction.
+    """
+    text = ' '.join(str(email.get(key) or '') for key in ('subject', 'sender', 'body'))
+    if query['transaction_id'] and not re.search(
+        rf'(?<![\w-]){re.escape(query["transaction_id"])}(?![\w-])', text, re.IGNORECASE
+    ):
+        return False
+    if query['amount'] and not _amount_pattern(query['amount']).search(text):
+        return False
+    if query['merchant'] and query['merchant'].lower() not in text.lower():
+        return False
+    return True
+
+
+async def answer_receipt_query(
+    query: ReceiptQuery,
+    call_tool: Callable[[str, Dict[str, Any]], Awaitable[str]],
+    max_results: int = DEFAULT_MAX_RESULTS,
+) -> Optional[Dict[str, Any]]:
+    """
+    Answers a receipt query with the Gmail MCP tools, without a language model.
+
+    Only a confident answer is given: when no email matches, a candidate's body was cut
+    short, or there are more than MAX_CANDIDATE_EMAILS candidates, so a match may have
+    been missed, the query is left to the agent, which can search more broadly.
+
+    Args:
+        query: The parsed receipt query.
+        call_tool: Coroutine function that calls a Gmail MCP tool by name with its
+            arguments and returns its text result.
+        max_results: The maximum number of matching emails returned.
+
+    Returns:
+        The response in the format of EMAIL_SEARCH_TEMPLATE, or None if the query is
+        better left to the agent.
+
+    Raises:
+        ValueError: If a tool returned an error instead of its result.
+    """
+    gmail_query = build_gmail_query(query)
+    # The response budget may cut a page short, so the candidates are paged through
+    candidates: List[Dict[str, Any]] = []
+    cursor = None
+    while True:
+        arguments: Dict[str, Any] = {
+            'query': gmail_query,
+            'body': 'full',
+            'page_size': MAX_CANDIDATE_EMAILS - len(candidates),
+        }
+        if cursor:
+            arguments['cursor'] = cursor
+        page = _load_tool_json(await call_tool('search-emails', arguments))
+        candidates.extend(page['emails'])
+        cursor = page.get('next_cursor')
+        if not cursor:
+            break
+        if len(candidates) >= MAX_CANDIDATE_EMAILS or not page['emails']:
+            logger.info(f'Too many candidates, leaving the query to the agent: {gmail_query}')
+            return None
+
+    if any(email.get('body_truncated') or 'body' not in email for email in candidates):
+        logger.info(
+            f'Candidate bodies were cut short, leaving the query to the agent: {gmail_query}'
+        )
+        return None
+
+    matched = [email for email in candidates if matches_receipt(query, email)]
+    logger.info(f'Matched {len(matched)} of {len(candidates)} emails for query: {gmail_query}')
+    if not matched:
+        return None
+
+    # Only the matches are fetched in full, for their recipients and untruncated bodies
+    details: List[Dict[str, Any]] = [
+        _load_tool_json(result)
+        for result in await asyncio.gather(
+            *(call_tool('get-email', {'email_id': email['id']}) for email in matched[:max_results])
+        )
+    ]
+    return {
+        'count': str(len(details)),
+        'results': [
+            {
+                'sender': email.get('sender', ''),
+                'recipient': email.get('to', ''),
+                'subject': email.get('subject', ''),
+                'date': str(email.get('date') or ''),
+                'body': email.get('body', ''),
+            }
+            for email in details
+        ],
+    }
+
+
+def _load_tool_json(result: str) -> Dict[str, Any]:
+    """Parses a tool's JSON result; the tools return errors as plain text."""
+    try:
+        loaded = json.loads(result)
+    except (TypeError, json.JSONDecodeError):
+        raise ValueError(f'Tool returned an error: {result}')
+    if not isinstance(loaded, dict):
+        raise ValueError(f'Tool returned an error: {result}')
+    return loaded
@@ -0,0 +1,213 @@
+import asyncio
+import json
+import unittest
+from datetime import date
+
+from query_router import (
+    MAX_CANDIDATE_EMAILS,
+    ReceiptQuery,
+    answer_receipt_query,
+    build_gmail_query,
+    matches_receipt,
+    parse_receipt_query,
+)
+
+
+def receipt_query(**fields) -> ReceiptQuery:
+    query = ReceiptQuery(transaction_id=None, amount=None, currency=None, merchant=None, date=None)
+    query.update(fields)  # type: ignore[typeddict-item]
+    return query
+
+
+class TestParseReceiptQuery(unittest.TestCase):
+    def test_transaction_id(self):
+        query = parse_receipt_query('Find the receipt for transaction ORD-1745343236226')
+        self.assertEqual(query, receipt_query(transaction_id='ORD-1745343236226'))
+
+    def test_amount_merchant_and_date(self):
+        query = parse_receipt_query('receipt for 66.00 EUR from CASA on 2025-04-25')
+        self.assertEqual(
+            query,
+            receipt_query(amount='66.00', currency='EUR', merchant='CASA', date=date(2025, 4, 25)),
+        )
+
+    def test_currency_symbol(self):
+        query = parse_receipt_query('Find the invoice for €12,5 at Stable?')
+        assert query is not None
+        self.assertEqual((query['amount'], query['currency']), ('12.50', 'EUR'))
+        self.assertEqual(query['merchant'], 'Stable')
+
+    def test_hash_id(self):
+        query = parse_receipt_query('find invoice #2099-8486')
+        assert query is not None
+        self.assertEqual(query['transaction_id'], '2099-8486')
+
+    def test_numbers_are_not_merchants(self):
+        # The year is not a merchant, so it is an unknown word and the agent answers
+        self.assertIsNone(parse_receipt_query('receipts from 2023 for $50.00'))
+        query = parse_receipt_query('invoice for 12.00 EUR at Marks & Spencer')
+        assert query is not None
+        self.assertEqual(query['merchant'], 'Marks & Spencer')
+
+    def test_free_form_queries_go_to_the_agent(self):
+        for text in [
+            'Summarise my receipts from last month',
+            'find all emails from bob about the invoice',
+            'how much did I spend on the order ORD-12',
+            'invoice for 12 items',
+            'invoice 2025',
+            'ORD-1745343236226',
+            'receipt for 66.00 EUR on 2025-02-30',
+        ]:
+            with self.subTest(text=text):
+                self.assertIsNone(parse_receipt_query(text))
+
+
+class TestBuildGmailQuery(unittest.TestCase):
+    def test_id_alone(self):
+        query = receipt_query(transaction_id='ORD-1', amount='66.00', merchant='CASA')
+        self.assertEqual(build_gmail_query(query), '"ORD-1"')
+
+    def test_amount_merchant_and_date_window(self):
+        query = receipt_query(amount='66.00', merchant='CASA', date=date(2025, 4, 25))
+        self.assertEqual(
+            build_gmail_query(query),
+            '("66.00" OR "66,00") "CASA" after:2025/04/22 before:2025/04/29',
+        )
+
+
+class TestMatchesReceipt(unittest.TestCase):
+    def test_id_must_match_whole_token(self):
+        query = receipt_query(transaction_id='ORD-17')
+        self.assertTrue(matches_receipt(query, {'subject': 'Order ord-17 shipped'}))
+        self.assertFalse(matches_receipt(query, {'body': 'Order ORD-170'}))
+
+    def test_amount_with_either_separator(self):
+        query = receipt_query(amount='66.00')
+        self.assertTrue(matches_receipt(query, {'body': 'Total: 66,00 €'}))
+        self.assertFalse(matches_receipt(query, {'body': 'Total: 166.00'}))
+        self.assertFalse(matches_receipt(query, {'body': 'Total: 66.001'}))
+
+    def test_every_field_must_match(self):
+        query = receipt_query(amount='66.00', merchant='casa')
+        self.assertTrue(matches_receipt(query, {'sender': 'CASA <r@casa.com>', 'body': '66.00'}))
+        self.assertFalse(matches_receipt(query, {'sender': 'Other', 'body': '66.00'}))
+
+
+class TestAnswerReceiptQuery(unittest.TestCase):
+    def setUp(self):
+        self.emails = {
+            'm1': {
+                'id': 'm1',
+                'subject': 'Receipt ORD-1',
+                'sender': 'shop@example.com',
+                'to': 'me@example.com',
+                'date': '2025-04-25 10:00:00+00:00',
+                'body': 'Total 66.00 EUR',
+            },
+            'm2': {
+                'id': 'm2',
+                'subject': 'Newsletter',
+                'sender': 'news@example.com',
+                'to': 'me@example.com',
+                'date': '2025-04-24 10:00:00+00:00',
+                'body': 'No orders here',
+            },
+        }
+        self.calls = []
+
+    async def call_tool(self, name, arguments):
+        self.calls.append((name, arguments))
+        if name == 'search-emails':
+            emails = [
+                {key: email[key] for key in ('id', 'subject', 'sender', 'date', 'body')}
+                for email in self.emails.values()
+            ]
+            return json.dumps({'emails': emails, 'next_cursor': None})
+        return json.dumps(self.emails[arguments['email_id']])
+
+    def test_returns_only_matches_in_template_format(self):
+        response = asyncio.run(
+            answer_receipt_query(receipt_query(transaction_id='ORD-1'), self.call_tool)
+        )
+        self.assertEqual(response['count'], '1')
+        self.assertEqual(
+            response['results'][0],
+            {
+                'sender': 'shop@example.com',
+                'recipient': 'me@example.com',
+                'subject': 'Receipt ORD-1',
+                'date': '2025-04-25 10:00:00+00:00',
+                'body': 'Total 66.00 EUR',
+            },
+        )
+        self.assertEqual([name for name, _ in self.calls], ['search-emails', 'get-email'])
+
+    def test_no_match_is_left_to_the_agent(self):
+        response = asyncio.run(
+            answer_receipt_query(receipt_query(transaction_id='ORD-2'), self.call_tool)
+        )
+        self.assertIsNone(response)
+        self.assertEqual([name for name, _ in self.calls], ['search-emails'])
+
+    def test_truncated_bodies_are_left_to_the_agent(self):
+        async def truncating_tool(name, arguments):
+            page = json.loads(await self.call_tool(name, arguments))
+            page['emails'][1]['body_truncated'] = True
+            return json.dumps(page)
+
+        response = asyncio.run(
+            answer_receipt_query(receipt_query(transaction_id='ORD-1'), truncating_tool)
+        )
+        self.assertIsNone(response)
+
+    def test_pages_through_candidates(self):
+        async def paging_tool(name, arguments):
+            if name != 'search-emails':
+                return await self.call_tool(name, arguments)
+            page = json.loads(await self.call_tool(name, arguments))
+            # The response budget cuts each page to one email
+            offset = int(arguments.get('cursor') or 0)
+            emails = page['emails'][offset : offset + 1]
+            next_cursor = str(offset + 1) if offset + 1 < len(page['emails']) else None
+            return json.dumps({'emails': emails, 'next_cursor': next_cursor})
+
+        # The match is on the second page
+        self.emails = {'m2': self.emails['m2'], 'm1': self.emails['m1']}
+        response = asyncio.run(
+            answer_receipt_query(receipt_query(transaction_id='ORD-1'), paging_tool)
+        )
+        self.assertEqual(response['count'], '1')
+        self.assertEqual(response['results'][0]['subject'], 'Receipt ORD-1')
+        searches = [arguments for name, arguments in self.calls if name == 'search-emails']
+        self.assertEqual([search.get('cursor') for search in searches], [None, '1'])
+        self.assertEqual(
+            [search['page_size'] for search in searches],
+            [MAX_CANDIDATE_EMAILS, MAX_CANDIDATE_EMAILS - 1],
+        )
+
+    def test_too_many_candidates_are_left_to_the_agent(self):
+        async def endless_tool(name, arguments):
+            self.calls.append((name, arguments))
+            emails = [
+                {'id': f'n{index}', 'subject': 'Newsletter', 'sender': '', 'date': '', 'body': ''}
+                for index in range(arguments['page_size'])
+            ]
+            return json.dumps({'emails': emails, 'next_cursor': 'more'})
+
+        response = asyncio.run(
+            answer_receipt_query(receipt_query(transaction_id='ORD-1'), endless_tool)
+        )
+        self.assertIsNone(response)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_tool_error_raises(self):
+        async def failing_tool(name, arguments):
+            return 'Error searching emails: quota exceeded'
+
+        with self.assertRaises(ValueError):
+            asyncio.run(answer_receipt_query(receipt_query(amount='1.00'), failing_tool))
+
+
+if __name__ == '__main__':
+    unittest.main()
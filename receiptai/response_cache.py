@@ -0,0 +1,215 @@
+import json
+import logging
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypedDict
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL_SECONDS = 600.0
+
+# Relative periods the time MCP's get_date tool resolves, by the phrase naming them
+RELATIVE_PERIODS: Dict[str, str] = {
+    'today': 'today',
+    'tomorrow': 'tomorrow',
+    'next week': 'next_week',
+    'last week': 'last_week',
+    'next month': 'next_month',
+    'last month': 'last_month',
+    'next year': 'next_year',
+    'last year': 'last_year',
+}
+
+# Words that make a query depend on the current date, even when no period above names
+# the window; such queries are keyed on today's date
+RELATIVE_TIME_WORDS = {
+    'yesterday',
+    'recent',
+    'recently',
+    'latest',
+    'ago',
+    'past',
+    'current',
+    'newest',
+}
+
+_PERIOD = re.compile(r'\b(' + '|'.join(RELATIVE_PERIODS) + r')\b')
+_RELATIVE_DURATION = re.compile(r'\b(last|past|in|next) (\d+) (day|week|month)s?\b')
+_CURRENT_PERIOD = re.compile(r'\bthis (week|month|year)\b')
+
+
+class CacheMetrics(TypedDict):
+    entries: int
+    hits: int
+    misses: int
+    expired: int
+    invalidations: int
+
+
+def normalize_query(text: str) -> str:
+    """
+    Normalizes a query so that near-identical texts share a cache entry.
+
+    Case, runs of whitespace, Unicode compatibility forms and surrounding punctuation
+    are ignored.
+
+    Args:
+        text: The query text.
+
+    Returns:
+        The normalized text.
+    """
+    text = unicodedata.normalize('NFKC', text).lower()
+    return ' '.join(text.split()).strip(' ?.!,;:')
+
+
+def date_requests(normalized_query: str) -> List[Dict[str, Any]]:
+    """
+    Lists the get_date calls that resolve the time windows a query refers to.
+
+    Args:
+        normalized_query: The query, as returned by normalize_query.
+
+    Returns:
+        The arguments of each get_date call, in a stable order; empty if the query does
+        not depend on the current date.
+    """
+    requests: List[Dict[str, Any]] = []
+    for phrase in _PERIOD.findall(normalized_query):
+        requests.append({'date_type': RELATIVE_PERIODS[phrase]})
+    for direction, duration, unit in _RELATIVE_DURATION.findall(normalized_query):
+        prefix = 'in' if direction in ('in', 'next') else 'last'
+        requests.append({'date_type': f'{prefix}_{unit}s', 'duration': int(duration)})
+
+    if not requests and (
+        set(normalized_query.split()) & RELATIVE_TIME_WORDS
+        or _CURRENT_PERIOD.search(normalized_query)
+    ):
+        requests.append({'date_type': 'today'})
+
+    unique = {json.dumps(request, sort_keys=True): request for request in requests}
+    return [unique[key] for key in sorted(unique)]
+
+
+def cache_key(normalized_query: str, time_windows: List[str]) -> str:
+    """
+    Builds the cache key of a query.
+
+    Args:
+        normalized_query: The query, as returned by normalize_query.
+        time_windows: The resolved results of the query's date_requests, in order.
+
+    Returns:
+        The cache key.
+    """
+    return json.dumps([normalized_query, time_windows])
+
+
+class ResponseCache:
+    """
+    An in-memory LRU cache of query responses, with a TTL.
+
+    Each response depends on the messages in the mailbox when it was computed, so the
+    cache drops every entry once a mailbox sync reports messages added or removed.
+    Reads and label changes also move the mailbox historyId but leave the messages
+    alone, so they keep the cache; the TTL bounds how stale such details may get.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Initialize an empty cache.
+
+        Args:
+            max_entries: Maximum number of responses kept; 0 disables the cache.
+            ttl_seconds: Seconds a response is served for after it was computed.
+            clock: Monotonic clock, in seconds.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.history_id: Optional[str] = None
+        self._entries: 'OrderedDict[str, Tuple[float, str]]' = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._expired = 0
+        self._invalidations = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the cached response for a key, if there is a fresh one.
+
+        Args:
+            key: The cache key, from cache_key.
+
+        Returns:
+            The response, or None on a miss.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self._misses += 1
+            return None
+        stored_at, response = entry
+        if self.clock() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            self._expired += 1
+            self._misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return response
+
+    def put(self, key: str, response: str):
+        """
+        Caches a response, evicting the least recently used ones over max_entries.
+
+        Args:
+            key: The cache key, from cache_key.
+            response: The response text.
+        """
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (self.clock(), response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def observe_sync(self, history_id: str, messages_changed: bool):
+        """
+        Records a mailbox sync, dropping every entry if it added or removed messages.
+
+        Args:
+            history_id: The historyId the mailbox is synced up to.
+            messages_changed: Whether the sync added or removed messages, or had to
+                sync in full and so cannot tell.
+        """
+        if messages_changed:
+            if self._entries:
+                logger.info(
+                    f'Mailbox messages changed up to history {history_id}, '
+                    f'dropping {len(self._entries)} cached responses'
+                )
+            self.invalidate()
+        self.history_id = history_id
+
+    def invalidate(self):
+        """Drops every entry."""
+        self._entries.clear()
+        self._invalidations += 1
+
+    def metrics(self) -> CacheMetrics:
+        return CacheMetrics(
+            entries=len(self._entries),
+            hits=self._hits,
+            misses=self._misses,
+            expired=self._expired,
+            invalidations=self._invalidations,
+        )
@@ -0,0 +1,83 @@
+import unittest
+
+from response_cache import ResponseCache, cache_key, date_requests, normalize_query
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestQueryKeys(unittest.TestCase):
+    def test_near_identical_queries_normalize_alike(self):
+        self.assertEqual(
+            normalize_query('  Find my  Uber receipts? '), normalize_query('find my uber receipts')
+        )
+        self.assertNotEqual(normalize_query('uber receipts'), normalize_query('lyft receipts'))
+
+    def test_date_requests(self):
+        self.assertEqual(date_requests('receipts from last month'), [{'date_type': 'last_month'}])
+        self.assertEqual(
+            date_requests('invoices from the last 3 days'),
+            [{'date_type': 'last_days', 'duration': 3}],
+        )
+        self.assertEqual(date_requests('my latest invoice'), [{'date_type': 'today'}])
+        self.assertEqual(date_requests('invoices this month'), [{'date_type': 'today'}])
+        self.assertEqual(date_requests('the invoice for order ord-1'), [])
+
+    def test_key_includes_time_windows(self):
+        query = normalize_query('receipts from last month')
+        self.assertNotEqual(
+            cache_key(query, ['{"last_month": "2025-03"}']),
+            cache_key(query, ['{"last_month": "2025-04"}']),
+        )
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = ResponseCache(max_entries=2, ttl_seconds=60, clock=self.clock)
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.put('a', '{}')
+        self.assertEqual(self.cache.get('a'), '{}')
+        self.assertEqual(self.cache.metrics()['hits'], 1)
+        self.assertEqual(self.cache.metrics()['misses'], 1)
+
+    def test_ttl(self):
+        self.cache.put('a', '{}')
+        self.clock.now = 61
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.metrics()['expired'], 1)
+
+    def test_lru_eviction(self):
+        self.cache.put('a', '1')
+        self.cache.put('b', '2')
+        self.cache.get('a')
+        self.cache.put('c', '3')
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), '1')
+        self.assertEqual(self.cache.get('c'), '3')
+
+    def test_only_message_changes_invalidate(self):
+        self.cache.put('a', '{}')
+        # A read or label change moves the historyId without changing the messages
+        self.cache.observe_sync('101', messages_changed=False)
+        self.assertEqual(self.cache.get('a'), '{}')
+        self.cache.observe_sync('102', messages_changed=True)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.metrics()['invalidations'], 1)
+        self.assertEqual(self.cache.history_id, '102')
+
+    def test_disabled(self):
+        cache = ResponseCache(max_entries=0)
+        cache.put('a', '{}')
+        self.assertIsNone(cache.get('a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
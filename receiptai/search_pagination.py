@@ -0,0 +1,152 @@
+import base64
+import hashlib
+import json
+from typing import Any, Dict, List, Literal, Tuple
+
+from email_types import Email
+
+BodyPolicy = Literal['full', 'truncate', 'snippet']
+BODY_POLICIES: Tuple[BodyPolicy, ...] = ('full', 'truncate', 'snippet')
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Characters of each body kept by the truncate policy
+DEFAULT_MAX_BODY_CHARS = 2000
+
+# Serialized size of the emails in one tool response, so a page never floods the context
+DEFAULT_MAX_RESPONSE_BYTES = 48 * 1024
+
+TRUNCATION_MARKER = '… [truncated, use get-email for the full body]'
+
+
+def _query_key(query: str) -> str:
+    return hashlib.sha256(query.strip().encode('utf-8')).hexdigest()[:16]
+
+
+def encode_cursor(query: str, offset: int) -> str:
+    """
+    Encodes the position of the next page of a search as an opaque cursor.
+
+    Args:
+        query: The search query the cursor belongs to.
+        offset: The index of the first email of the next page.
+
+    Returns:
+        The cursor string.
+    """
+    payload = json.dumps({'q': _query_key(query), 'o': offset}).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, query: str) -> int:
+    """
+    Decodes a cursor returned by a previous page of the same search.
+
+    Args:
+        cursor: The cursor string.
+        query: The search query of the current call.
+
+    Returns:
+        The index of the first email of the page.
+
+    Raises:
+        ValueError: If the cursor is malformed or belongs to a different query.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        query_key, offset = payload['q'], int(payload['o'])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f'Invalid cursor: {cursor}') from e
+    if query_key != _query_key(query):
+        raise ValueError('Cursor belongs to a different query')
+    if offset < 0:
+        raise ValueError(f'Invalid cursor: {cursor}')
+    return offset
+
+
+def truncate_text(text: str, max_chars: int) -> Tuple[str, bool]:
+    """
+    Shortens text to at most max_chars characters plus a truncation marker.
+
+    Args:
+        text: The text to shorten.
+        max_chars: The number of characters to keep.
+
+    Returns:
+        The possibly shortened text and whether it was shortened.
+    """
+    if len(text) <= max_chars:
+        return text, False
+    return text[:max_chars].rstrip() + TRUNCATION_MARKER, True
+
+
+def format_email(
+    email: Email, body_policy: BodyPolicy, max_body_chars: int = DEFAULT_MAX_BODY_CHARS
+) -> Dict[str, Any]:
+    """
+    Formats an email for a search-emails tool response.
+
+    Args:
+        email: The email; its body is only read if the policy includes it.
+        body_policy: 'full' for the whole body, 'truncate' for at most max_body_chars
+            of it, or 'snippet' for Gmail's short snippet instead of the body.
+        max_body_chars: The number of body characters kept by the truncate policy.
+
+    Returns:
+        The JSON-serializable email dictionary.
+    """
+    formatted: Dict[str, Any] = {
+        'id': email.id,
+        'subject': email.subject,
+        'sender': email.from_email,
+        'date': email.date.isoformat(),
+    }
+    if body_policy == 'snippet':
+        formatted['snippet'] = email.snippet
+    elif body_policy == 'truncate':
+        formatted['body'], truncated = truncate_text(email.body, max_body_chars)
+        if truncated:
+            formatted['body_truncated'] = True
+    else:
+        formatted['body'] = email.body
+    return formatted
+
+
+def _serialized_size(item: Dict[str, Any]) -> int:
+    return len(json.dumps(item, indent=2).encode('utf-8'))
+
+
+def fit_to_budget(
+    formatted_emails: List[Dict[str, Any]], max_bytes: int = DEFAULT_MAX_RESPONSE_BYTES
+) -> List[Dict[str, Any]]:
+    """
+    Takes emails, in order, until their serialized size would exceed the byte budget.
+
+    The first email is always returned, so paging always makes progress; if it is over
+    the budget on its own, its body is truncated to fit.
+
+    Args:
+        formatted_emails: The emails of the page, as returned by format_email.
+        max_bytes: The byte budget of the response.
+
+    Returns:
+        The leading emails that fit in the budget.
+    """
+    fitted: List[Dict[str, Any]] = []
+    used = 0
+    for formatted in formatted_emails:
+        size = _serialized_size(formatted)
+        if fitted and used + size > max_bytes:
+            break
+        if not fitted and size > max_bytes and formatted.get('body'):
+            formatted = dict(formatted)
+            overflow = size - max_bytes + len(TRUNCATION_MARKER)
+            body = formatted['body']
+            formatted['body'], _ = truncate_text(body, max(0, len(body) - overflow))
+            formatted['body_truncated'] = True
+            size = _serialized_size(formatted)
+        fitted.append(formatted)
+        used += size
+    return fitted
@@ -0,0 +1,92 @@
+import json
+import unittest
+from datetime import datetime, timezone
+
+from email_types import Email
+from search_pagination import (
+    TRUNCATION_MARKER,
+    decode_cursor,
+    encode_cursor,
+    fit_to_budget,
+    format_email,
+    truncate_text,
+)
+
+
+def make_email(index: int, body: str = 'body') -> Email:
+    return Email(
+        id=f'id{index}',
+        subject=f'Receipt {index}',
+        body=body,
+        from_email='billing@example.com',
+        to_email='me@example.com',
+        date=datetime(2025, 4, 14, tzinfo=timezone.utc),
+        snippet=f'snippet {index}',
+    )
+
+
+class TestCursor(unittest.TestCase):
+    def test_round_trip(self):
+        cursor = encode_cursor('from:stripe', 40)
+        self.assertEqual(decode_cursor(cursor, 'from:stripe'), 40)
+
+    def test_rejects_other_query(self):
+        cursor = encode_cursor('from:stripe', 40)
+        with self.assertRaises(ValueError):
+            decode_cursor(cursor, 'from:brex')
+
+    def test_rejects_malformed(self):
+        for cursor in ('not a cursor', 'e30', encode_cursor('q', 1)[:-2]):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor, 'q')
+
+
+class TestFormatEmail(unittest.TestCase):
+    def test_snippet_policy_omits_body(self):
+        formatted = format_email(make_email(1), 'snippet')
+        self.assertEqual(formatted['snippet'], 'snippet 1')
+        self.assertNotIn('body', formatted)
+
+    def test_truncate_policy(self):
+        formatted = format_email(make_email(1, 'x' * 50), 'truncate', max_body_chars=10)
+        self.assertEqual(formatted['body'], 'x' * 10 + TRUNCATION_MARKER)
+        self.assertTrue(formatted['body_truncated'])
+
+        formatted = format_email(make_email(1, 'short'), 'truncate', max_body_chars=10)
+        self.assertEqual(formatted['body'], 'short')
+        self.assertNotIn('body_truncated', formatted)
+
+    def test_full_policy(self):
+        formatted = format_email(make_email(1, 'x' * 5000), 'full')
+        self.assertEqual(formatted['body'], 'x' * 5000)
+
+    def test_truncate_text(self):
+        self.assertEqual(truncate_text('abc', 3), ('abc', False))
+        self.assertEqual(truncate_text('abcd', 3), ('abc' + TRUNCATION_MARKER, True))
+
+
+class TestFitToBudget(unittest.TestCase):
+    def test_stops_at_budget(self):
+        emails = [format_email(make_email(i, 'x' * 400), 'full') for i in range(10)]
+        fitted = fit_to_budget(emails, max_bytes=2000)
+        self.assertGreater(len(fitted), 0)
+        self.assertLess(len(fitted), 10)
+        self.assertLessEqual(len(json.dumps(fitted, indent=2).encode()), 2000 + 100)
+        self.assertEqual(fitted, emails[: len(fitted)])
+
+    def test_everything_fits(self):
+        emails = [format_email(make_email(i), 'snippet') for i in range(3)]
+        self.assertEqual(fit_to_budget(emails, max_bytes=10_000), emails)
+
+    def test_first_email_is_truncated_to_fit(self):
+        emails = [format_email(make_email(i, 'é' * 5000), 'full') for i in range(2)]
+        fitted = fit_to_budget(emails, max_bytes=1000)
+        self.assertEqual(len(fitted), 1)
+        self.assertTrue(fitted[0]['body_truncated'])
+        self.assertLessEqual(len(json.dumps(fitted[0], indent=2).encode()), 1000)
+        # The input is left untouched
+        self.assertEqual(emails[0]['body'], 'é' * 5000)
+
+
+if __name__ == '__main__':
+    unittest.main()
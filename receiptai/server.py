@@ -1,12 +1,16 @@
 import json
 import logging
 import os
-from contextlib import asynccontextmanager
+from contextlib import aclosing, asynccontextmanager
+from typing import Optional
 
 import uvicorn
+from agent_pool import PoolRejectedError
 from client import LangGraphClient, Query, QueryResponse, get_langchain_client
 from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from pydantic import ValidationError
+from sse_starlette.sse import EventSourceResponse
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -45,10 +49,14 @@ app = FastAPI(title='LangGraph MCP Client API', lifespan=lifespan)
 
 @app.post('/query', response_model=QueryResponse)
 async def handle_query(
-    query: Query, langgraph_client: LangGraphClient = Depends(get_langchain_client)
+    query: Query,
+    langgraph_client: LangGraphClient = Depends(get_langchain_client),
+    cache_control: Optional[str] = Header(None),
 ):
+    # Cache-Control: no-cache answers the query afresh, refreshing its cached response
+    use_cache = 'no-cache' not in (cache_control or '').lower()
     try:
-        response = await langgraph_client.process_query(query.text)
+        response = await langgraph_client.process_query(query.text, use_cache=use_cache)
         # Attempt to parse the response as JSON
         try:
             data = json.loads(response)
@@ -58,11 +66,68 @@ async def handle_query(
             raise HTTPException(
                 status_code=500, detail=f'Error decoding JSON: {str(e)}. Raw response: {response}'
             )
+    except PoolRejectedError as e:
+        logger.warning(f'Rejected query: {e}')
+        raise HTTPException(status_code=503, detail=str(e), headers={'Retry-After': '5'})
+    except TimeoutError:
+        raise HTTPException(
+            status_code=504,
+            detail=f'Query took longer than {langgraph_client.pool.timeout} seconds',
+        )
     except Exception as e:
         logger.error(f'General error processing query: {e}')
         raise HTTPException(status_code=500, detail=f'Error processing query: {str(e)}')
 
 
+@app.post('/query/stream')
+async def handle_query_stream(
+    query: Query,
+    langgraph_client: LangGraphClient = Depends(get_langchain_client),
+    cache_control: Optional[str] = Header(None),
+):
+    """Answer a query as server-sent events: route, step, tool_start, tool_end and token
+    events as the agent works, then a result event holding the QueryResponse.
+
+    Errors arrive as an error event with the status /query would have answered with.
+    Disconnecting cancels the query.
+    """
+    use_cache = 'no-cache' not in (cache_control or '').lower()
+
+    def error(status_code: int, detail: str) -> dict:
+        return {'event': 'error', 'data': json.dumps({'status': status_code, 'detail': detail})}
+
+    async def events():
+        try:
+            # Closing the stream as soon as the client goes away hands its agent back
+            async with aclosing(langgraph_client.stream_query(query.text, use_cache)) as stream:
+                async for event in stream:
+                    if event['event'] != 'result':
+                        yield {
+                            'event': event['event'],
+                            'data': json.dumps(event['data'], default=str),
+                        }
+                        continue
+                    try:
+                        response = QueryResponse.model_validate_json(event['data'])
+                    except ValidationError as e:
+                        logger.error(f'Invalid response: {e}, Response: {event["data"]}')
+                        yield error(
+                            500, f'Error decoding JSON: {str(e)}. Raw response: {event["data"]}'
+                        )
+                        return
+                    yield {'event': 'result', 'data': response.model_dump_json()}
+        except PoolRejectedError as e:
+            logger.warning(f'Rejected query: {e}')
+            yield error(503, str(e))
+        except TimeoutError:
+            yield error(504, f'Query took longer than {langgraph_client.pool.timeout} seconds')
+        except Exception as e:
+            logger.error(f'General error processing query: {e}')
+            yield error(500, f'Error processing query: {str(e)}')
+
+    return EventSourceResponse(events())
+
+
 @app.get('/status')
 async def get_status(request: Request):
     if not hasattr(request.app, 'langgraph_client') or request.app.langgraph_client is None:
@@ -83,6 +148,9 @@ async def get_status(request: Request):
         'status': 'ready',
         'initialised': True,
         'message': 'LangGraph Client is ready to process queries',
+        'pool': request.app.langgraph_client.pool.metrics(),
+        'response_cache': request.app.langgraph_client.response_cache.metrics(),
+        'gmail': await request.app.langgraph_client.gmail_metrics(),
     }
 
 
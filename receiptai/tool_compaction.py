@@ -0,0 +1,288 @@
+import json
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import BaseMessage, ToolMessage
+from langchain_core.tools import BaseTool, StructuredTool
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Rough size of a token in characters, which is close enough for budgeting English text
+CHARS_PER_TOKEN = 4
+
+# Tokens one tool message may take in the model's input, and all tool messages together;
+# the newest messages get their share first
+DEFAULT_TOOL_MESSAGE_TOKEN_BUDGET = 2000
+DEFAULT_TOOL_HISTORY_TOKEN_BUDGET = 8000
+
+# Tokens left to a tool message once the history budget is used up: enough for its ref
+MIN_TOOL_MESSAGE_TOKENS = 64
+
+DEFAULT_MAX_PAYLOADS = 256
+
+# Characters every field keeps before whole records are dropped instead; IDs are never
+# shortened, as the agent needs them to fetch the full email
+MIN_FIELD_CHARS = 80
+UNSHORTENED_FIELDS = {'id'}
+
+READ_TOOL_OUTPUT = 'read-tool-output'
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of tokens a text takes in the model's input."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class PayloadStore:
+    """
+    Keeps the full tool results that were compacted, by reference, so the agent can
+    still read any part of them.
+
+    Only the most recent max_payloads results are kept.
+    """
+
+    def __init__(self, max_payloads: int = DEFAULT_MAX_PAYLOADS):
+        self.max_payloads = max_payloads
+        self._payloads: 'OrderedDict[str, str]' = OrderedDict()
+
+    def put(self, ref: str, payload: str):
+        self._payloads[ref] = payload
+        self._payloads.move_to_end(ref)
+        while len(self._payloads) > self.max_payloads:
+            self._payloads.popitem(last=False)
+
+    def get(self, ref: str) -> Optional[str]:
+        return self._payloads.get(ref)
+
+
+def _email_records(data: Any) -> Optional[Tuple[List[Any], Any]]:
+    """
+    Finds the email records of a Gmail tool result.
+
+    Returns:
+        The records and the object holding them under 'emails', if there is one, or None
+        if the result holds no records
+    """
+    if isinstance(data, list) and all(isinstance(item, dict) for item in data):
+        return data, None
+    if isinstance(data, dict) and isinstance(data.get('emails'), list):
+        return data['emails'], data
+    if isinstance(data, dict):
+        return [data], None
+    return None
+
+
+def _shorten_records(records: List[Dict[str, Any]], max_field_chars: int) -> List[Dict[str, Any]]:
+    """Cuts every long string field of the records, bodies above all, to max_field_chars."""
+    shortened = []
+    for record in records:
+        record = dict(record)
+        for key, value in record.items():
+            if key in UNSHORTENED_FIELDS:
+                continue
+            if isinstance(value, str) and len(value) > max_field_chars:
+                record[key] = value[:max_field_chars].rstrip() + '…'
+        shortened.append(record)
+    return shortened
+
+
+def _compact_json(data: Any, max_chars: int, note: Dict[str, Any]) -> Optional[str]:
+    """
+    Fits a JSON tool result into max_chars by shortening the fields of its records,
+    evenly, down to MIN_FIELD_CHARS, and then dropping trailing records.
+
+    Returns:
+        The compacted JSON, or None if the result is not a list of records
+    """
+    found = _email_records(data)
+    if found is None:
+        return None
+    records, wrapper = found
+
+    def render(kept: List[Any], omitted: int) -> str:
+        compaction = dict(note, omitted_records=omitted) if omitted else note
+        if wrapper is None and isinstance(data, dict):
+            return json.dumps({**kept[0], '_compacted': compaction}, default=str)
+        container = dict(wrapper) if wrapper is not None else {}
+        container['emails'] = kept
+        container['_compacted'] = compaction
+        return json.dumps(container, default=str)
+
+    longest = max(
+        (len(value) for record in records for value in record.values() if isinstance(value, str)),
+        default=0,
+    )
+    # The longest field length that still fits, by binary search
+    low, high = min(MIN_FIELD_CHARS, longest), longest
+    while low < high:
+        middle = (low + high + 1) // 2
+        if len(render(_shorten_records(records, middle), 0)) <= max_chars:
+            low = middle
+        else:
+            high = middle - 1
+    kept = _shorten_records(records, low)
+    while len(kept) > 1 and len(render(kept, len(records) - len(kept))) > max_chars:
+        kept.pop()
+    rendered = render(kept, len(records) - len(kept))
+    return rendered if len(rendered) <= max_chars else None
+
+
+def compact_tool_output(content: str, max_tokens: int, ref: str, store: PayloadStore) -> str:
+    """
+    Shortens a tool result to a token budget, keeping the full result retrievable.
+
+    JSON lists of emails keep every email's ID, subject, sender and date where they can
+    and lose the end of their bodies first; other results are cut short. Either way the
+    result records the reference to read the rest with.
+
+    Args:
+        content: The tool result text.
+        max_tokens: The token budget of the result.
+        ref: The reference the full result is stored under.
+        store: The store of full results.
+
+    Returns:
+        The result, unchanged if it is within the budget.
+    """
+    if estimate_tokens(content) <= max_tokens:
+        return content
+
+    store.put(ref, content)
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    note = {
+        'ref': ref,
+        'full_chars': len(content),
+        'note': f'Compacted to fit the context. Call {READ_TOOL_OUTPUT} with this ref for '
+        'the full result, or get-email with an id for one full email.',
+    }
+
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        data = None
+    if data is not None:
+        compacted = _compact_json(data, max_chars, note)
+        if compacted is not None:
+            return compacted
+
+    suffix = f'\n[{json.dumps(note)}]'
+    return content[: max(0, max_chars - len(suffix))].rstrip() + suffix
+
+
+def _message_text(message: ToolMessage) -> Optional[str]:
+    """The text of a tool message, or None if it holds anything but text."""
+    if isinstance(message.content, str):
+        return message.content
+    if all(isinstance(block, str) for block in message.content):
+        return '\n'.join(message.content)  # type: ignore[arg-type]
+    return None
+
+
+def compact_messages(
+    messages: Sequence[BaseMessage],
+    store: PayloadStore,
+    message_budget: int = DEFAULT_TOOL_MESSAGE_TOKEN_BUDGET,
+    history_budget: int = DEFAULT_TOOL_HISTORY_TOKEN_BUDGET,
+) -> List[BaseMessage]:
+    """
+    Compacts the tool messages of an agent's history to the token budgets.
+
+    The newest tool messages are given up to message_budget tokens each until the
+    history_budget is spent; older ones keep MIN_TOOL_MESSAGE_TOKENS, enough to say
+    where their full result is. Reads of compacted results count like any other tool
+    message, so repeated reads cannot grow the context past the budget either. The
+    history itself is not changed.
+
+    Args:
+        messages: The agent's messages, oldest first.
+        store: The store the full results are kept in.
+        message_budget: Tokens one tool message may take.
+        history_budget: Tokens all tool messages together may take.
+
+    Returns:
+        The messages to send to the model.
+    """
+    compacted: List[BaseMessage] = list(messages)
+    remaining = history_budget
+    for index in range(len(compacted) - 1, -1, -1):
+        message = compacted[index]
+        if not isinstance(message, ToolMessage):
+            continue
+        text = _message_text(message)
+        if text is None:
+            continue
+        budget = max(min(message_budget, remaining), MIN_TOOL_MESSAGE_TOKENS)
+        content = compact_tool_output(text, budget, message.tool_call_id, store)
+        remaining = max(0, remaining - estimate_tokens(content))
+        if content != message.content:
+            compacted[index] = message.model_copy(update={'content': content})
+    return compacted
+
+
+def make_compaction_hook(
+    store: PayloadStore,
+    message_budget: int = DEFAULT_TOOL_MESSAGE_TOKEN_BUDGET,
+    history_budget: int = DEFAULT_TOOL_HISTORY_TOKEN_BUDGET,
+):
+    """
+    Creates a create_react_agent pre_model_hook that compacts tool messages.
+
+    Args:
+        store: The store the full results are kept in.
+        message_budget: Tokens one tool message may take.
+        history_budget: Tokens all tool messages together may take.
+
+    Returns:
+        The hook.
+    """
+
+    def compact_tool_messages(state: Dict[str, Any]) -> Dict[str, Any]:
+        messages = compact_messages(state['messages'], store, message_budget, history_budget)
+        return {'llm_input_messages': messages}
+
+    return compact_tool_messages
+
+
+def _continuation(offset: int) -> str:
+    return f'\n[Continues: call again with offset={offset}]'
+
+
+def make_read_tool_output_tool(
+    store: PayloadStore, max_tokens: int = DEFAULT_TOOL_MESSAGE_TOKEN_BUDGET
+) -> BaseTool:
+    """
+    Creates the tool the agent reads compacted tool results with.
+
+    A read, with the note of where it continues, fits in max_tokens, so the newest
+    read is never compacted itself when max_tokens is the message budget.
+
+    Args:
+        store: The store the full results are kept in.
+        max_tokens: Tokens one read may return.
+
+    Returns:
+        The tool.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+
+    def read_tool_output(ref: str, offset: int = 0) -> str:
+        payload = store.get(ref)
+        if payload is None:
+            return f'No tool output stored for ref {ref}'
+        offset = max(0, offset)
+        if len(payload) - offset <= max_chars:
+            return payload[offset:]
+        # Room for the continuation note, whose offset is at most the payload length
+        window = max(1, max_chars - len(_continuation(len(payload))))
+        end = offset + window
+        return payload[offset:end] + _continuation(end)
+
+    return StructuredTool.from_function(
+        read_tool_output,
+        name=READ_TOOL_OUTPUT,
+        description='Read the full result of a tool call that was compacted, by the ref in '
+        'its _compacted field. Long results are returned in parts: pass the offset given '
+        'at the end of a part to read the next one.',
+    )
@@ -0,0 +1,125 @@
+import json
+import unittest
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from tool_compaction import (
+    CHARS_PER_TOKEN,
+    MIN_TOOL_MESSAGE_TOKENS,
+    READ_TOOL_OUTPUT,
+    PayloadStore,
+    compact_messages,
+    compact_tool_output,
+    estimate_tokens,
+    make_read_tool_output_tool,
+)
+
+
+def search_result(count: int, body_chars: int) -> str:
+    emails = [
+        {
+            'id': f'id{index}',
+            'subject': f'Receipt {index}',
+            'sender': 'shop@example.com',
+            'date': '2025-04-25T10:00:00+00:00',
+            'body': 'x' * body_chars,
+        }
+        for index in range(count)
+    ]
+    return json.dumps({'emails': emails, 'next_cursor': 'abc'}, indent=2)
+
+
+class TestCompactToolOutput(unittest.TestCase):
+    def setUp(self):
+        self.store = PayloadStore()
+
+    def test_small_output_unchanged(self):
+        content = search_result(1, 10)
+        self.assertEqual(compact_tool_output(content, 1000, 'ref', self.store), content)
+        self.assertIsNone(self.store.get('ref'))
+
+    def test_shortens_bodies_and_keeps_every_email(self):
+        content = search_result(5, 4000)
+        compacted = compact_tool_output(content, 500, 'call-1', self.store)
+        self.assertLessEqual(estimate_tokens(compacted), 500)
+        data = json.loads(compacted)
+        self.assertEqual([email['id'] for email in data['emails']], [f'id{i}' for i in range(5)])
+        self.assertEqual(data['next_cursor'], 'abc')
+        self.assertEqual(data['_compacted']['ref'], 'call-1')
+        self.assertEqual(self.store.get('call-1'), content)
+
+    def test_drops_trailing_emails_when_bodies_are_not_enough(self):
+        compacted = compact_tool_output(search_result(100, 100), 300, 'call-2', self.store)
+        self.assertLessEqual(len(compacted), 300 * CHARS_PER_TOKEN)
+        data = json.loads(compacted)
+        self.assertEqual(data['emails'][0]['id'], 'id0')
+        self.assertEqual(len(data['emails']) + data['_compacted']['omitted_records'], 100)
+
+    def test_list_and_single_email_results(self):
+        emails = json.loads(search_result(3, 2000))['emails']
+        listed = json.loads(compact_tool_output(json.dumps(emails), 400, 'a', self.store))
+        self.assertEqual(len(listed['emails']), 3)
+        single = json.loads(compact_tool_output(json.dumps(emails[0]), 200, 'b', self.store))
+        self.assertEqual(single['id'], 'id0')
+        self.assertIn('_compacted', single)
+
+    def test_plain_text_is_cut(self):
+        compacted = compact_tool_output('y' * 10000, 100, 'c', self.store)
+        self.assertLessEqual(len(compacted), 100 * CHARS_PER_TOKEN)
+        self.assertIn('"ref": "c"', compacted)
+
+
+class TestCompactMessages(unittest.TestCase):
+    def test_newest_messages_get_the_budget_first(self):
+        store = PayloadStore()
+        messages = [HumanMessage('find receipts')]
+        for index in range(3):
+            messages.append(AIMessage(''))
+            messages.append(
+                ToolMessage(search_result(5, 2000), tool_call_id=f'call-{index}', name='search')
+            )
+        compacted = compact_messages(messages, store, message_budget=1000, history_budget=1500)
+
+        sizes = [estimate_tokens(message.content) for message in compacted[2::2]]
+        self.assertLessEqual(sizes[2], 1000)
+        self.assertLessEqual(sizes[1], 500)
+        self.assertLess(sizes[0], sizes[1])
+        # The history itself is left alone
+        self.assertEqual(messages[2].content, search_result(5, 2000))
+
+    def test_read_tool_output_counts_toward_the_budget(self):
+        store = PayloadStore()
+        store.put('ref', 'z' * 100000)
+        tool = make_read_tool_output_tool(store, max_tokens=1000)
+        messages = []
+        offset = 0
+        for index in range(5):
+            content = tool.invoke({'ref': 'ref', 'offset': offset})
+            offset = int(content.rsplit('offset=', 1)[1].rstrip(']'))
+            messages.append(
+                ToolMessage(content, tool_call_id=f'read-{index}', name=READ_TOOL_OUTPUT)
+            )
+        compacted = compact_messages(messages, store, message_budget=1000, history_budget=2500)
+
+        sizes = [estimate_tokens(message.content) for message in compacted]
+        self.assertLessEqual(sum(sizes), 2500 + 3 * MIN_TOOL_MESSAGE_TOKENS)
+        # The newest read fits its budget as it is, continuation note included
+        self.assertIs(compacted[-1], messages[-1])
+        self.assertLess(sizes[0], sizes[-1])
+
+
+class TestReadToolOutput(unittest.TestCase):
+    def test_reads_in_parts(self):
+        store = PayloadStore()
+        store.put('ref', 'a' * 500 + 'b' * 500)
+        tool = make_read_tool_output_tool(store, max_tokens=150)
+        first = tool.invoke({'ref': 'ref'})
+        self.assertLessEqual(len(first), 150 * CHARS_PER_TOKEN)
+        part, note = first.split('\n[Continues: call again with offset=')
+        self.assertEqual(note, f'{len(part)}]')
+        self.assertEqual(part, ('a' * 500 + 'b' * 500)[: len(part)])
+        self.assertEqual(tool.invoke({'ref': 'ref', 'offset': 600}), 'b' * 400)
+        self.assertIn('No tool output', tool.invoke({'ref': 'missing'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
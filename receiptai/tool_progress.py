@@ -0,0 +1,95 @@
+import logging
+from typing import Any, Optional, Union
+
+from mcp.server import Server
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Logger name partial results are sent under, so clients can tell them from other logs
+PARTIAL_RESULTS_LOGGER = 'gmail.partial-results'
+
+
+class ToolProgress:
+    """
+    Reports the progress and partial results of a running tool call to the MCP client.
+
+    Progress is sent as notifications/progress against the progressToken the client
+    put in the request's _meta. Partial results are sent as log messages while the
+    call is still running, so the client can start on the first results early. A
+    client that did not ask for progress gets neither.
+    """
+
+    def __init__(self, session: Any, progress_token: Optional[Union[str, int]]):
+        """
+        Initialize the progress reporter.
+
+        Args:
+            session: The MCP server session of the request.
+            progress_token: The progress token of the request, if the client sent one.
+        """
+        self.session = session
+        self.progress_token = progress_token
+        self.completed = 0
+        self.total: Optional[int] = None
+
+    @classmethod
+    def for_request(cls, server: Server) -> 'ToolProgress':
+        """
+        Creates a progress reporter for the request the server is currently handling.
+
+        Args:
+            server: The MCP server handling the tool call.
+
+        Returns:
+            The progress reporter; it does nothing if there is no request context.
+        """
+        try:
+            context = server.request_context
+        except LookupError:
+            return cls(None, None)
+        progress_token = context.meta.progressToken if context.meta else None
+        return cls(context.session, progress_token)
+
+    @property
+    def enabled(self) -> bool:
+        return self.session is not None and self.progress_token is not None
+
+    async def advance(self, completed: int = 1, total: Optional[int] = None):
+        """
+        Records more completed work and notifies the client.
+
+        Args:
+            completed: The number of items completed since the last call.
+            total: The total number of items, once it is known.
+        """
+        self.completed += completed
+        if total is not None:
+            self.total = total
+        if not self.enabled:
+            return
+        try:
+            await self.session.send_progress_notification(
+                self.progress_token, self.completed, self.total
+            )
+        except Exception as e:
+            # Progress is best effort and must never fail the tool call
+            logger.warning(f'Failed to send progress notification: {e}')
+
+    async def partial_result(self, data: Any):
+        """
+        Sends part of the tool result to the client ahead of the final response.
+
+        Args:
+            data: The JSON-serializable partial result.
+        """
+        if not self.enabled:
+            return
+        try:
+            await self.session.send_log_message(
+                'info',
+                {'progressToken': self.progress_token, 'partial_result': data},
+                logger=PARTIAL_RESULTS_LOGGER,
+            )
+        except Exception as e:
+            logger.warning(f'Failed to send partial result: {e}')
@@ -0,0 +1,57 @@
+import unittest
+
+from tool_progress import PARTIAL_RESULTS_LOGGER, ToolProgress
+
+
+class FakeSession:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.progress = []
+        self.logs = []
+
+    async def send_progress_notification(self, progress_token, progress, total=None):
+        if self.fail:
+            raise ConnectionError('client went away')
+        self.progress.append((progress_token, progress, total))
+
+    async def send_log_message(self, level, data, logger=None):
+        self.logs.append((level, data, logger))
+
+
+class TestToolProgress(unittest.IsolatedAsyncioTestCase):
+    async def test_reports_progress_and_partial_results(self):
+        session = FakeSession()
+        progress = ToolProgress(session, 'token-1')
+        await progress.advance(0, total=3)
+        await progress.advance(2)
+        await progress.partial_result([{'id': 'a'}, {'id': 'b'}])
+
+        self.assertEqual(session.progress, [('token-1', 0, 3), ('token-1', 2, 3)])
+        self.assertEqual(
+            session.logs,
+            [
+                (
+                    'info',
+                    {'progressToken': 'token-1', 'partial_result': [{'id': 'a'}, {'id': 'b'}]},
+                    PARTIAL_RESULTS_LOGGER,
+                )
+            ],
+        )
+
+    async def test_silent_without_progress_token(self):
+        session = FakeSession()
+        progress = ToolProgress(session, None)
+        await progress.advance(5)
+        await progress.partial_result({'id': 'a'})
+        self.assertEqual(progress.completed, 5)
+        self.assertEqual(session.progress, [])
+        self.assertEqual(session.logs, [])
+
+    async def test_notification_errors_do_not_fail_the_call(self):
+        progress = ToolProgress(FakeSession(fail=True), 'token-1')
+        await progress.advance(1)
+        self.assertEqual(progress.completed, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()